@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+"""
+File:         create_matrix_store.py
+Created:      2020/10/30
+Last Changed:
+Author:       M.Vochteloo
+
+Copyright (C) 2020 M.Vochteloo
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+A copy of the GNU General Public License can be found in the LICENSE file in the
+root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Standard imports.
+from __future__ import print_function
+import argparse
+import time
+import os
+
+# Third party imports.
+
+# Local application imports.
+from general.df_utilities import load_dataframe
+from general.matrix_store import find_matrix_store, get_store_path, \
+    save_matrix_store
+
+# Metadata
+__program__ = "Create Matrix Store"
+__author__ = "Martijn Vochteloo"
+__maintainer__ = "Martijn Vochteloo"
+__email__ = "m.vochteloo@rug.nl"
+__license__ = "GPLv3"
+__version__ = 1.0
+__description__ = "{} is a program developed and maintained by {}. " \
+                  "This program is licensed under the {} license and is " \
+                  "provided 'as-is' without any warranty or indemnification " \
+                  "of any kind.".format(__program__,
+                                        __author__,
+                                        __license__)
+
+"""
+Syntax:
+./create_matrix_store.py -m /path/to/genotype_table.txt.gz /path/to/expression_table.txt.gz
+"""
+
+
+class main():
+    def __init__(self):
+        # Get the command line arguments.
+        arguments = self.create_argument_parser()
+        self.matrices = getattr(arguments, 'matrices')
+        self.force = getattr(arguments, 'force')
+
+    @staticmethod
+    def create_argument_parser():
+        parser = argparse.ArgumentParser(prog=__program__,
+                                         description=__description__)
+
+        # Add optional arguments.
+        parser.add_argument("-v",
+                            "--version",
+                            action="version",
+                            version="{} {}".format(__program__,
+                                                   __version__),
+                            help="show program's version number and exit")
+        parser.add_argument("-m",
+                            "--matrices",
+                            nargs="+",
+                            type=str,
+                            required=True,
+                            help="The paths of the matrices (with header and "
+                                 "index column) to store.")
+        parser.add_argument("-f",
+                            "--force",
+                            action='store_true',
+                            help="Recreate stores that are up to date. "
+                                 "Default: False.")
+
+        return parser.parse_args()
+
+    def start(self):
+        self.print_arguments()
+
+        for inpath in self.matrices:
+            if not os.path.isfile(inpath):
+                print("File {} does not exist".format(inpath))
+                continue
+
+            store_path = get_store_path(inpath)
+            if not self.force and find_matrix_store(inpath) is not None:
+                print("{} is up to date".format(os.path.basename(store_path)))
+                continue
+
+            start_time = time.time()
+            print("Storing {}".format(os.path.basename(inpath)), flush=True)
+            df = load_dataframe(inpath, header=0, index_col=0)
+            save_matrix_store(df, store_path, source=inpath)
+            del df
+            print("\tCreated {} in {:.2f} second(s)".format(os.path.basename(store_path),
+                                                          time.time() - start_time),
+                  flush=True)
+
+    def print_arguments(self):
+        print("Arguments:")
+        print("  > Matrices: {}".format(", ".join(self.matrices)))
+        print("  > Force: {}".format(self.force))
+        print("")
+
+
+if __name__ == '__main__':
+    m = main()
+    m.start()
@@ -3,7 +3,7 @@
 """
 File:         custom_interaction_analyser.py
 Created:      2020/03/23
-Last Changed: 2020/06/08
+Last Changed: 2020/10/30
 Author:       M.Vochteloo
 
 Copyright (C) 2020 M.Vochteloo
@@ -55,13 +55,17 @@ if __name__ == '__main__':
     COMBINE = CLA.get_argument("combine")
 
     if COMBINE:
+        CORES = CLA.get_argument("cores")
+
         PROGRAM = CombineAndPlot(name=NAME,
-                                 settings_file=SETTINGS_FILE)
+                                 settings_file=SETTINGS_FILE,
+                                 cores=CORES)
         PROGRAM.start()
     else:
         SKIP_ROWS = CLA.get_argument("skip_rows")
         N_EQTLS = CLA.get_argument("n_eqtls")
         N_SAMPLES = CLA.get_argument("n_samples")
+        CORES = CLA.get_argument("cores")
         VERBOSE = CLA.get_argument("verbose")
 
         # Start the program.
@@ -70,5 +74,6 @@ if __name__ == '__main__':
                        skip_rows=SKIP_ROWS,
                        n_eqtls=N_EQTLS,
                        n_samples=N_SAMPLES,
+                       cores=CORES,
                        verbose=VERBOSE)
         PROGRAM.start()
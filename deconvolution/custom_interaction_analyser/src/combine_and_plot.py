@@ -1,7 +1,7 @@
 """
 File:         combine_and_plot.py
 Created:      2020/03/30
-Last Changed: 2020/06/09
+Last Changed: 2020/10/30
 Author:       M.Vochteloo
 
 Copyright (C) 2020 M.Vochteloo
@@ -23,7 +23,6 @@ root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
 # Standard imports.
 from __future__ import print_function
 from pathlib import Path
-from bisect import bisect_left
 from colour import Color
 from itertools import groupby, count
 import pickle
@@ -35,7 +34,6 @@ import os
 # Third party imports.
 import numpy as np
 import pandas as pd
-from scipy import stats
 import seaborn as sns
 import matplotlib
 matplotlib.use('Agg')
@@ -44,6 +42,9 @@ import matplotlib.pyplot as plt
 # Local application imports.
 from general.local_settings import LocalSettings
 from general.df_utilities import save_dataframe, get_basename
+from general.multiple_testing import calc_zscores, calc_bh_fdr, \
+    PermutationCounter
+from general.parallel_loading import imap_bounded, assemble_rows
 
 
 class CombineAndPlot:
@@ -51,13 +52,19 @@ class CombineAndPlot:
     Main: this class combines the output of different jobs of the manager into
         one result.
     """
-    def __init__(self, name, settings_file):
+    # The bins of the p-value distribution plots.
+    PVALUE_BINS = np.linspace(0, 1, 50)
+
+    def __init__(self, name, settings_file, cores=1):
         """
         Initializer of the class.
 
         :param name: string, the name of the base input/ouput directory.
         :param settings_file: string, the name of the settings file.
+        :param cores: int, the number of cores to read files with.
         """
+        self.cores = cores
+
         # Define the current directory.
         current_dir = str(Path(__file__).parent.parent)
 
@@ -132,16 +139,14 @@ class CombineAndPlot:
         # Get the pvalues from the dataframe.
         pvalues = pvalue_df.melt()["value"].values
 
-        print("Loading permutation pvalue data.", flush=True)
-        _, perm_pvalues = self.combine_pickles(workdir,
-                                               self.perm_pvalues_outfile)
-        # with open(os.path.join(workdir, "perm_pvalues.pkl"), "wb") as f:
-        #      pickle.dump(perm_pvalues, f)
-        # f.close()
+        print("Counting permutation pvalue data.", flush=True)
+        perm_counter, perm_bin_counts = self.count_perm_pvalues(workdir,
+                                                                self.perm_pvalues_outfile,
+                                                                pvalue_df.values)
 
         # Visualise distributions.
         print("Visualizing distributions.", flush=True)
-        self.plot_distributions(perm_pvalues, pvalues, workdir)
+        self.plot_distributions(perm_bin_counts, pvalues, workdir)
 
         # return
 
@@ -177,16 +182,14 @@ class CombineAndPlot:
                                             "interaction_table.txt.gz"),
                        header=True, index=True)
 
-        # Sort the lists.
+        # Sort the arrays.
         print("Sorting p-values.", flush=True)
-        perm_pvalues = sorted(perm_pvalues)
-        pvalues = sorted(pvalues)
+        pvalues = np.sort(pvalues[~np.isnan(pvalues)])
 
         # Create the FDR dataframes.
         print("Creating permutation FDR dataframe.", flush=True)
         perm_fdr_df, perm_cutoff = self.create_perm_fdr_df(pvalue_df,
-                                                           pvalues,
-                                                           perm_pvalues,
+                                                           perm_counter,
                                                            self.n_permutations)
         perm_n_signif = self.count_n_significant(pvalues, perm_cutoff)
         print("\tPermutation FDR: {} p-values < signif. cutoff "
@@ -199,7 +202,7 @@ class CombineAndPlot:
                        header=True, index=True)
 
         print("Creating Benjamini-Hochberg FDR dataframe.", flush=True)
-        bh_fdr_df, bh_cutoff = self.create_bh_fdr_df(pvalue_df, pvalues)
+        bh_fdr_df, bh_cutoff = self.create_bh_fdr_df(pvalue_df)
         bh_n_signif = self.count_n_significant(pvalues, bh_cutoff)
         print("\tBH FDR: {} p-values < signif. cutoff "
               "{:.2e} [{:.2f}%]".format(bh_n_signif, bh_cutoff,
@@ -216,75 +219,134 @@ class CombineAndPlot:
         self.compare_pvalue_scores(pvalue_df, perm_fdr_df, bh_fdr_df,
                                    workdir)
 
-    @staticmethod
-    def combine_pickles(indir, filename, columns=False):
+    def combine_pickles(self, indir, filename, columns=False):
         """
-        Method for combining the pickled lists into one nested list.
+        Method for combining the pickled lists. The files are read in
+        parallel with at most two files per core in flight.
 
         :param indir: string, the input directory containing the pickle files.
         :param filename: string, the prefix name of the input file.
         :param columns: boolean, whether or not each pickle file has a column.
         :return col_list: list, the columns of the content.
-        :return data: list, a nested list with the combined content.
+        :return data: list, (eqtl_indices, names, values) tuples per file
+                      if columns is True, else an ndarray with the combined
+                      content.
         """
-        # Declare variables.
+        fpaths = sorted(glob.glob(os.path.join(indir, filename,
+                                               filename + "*.pkl")))
+
+        # Load the found files, keeping the file order.
+        contents = [None] * len(fpaths)
+        for i, content in imap_bounded(self.load_pickle, fpaths,
+                                       n_workers=self.cores):
+            contents[i] = content
+        contents = [content for content in contents if content is not None]
+
+        if not columns:
+            if len(contents) == 0:
+                return None, np.array([], dtype=np.float64)
+            return None, np.concatenate([np.asarray(content, dtype=np.float64)
+                                         for content in contents])
+
         col_list = None
         data = []
-
-        # Combine the found files.
-        for i, fpath in enumerate(glob.glob(os.path.join(indir, filename,
-                                                         filename + "*.pkl"))):
-            with open(fpath, "rb") as f:
-                try:
-                    content = pickle.load(f)
-                    if columns and i == 0:
-                        col_list = content[0]
-                    data.extend(content[1:])
-                    # print("\tLoaded list: {} with length: {}".format(
-                    #     get_basename(fpath), len(content)))
-                except EOFError:
-                    print("\tEOFError in: {} ".format(get_basename(fpath)))
-            f.close()
+        for content in contents:
+            if col_list is None:
+                col_list = content[0]
+            rows = content[1:]
+            data.append(([row[0] for row in rows],
+                         [row[1] for row in rows],
+                         np.array([row[2:] for row in rows],
+                                  dtype=np.float64).reshape(len(rows), -1)))
 
         return col_list, data
 
+    def count_perm_pvalues(self, indir, filename, pvalues):
+        """
+        Method for streaming the pickled permuted p-values file by file
+        through a permutation counter and the distribution plot bins, so
+        they never have to be in memory at once.
+
+        :param indir: string, the input directory containing the pickle files.
+        :param filename: string, the prefix name of the input file.
+        :param pvalues: ndarray, the real p-values.
+        :return counter: PermutationCounter, the permutation counter.
+        :return bin_counts: ndarray, the number of permuted p-values per bin
+                            of PVALUE_BINS.
+        """
+        fpaths = sorted(glob.glob(os.path.join(indir, filename,
+                                               filename + "*.pkl")))
+
+        counter = PermutationCounter(pvalues)
+        bin_counts = np.zeros(len(self.PVALUE_BINS) - 1, dtype=np.int64)
+        for _, content in imap_bounded(self.load_pickle, fpaths,
+                                       n_workers=self.cores):
+            if content is None:
+                continue
+            perm_pvalues = np.asarray(content, dtype=np.float64)
+            counter.add(perm_pvalues)
+            bin_counts += self.count_bins(perm_pvalues)
+        print("\tCounted {} permutation p-values".format(counter.get_n_perm_pvalues()))
+
+        return counter, bin_counts
+
+    @staticmethod
+    def count_bins(values):
+        """
+        Method for counting values per bin of PVALUE_BINS. Like pd.cut the
+        bins are closed on the right and values outside of the bins or NaN
+        are not counted.
+
+        :param values: ndarray, the values.
+        :return : ndarray, the number of values per bin.
+        """
+        bins = CombineAndPlot.PVALUE_BINS
+        values = np.asarray(values, dtype=np.float64).ravel()
+        positions = np.searchsorted(bins, values[~np.isnan(values)],
+                                    side="left") - 1
+        positions = positions[(positions >= 0) & (positions < len(bins) - 1)]
+        return np.bincount(positions, minlength=len(bins) - 1)
+
+    @staticmethod
+    def load_pickle(fpath):
+        """
+        Method for loading a pickle file.
+
+        :param fpath: string, the pickle file.
+        :return content: the content, None on an EOFError.
+        """
+        content = None
+        with open(fpath, "rb") as f:
+            try:
+                content = pickle.load(f)
+            except EOFError:
+                print("\tEOFError in: {} ".format(get_basename(fpath)))
+        f.close()
+
+        return content
+
     def create_df(self, data, columns):
         """
-        Method for creating a pandas dataframe from a nested list.
+        Method for creating a pandas dataframe from the per file parts. The
+        rows are placed by eQTL index in a preallocated array, so missing
+        eQTLs are NaN rows and of duplicated eQTLs the first file wins.
 
-        :param data: list, a nested list with the data.
+        :param data: list, (eqtl_indices, names, values) tuples per file.
         :param columns: list, the column names.
         :return df: DataFrame, the created pandas dataframe.
         """
-        # Crate the data frame.
-        df = pd.DataFrame(data, columns=columns)
-        order_col = df.columns[0]
-        df.sort_values(by=order_col, inplace=True)
-        print("\tInput shape: {}".format(df.shape))
-
-        # Check what eQTLs are present, missing, duplicated.
-        reference = set(np.arange(df[order_col].min(), df[order_col].max() + 1))
-        present = set(df[order_col])
-        print("\tPresent indices: {}".format(self.group_consecutive_numbers(present)))
-        missing = list(set(df[order_col]).symmetric_difference(reference))
+        n_rows = sum(len(part[0]) for part in data)
+        print("\tInput shape: {}".format((n_rows, len(columns))))
+
+        eqtl_indices, names, values, missing, duplicated = \
+            assemble_rows(data, len(columns) - 2)
+        print("\tPresent indices: {}".format(self.group_consecutive_numbers(np.setdiff1d(eqtl_indices, missing))))
         print("\tMissing indices: {}".format(self.group_consecutive_numbers(missing)))
-        duplicated = list(df.loc[df.duplicated([order_col]), order_col].values)
         print("\tDuplicate indices: {}".format(self.group_consecutive_numbers(duplicated)))
 
-        # Remove duplicate eQTLs.
-        df.drop_duplicates(subset=order_col, keep="first", inplace=True)
-
-        # Insert missing eQTLs.
-        if len(missing) > 0:
-            print("\tInserting missing indices")
-            missing_df = pd.Series(missing).to_frame()
-            missing_df.columns = [order_col]
-            df = pd.concat([df, missing_df], axis=0).reset_index(drop=True)
-            df.sort_values(by=order_col, inplace=True)
-
-        # Remove the eQTL order column and set the SNPName as index.
-        df.drop([order_col], axis=1, inplace=True)
-        df.set_index("-", inplace=True)
+        # Set the SNPName as index.
+        df = pd.DataFrame(values, index=names, columns=columns[2:])
+        df.index.name = columns[1]
         df = df.T
         print("\tOutput shape: {}".format(df.shape))
 
@@ -296,64 +358,32 @@ class CombineAndPlot:
         tmp = [list(g) for k, g in groups]
         return [str(x[0]) if len(x) == 1 else "{}-{}".format(x[0], x[-1]) for x in tmp]
 
-    def create_zscore_df(self, df):
+    @staticmethod
+    def create_zscore_df(df):
         """
         Method for converting a dataframe of p-values to z-scores.
 
         :param df: DataFrame, a dataframe containing p-values.
         :return zscore_df: DataFrame, a dataframe containing z-scores
         """
-        count = 1
-        total = df.shape[0] * df.shape[1]
-
-        zscore_df = pd.DataFrame(np.nan, index=df.index, columns=df.columns)
-        for row_index in range(df.shape[0]):
-            for col_index in range(df.shape[1]):
-                if (count == 1) or (count % int(total / 10) == 0) or (count == total):
-                    print("\tworking on {}/{} [{:.2f}%]".format(count,
-                                                                total,
-                                                                (100 / total) * count))
-                pvalue = df.iloc[row_index, col_index]
-                zscore = self.get_z_score(pvalue)
-                zscore_df.iloc[row_index, col_index] = zscore
-                count += 1
-
-        return zscore_df
+        return pd.DataFrame(calc_zscores(df.values), index=df.index,
+                            columns=df.columns)
 
     @staticmethod
-    def get_z_score(p_value):
-        """
-        Method for converting a p-value to a z-score.
-
-        :param p-value: float, the p-value to convert.
-        :param z-score: float, the corresponding z-score.
-        """
-        if p_value > (1.0 - 1e-16):
-            p_value = (1.0 - 1e-16)
-        if p_value < 1e-323:
-            p_value = 1e-323
-
-        # The lower and upper limit of stats.norm.sf
-        # stats.norm.isf((1 - 1e-16)) = -8.209536151601387
-        # stats.norm.isf(1e-323) = 38.44939448087599
-        return stats.norm.isf(p_value)
-
-    @staticmethod
-    def plot_distributions(perm_pvalues, pvalues, outdir):
+    def plot_distributions(perm_bin_counts, pvalues, outdir):
         """
         Method for visualizing the distribution of the null and alternative
         p-values.
 
-        :param perm_pvalues: list, the sorted null model p-values.
+        :param perm_bin_counts: ndarray, the number of null model p-values
+                                per bin of PVALUE_BINS.
         :param pvalues: list, the sorted alternative model p-values.
         :param outdir: string, the output directory for the image.
         """
         # Create bins.
-        bins = np.linspace(0, 1, 50)
-        perm_pvalues_bins = pd.cut(perm_pvalues, bins=bins).value_counts().to_frame()
-        pvalues_bins = pd.cut(pvalues, bins=bins).value_counts().to_frame()
-        df = perm_pvalues_bins.merge(pvalues_bins, left_index=True, right_index=True)
-        df.columns = ["perm_pvalues", "pvalues"]
+        bins = CombineAndPlot.PVALUE_BINS
+        df = pd.DataFrame({"perm_pvalues": perm_bin_counts,
+                           "pvalues": CombineAndPlot.count_bins(pvalues)})
         df = df.divide(df.sum())
         lowest_row = df[df["pvalues"] == df["pvalues"].min()]
         scaler = lowest_row.iloc[0, 1] / lowest_row.iloc[0, 0]
@@ -420,50 +450,28 @@ class CombineAndPlot:
         plt.close()
 
     @staticmethod
-    def create_perm_fdr_df(df, pvalues, perm_pvalues, n_perm):
+    def create_perm_fdr_df(df, perm_counter, n_perm):
         """
         Method for creating the permutation False Discovery Rate dataframe.
 
-        FDR = (permutation rank / number of permutations) / actual rank
+        FDR = (# permuted p-values <= p-value / number of permutations) /
+              # p-values <= p-value
 
         :param df: DataFrame, the alternative p-value dataframe.
-        :param perm_pvalues: list, the sorted null model p-values.
-        :param pvalues: list, the sorted alternative model p-values.
+        :param perm_counter: PermutationCounter, the counted null model
+                             p-values.
         :param n_perm: int, the number of permutations performed.
         :return fdr_df: DataFrame, the permutation FDR dataframe.
+        :return max_signif_pvalue: float, the largest p-value with a
+                                   FDR < 0.05.
         """
-        count = 1
-        total = df.shape[0] * df.shape[1]
-
-        max_signif_pvalue = -np.inf
-
-        fdr_df = pd.DataFrame(np.nan, index=df.index, columns=df.columns)
-        for row_index in range(df.shape[0]):
-            for col_index in range(df.shape[1]):
-                if (count == 1) or (count % int(total / 10) == 0) or (count == total):
-                    print("\tworking on {}/{} [{:.2f}%]".format(count,
-                                                                total,
-                                                                (100 / total) * count))
-                pvalue = df.iloc[row_index, col_index]
-                rank = bisect_left(pvalues, pvalue)
-                perm_rank = bisect_left(perm_pvalues, pvalue)
-                if (rank > 0) and (perm_rank > 0):
-                    fdr_value = (perm_rank / n_perm) / rank
-                    if fdr_value > 1:
-                        fdr_value = 1
-                else:
-                    fdr_value = 0
-                fdr_df.iloc[row_index, col_index] = fdr_value
-
-                if fdr_value < 0.05 and pvalue > max_signif_pvalue:
-                    max_signif_pvalue = pvalue
-
-                count += 1
+        fdr = perm_counter.get_fdr(n_perm=n_perm)
+        fdr_df = pd.DataFrame(fdr, index=df.index, columns=df.columns)
 
-        return fdr_df, max_signif_pvalue
+        return fdr_df, CombineAndPlot.get_max_signif_pvalue(df.values, fdr)
 
     @staticmethod
-    def create_bh_fdr_df(df, pvalues):
+    def create_bh_fdr_df(df):
         """
         Method for creating the Benjamini-Hochberg False Discovery Rate
         dataframe.
@@ -471,68 +479,33 @@ class CombineAndPlot:
         FDR = p-value * (# p-values / rank)
 
         :param df: DataFrame, the alternative p-value dataframe.
-        :param pvalues: list, the sorted alternative model p-values.
         :return fdr_df: DataFrame, the Benjamini-Hochberg FDR dataframe.
+        :return max_signif_pvalue: float, the largest p-value with a
+                                   FDR < 0.05.
         """
-        count = 1
-        total = df.shape[0] * df.shape[1]
-
-        max_signif_pvalue = -np.inf
-
-        m = np.count_nonzero(~np.isnan(pvalues))
-        fdr_df = pd.DataFrame(np.nan, index=df.index, columns=df.columns)
-        fdr_values = []
-        for row_index in range(df.shape[0]):
-            for col_index in range(df.shape[1]):
-                if (count == 1) or (count % int(total / 10) == 0) or (count == total):
-                    print("\tworking on {}/{} [{:.2f}%]".format(count,
-                                                                total,
-                                                                (100 / total) * count))
-                pvalue = df.iloc[row_index, col_index]
-                rank = bisect_left(pvalues, pvalue) + 1
-                fdr_value = pvalue * (m / rank)
-                if fdr_value > 1:
-                    fdr_value = 1
-                fdr_values.append((rank, row_index, col_index, fdr_value))
-                fdr_df.iloc[row_index, col_index] = fdr_value
-
-                if fdr_value < 0.05 and pvalue > max_signif_pvalue:
-                    max_signif_pvalue = pvalue
-
-                count += 1
-
-        # Make sure the BH FDR is a monotome function. This goes through
-        # the FDR values backwords and make sure that the next FDR is always
-        # lower or equal to the previous.
-        fdr_values = sorted(fdr_values, key=lambda x: x[0], reverse=True)
-        prev_fdr_value = None
-        for (rank, row_index, col_index, fdr_value) in fdr_values:
-            if prev_fdr_value is not None and fdr_value > prev_fdr_value:
-                fdr_df.iloc[row_index, col_index] = prev_fdr_value
-                prev_fdr_value = prev_fdr_value
-            else:
-                prev_fdr_value = fdr_value
-
-        return fdr_df, max_signif_pvalue
+        fdr = calc_bh_fdr(df.values)
+        fdr_df = pd.DataFrame(fdr, index=df.index, columns=df.columns)
+
+        return fdr_df, CombineAndPlot.get_max_signif_pvalue(df.values, fdr)
+
+    @staticmethod
+    def get_max_signif_pvalue(pvalues, fdr, threshold=0.05):
+        signif = fdr < threshold
+        if not np.any(signif):
+            return -np.inf
+        return np.max(pvalues[signif])
 
     @staticmethod
     def count_n_significant(sorted_values, threshold):
         """
-        Method to count the number of values in a sorted list lower than
-        a certain threshhold.
+        Method to count the number of values in a sorted array lower than
+        or equal to a certain threshhold.
 
-        :param sorted_values: list, sorted list of numbers.
+        :param sorted_values: ndarray, sorted array of numbers.
         :param threshold: float, the cutoff to count the n values below.
-        :return i: int, the number of values < threshold
+        :return i: int, the number of values <= threshold
         """
-        count = 0
-        for value in sorted_values:
-            if value != np.nan:
-                count += 1
-                if value > threshold:
-                    break
-
-        return count
+        return int(np.searchsorted(sorted_values, threshold, side="right"))
 
     def compare_pvalue_scores(self, pvalue_df, perm_fdr, bh_fdr, outdir,
                               a=0.05):
@@ -663,6 +636,7 @@ class CombineAndPlot:
         print("Arguments:")
         print("  > Output directory: {}".format(self.outdir))
         print("  > N permutations: {}".format(self.n_permutations))
+        print("  > Cores: {}".format(self.cores))
         print(
             "  > Actual P-values output file: {}*.pkl".format(
                 self.pvalues_outfile))
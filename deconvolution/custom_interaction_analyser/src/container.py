@@ -1,7 +1,7 @@
 """
 File:         container.py
 Created:      2020/05/06
-Last Changed: 2020/06/02
+Last Changed: 2020/10/29
 Author:       M.Vochteloo
 
 Copyright (C) 2020 M.Vochteloo
@@ -23,69 +23,84 @@ root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
 # Standard imports.
 
 # Third party imports.
-
+import numpy as np
 
 # Local application imports.
 
 
 class Container:
-    def __init__(self, colnames):
-        # Initialize the result list.
-        self.pvalues_buffer = [[-1, "-"] + colnames]
-        self.snp_tvalues_buffer = [[-1, "-"] + colnames]
-        self.inter_tvalues_buffer = [[-1, "-"] + colnames]
-        self.perm_pvalues_buffer = []
-
-        # Initialize a new row.
-        self.pvalues = None
-        self.snp_tvalues = None
-        self.inter_tvalues = None
-        self.perm_pvalues = None
+    def __init__(self, colnames, n_rows, n_permutations, dtype=np.float64,
+                 perm_dtype=np.float64):
+        self.colnames = colnames
+        n_cols = len(colnames)
+
+        # Preallocate the result arrays. Rows that are never stored or that
+        # errored stay NaN.
+        self.eqtl_indices = np.full(n_rows, -1, dtype=np.int64)
+        self.names = np.empty(n_rows, dtype=object)
+        self.pvalues = np.full((n_rows, n_cols), np.nan, dtype=dtype)
+        self.snp_tvalues = np.full((n_rows, n_cols), np.nan, dtype=dtype)
+        self.inter_tvalues = np.full((n_rows, n_cols), np.nan, dtype=dtype)
+        self.perm_pvalues = np.full((n_rows, n_cols, n_permutations), np.nan,
+                                    dtype=perm_dtype)
+
+        # Initialize variables.
+        self.n_rows = 0
 
     def add_row(self, eqtl_index, genotype_name):
-        self.pvalues = [eqtl_index, genotype_name]
-        self.snp_tvalues = [eqtl_index, genotype_name]
-        self.inter_tvalues = [eqtl_index, genotype_name]
-
-        self.perm_pvalues = []
+        self.eqtl_indices[self.n_rows] = eqtl_index
+        self.names[self.n_rows] = genotype_name
 
     def store_row(self):
-        self.pvalues_buffer.append(self.pvalues)
-        self.snp_tvalues_buffer.append(self.snp_tvalues)
-        self.inter_tvalues_buffer.append(self.inter_tvalues)
-        self.perm_pvalues_buffer.extend(self.perm_pvalues)
-
-        self.pvalues = None
-        self.snp_tvalues = None
-        self.inter_tvalues = None
-        self.perm_pvalues = None
-
-    def add_pvalue(self, order_id, value):
+        self.n_rows = self.n_rows + 1
+
+    def clear_row(self):
+        self.pvalues[self.n_rows, :] = np.nan
+        self.snp_tvalues[self.n_rows, :] = np.nan
+        self.inter_tvalues[self.n_rows, :] = np.nan
+        self.perm_pvalues[self.n_rows, :, :] = np.nan
+
+    def extend(self, other):
+        start = self.n_rows
+        end = start + other.n_rows
+        self.eqtl_indices[start:end] = other.eqtl_indices[:other.n_rows]
+        self.names[start:end] = other.names[:other.n_rows]
+        self.pvalues[start:end] = other.pvalues[:other.n_rows]
+        self.snp_tvalues[start:end] = other.snp_tvalues[:other.n_rows]
+        self.inter_tvalues[start:end] = other.inter_tvalues[:other.n_rows]
+        self.perm_pvalues[start:end] = other.perm_pvalues[:other.n_rows]
+        self.n_rows = end
+
+    def add_pvalue(self, col_index, order_id, value):
         if order_id == 0:
-            self.pvalues.append(value)
+            self.pvalues[self.n_rows, col_index] = value
         else:
-            self.perm_pvalues.append(value)
+            self.perm_pvalues[self.n_rows, col_index, order_id - 1] = value
 
-    def add_snp_tvalue(self, order_id, value):
+    def add_snp_tvalue(self, col_index, order_id, value):
         if order_id == 0:
-            self.snp_tvalues.append(value)
-        else:
-            pass
+            self.snp_tvalues[self.n_rows, col_index] = value
 
-    def add_inter_tvalue(self, order_id, value):
+    def add_inter_tvalue(self, col_index, order_id, value):
         if order_id == 0:
-            self.inter_tvalues.append(value)
-        else:
-            pass
+            self.inter_tvalues[self.n_rows, col_index] = value
+
+    def to_table(self, values):
+        table = [[-1, "-"] + self.colnames]
+        table.extend([[index, name] + row for index, name, row in
+                      zip(self.eqtl_indices[:self.n_rows].tolist(),
+                          self.names[:self.n_rows].tolist(),
+                          values[:self.n_rows].tolist())])
+        return table
 
     def get_pvalues(self):
-        return self.pvalues_buffer
+        return self.to_table(self.pvalues)
 
     def get_snp_tvalues(self):
-        return self.snp_tvalues_buffer
+        return self.to_table(self.snp_tvalues)
 
     def get_inter_tvalues(self):
-        return self.inter_tvalues_buffer
+        return self.to_table(self.inter_tvalues)
 
     def get_perm_pvalues(self):
-        return self.perm_pvalues_buffer
\ No newline at end of file
+        return self.perm_pvalues[:self.n_rows].ravel().tolist()
@@ -24,6 +24,7 @@ root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
 from __future__ import print_function
 from pathlib import Path
 from datetime import datetime
+import multiprocessing as mp
 import pickle
 import random
 import time
@@ -39,10 +40,18 @@ from functools import reduce
 
 # Local application imports.
 from .storage import Storage
+from .qr_model import QRModel
 from general.local_settings import LocalSettings
 from general.utilities import check_file_exists, prepare_output_dir
 from general.df_utilities import load_dataframe
 
+# The Main instance that forked worker processes work on.
+_MAIN = None
+
+
+def _process_eqtl(row_index):
+    return _MAIN.process_eqtl(row_index)
+
 
 class Main:
     """
@@ -50,7 +59,7 @@ class Main:
     """
 
     def __init__(self, name, settings_file, skip_rows, n_eqtls, n_samples,
-                 verbose):
+                 cores, verbose):
         """
         Initializer of the class.
 
@@ -90,11 +99,18 @@ class Main:
         self.inter_tvalues_filename = settings.get_setting("inter_tvalues_pickle_filename")
         self.perm_pvalues_filename = settings.get_setting("permuted_pvalues_pickle_filename")
         self.n_permutations = settings.get_setting("n_permutations")
+        self.perm_pvalues_dtype = settings.get_setting("perm_pvalues_dtype")
+        if self.perm_pvalues_dtype is None:
+            self.perm_pvalues_dtype = "float64"
+        self.fitting_mode = settings.get_setting("fitting_mode")
+        if self.fitting_mode is None:
+            self.fitting_mode = "statsmodels"
         self.max_end_time = int(time.time()) + settings.get_setting("max_runtime_in_hours") * 60 * 60
         self.panic_time = self.max_end_time - (settings.get_setting("panic_time_in_min") * 60)
         self.skip_rows = skip_rows
         self.n_eqtls = n_eqtls
         self.n_samples = n_samples
+        self.cores = cores
         self.verbose = verbose
 
     def start(self):
@@ -178,7 +194,7 @@ class Main:
                                     int(run_time_min),
                                     int(run_time_sec)))
         print("Received {:.2f} analyses per minute".format((self.n_eqtls * (self.n_permutations + 1)) /
-                                                           (run_time / 60)))
+                                                           (max(run_time, 1) / 60)))
 
         # Shutdown the manager.
         print("Shutting down manager [{}]".format(
@@ -226,165 +242,285 @@ class Main:
                 tech_cov_names.append(rowname)
             else:
                 cov_names.append(rowname)
-        storage = Storage(tech_covs=tech_cov_names, covs=cov_names)
+        storage = Storage(tech_covs=tech_cov_names, covs=cov_names,
+                          n_rows=geno_df.shape[0],
+                          n_permutations=len(permutation_orders) - 1,
+                          perm_dtype=self.perm_pvalues_dtype)
         storage.print_info()
 
+        # Safe the data on the instance. Worker processes are forked and
+        # share these objects read-only (copy-on-write) instead of having
+        # them pickled per task.
+        self.cov_df = cov_df
+        self.tech_cov_df = tech_cov_df
+        self.geno_df = geno_df
+        self.expr_df = expr_df
+        self.tech_cov_names = tech_cov_names
+        self.cov_names = cov_names
+        self.permutation_orders = permutation_orders
+
         # Start working.
         print("Starting interaction analyser", flush=True)
-        for row_index, eqtl_index in enumerate([i for i in
-                                                range(self.skip_rows,
-                                                      self.skip_rows +
-                                                      self.n_eqtls)]):
+        n_rows = geno_df.shape[0]
+        pool = None
+        if self.cores > 1:
+            print("\tUsing {} cores".format(self.cores), flush=True)
+            global _MAIN
+            _MAIN = self
+            pool = mp.get_context("fork").Pool(processes=self.cores)
+            results = pool.imap(_process_eqtl, range(n_rows))
+        else:
+            results = (self.process_eqtl(row_index) for row_index in range(n_rows))
+
+        for row_index, eqtl_storage in enumerate(results):
             print("\tProcessing eQTL {}/{} "
                   "[{:.0f}%]".format(row_index + 1,
-                                     self.n_eqtls,
-                                     (100 / self.n_eqtls) * (row_index + 1)),
+                                     n_rows,
+                                     (100 / n_rows) * (row_index + 1)),
                   flush=True)
 
-            # Get the complete genotype row for the permutation later.
-            genotype_all = geno_df.iloc[row_index, :].copy()
-
-            # Get the missing genotype indices.
-            indices = np.arange(geno_df.shape[1])
-            eqtl_indices = indices[~geno_df.iloc[row_index, :].isnull().values]
-
-            # Subset the row and present samples for this eQTL.
-            genotype = geno_df.iloc[row_index, eqtl_indices].copy()
-            expression = expr_df.iloc[row_index, eqtl_indices].copy()
-            technical_covs = tech_cov_df.iloc[:, eqtl_indices].copy()
-            covariates = cov_df.iloc[:, eqtl_indices].copy()
-
-            # Create the null model. Null model are all the technical
-            # covariates multiplied with the genotype + the SNP.
-            tech_inter_matrix = technical_covs.mul(genotype, axis=1)
-            tech_inter_matrix.index = ["{}_X_SNP".format(x) for x in
-                                       technical_covs.index]
-            intercept = pd.DataFrame(1, index=genotype.index,
-                                     columns=["intercept"])
-            base_matrix = reduce(lambda left, right: pd.merge(left,
-                                                              right,
-                                                              left_index=True,
-                                                              right_index=True),
-                                 [intercept,
-                                  genotype.to_frame(),
-                                  technical_covs.T,
-                                  tech_inter_matrix.T])
-
-            # Initialize variables.
-            storage.add_row(eqtl_index, genotype.name)
-
-            # Loop over the covariates.
-            for cov_index in range(len(cov_df.index)):
+            # Merge the results of the eQTL.
+            storage.merge(eqtl_storage)
+
+            # Check whether we are almost running out of time.
+            if time.time() > self.panic_time:
+                print("\tPanic!!!", flush=True)
+                break
+
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+        return storage
+
+    def process_eqtl(self, row_index):
+        """
+        Method that does the interaction analysis of one eQTL.
+
+        :param row_index: int, the row index of the eQTL in the input
+                          data frames.
+        :return storage: object, a storage object containing the results of
+                         this eQTL.
+        """
+        eqtl_index = self.skip_rows + row_index
+        storage = Storage(tech_covs=self.tech_cov_names, covs=self.cov_names,
+                          n_rows=1,
+                          n_permutations=len(self.permutation_orders) - 1,
+                          perm_dtype=self.perm_pvalues_dtype)
+
+        # Get the complete genotype row for the permutation later.
+        genotype_all = self.geno_df.iloc[row_index, :].copy()
+
+        # Get the missing genotype indices.
+        indices = np.arange(self.geno_df.shape[1])
+        eqtl_indices = indices[~self.geno_df.iloc[row_index, :].isnull().values]
+
+        # Subset the row and present samples for this eQTL.
+        genotype = self.geno_df.iloc[row_index, eqtl_indices].copy()
+        expression = self.expr_df.iloc[row_index, eqtl_indices].copy()
+        technical_covs = self.tech_cov_df.iloc[:, eqtl_indices].copy()
+        covariates = self.cov_df.iloc[:, eqtl_indices].copy()
+
+        # Create the null model. Null model are all the technical
+        # covariates multiplied with the genotype + the SNP.
+        tech_inter_matrix = technical_covs.mul(genotype, axis=1)
+        tech_inter_matrix.index = ["{}_X_SNP".format(x) for x in
+                                   technical_covs.index]
+        intercept = pd.DataFrame(1, index=genotype.index,
+                                 columns=["intercept"])
+        base_matrix = reduce(lambda left, right: pd.merge(left,
+                                                          right,
+                                                          left_index=True,
+                                                          right_index=True),
+                             [intercept,
+                              genotype.to_frame(),
+                              technical_covs.T,
+                              tech_inter_matrix.T])
+
+        # Initialize variables.
+        storage.add_row(eqtl_index, genotype.name)
+
+        # Factorise the base model once for this eQTL.
+        base_model = None
+        if self.fitting_mode == "qr":
+            base_model = QRModel(base_matrix.values.astype(np.float64),
+                                 expression.values.astype(np.float64))
+
+        # Loop over the covariates.
+        for cov_index in range(len(self.cov_df.index)):
+            if storage.has_error():
+                break
+
+            # Get the covariate we are processing.
+            covariate = covariates.iloc[cov_index, :]
+            cov_name = covariate.name
+
+            if self.verbose:
+                print("\t\tWorking on '{}'".format(cov_name), flush=True)
+
+            # Add the covariate to the null matrix if it isn't already.
+            null_matrix = base_matrix.copy()
+            if cov_name not in null_matrix.columns:
+                covariate_df = covariate.copy()
+                null_matrix = null_matrix.merge(covariate_df.to_frame(),
+                                                left_index=True,
+                                                right_index=True)
+
+            if base_model is not None and base_model.is_full_rank():
+                null_model = base_model
+                if cov_name not in base_matrix.columns:
+                    null_model = base_model.add_column(covariate.values.astype(np.float64))
+
+                if null_model.is_full_rank():
+                    self.test_covariate_qr(cov_name,
+                                           null_model,
+                                           null_matrix,
+                                           expression,
+                                           genotype,
+                                           self.cov_df.iloc[cov_index, :].values.astype(np.float64),
+                                           genotype_all.values.astype(np.float64),
+                                           eqtl_indices,
+                                           self.permutation_orders,
+                                           storage)
+
+                    continue
+
+            # Create the null model.
+            n_null = null_matrix.shape[0]
+            df_null, rss_null, _ = self.create_model(null_matrix,
+                                                     expression)
+
+            # if self.verbose:
+            #     print("\t\tn_null: {}\tdf_null: {}\trss_null: {}\t".format(n_null, df_null, rss_null))
+
+            # Loop over each permutation sample order. The first order
+            # is the normal order and the remainder are random shuffles.
+            for order_id, sample_order in enumerate(self.permutation_orders):
                 if storage.has_error():
                     break
 
-                # Get the covariate we are processing.
-                covariate = covariates.iloc[cov_index, :]
-                cov_name = covariate.name
-
                 if self.verbose:
-                    print("\t\tWorking on '{}'".format(cov_name), flush=True)
+                    print("\t\t\tWorking on 'order_{}'".format(order_id),
+                          flush=True)
+
+                # Reorder the covariate based on the sample order.
+                # Make sure the labels are in the same order, just
+                # shuffle the values.
+                covariate_all = self.cov_df.iloc[cov_index, :].copy()
+                covariate_all_index = covariate_all.index
+                covariate_all = covariate_all.reindex(
+                    covariate_all.index[sample_order])
+                covariate_all.index = covariate_all_index
+
+                # Calculate the interaction effect of the covariate of
+                # interest. Then drop the NA's from the interaction
+                # term.
+                inter_of_interest = covariate_all * genotype_all
+                inter_name = "{}_X_SNP".format(cov_name)
+                if inter_name in null_matrix.columns:
+                    inter_name = inter_name + "_2"
+                inter_of_interest.name = inter_name
+                inter_of_interest = inter_of_interest.iloc[eqtl_indices]
+
+                # Check if the drop is identical (see above).
+                if not inter_of_interest.index.equals(null_matrix.index):
+                    print("\t\t\tError in permutation reordering "
+                          "(ID: {})".format(order_id), flush=True)
+                    storage.set_error()
+                    continue
+
+                # Create the alternative matrix and add the interaction
+                # term.
+                alt_matrix = null_matrix.copy()
+                alt_matrix = alt_matrix.merge(inter_of_interest.to_frame(),
+                                              left_index=True,
+                                              right_index=True)
+
+                # Create the alternative model.
+                n_alt = alt_matrix.shape[0]
+                df_alt, rss_alt, alt_tvalues = self.create_model(alt_matrix,
+                                                                 expression,
+                                                                 tvalue_cols=[genotype.name, inter_name])
+
+                # if self.verbose:
+                #     print("\t\t\tn_alt: {}\tdf_alt: {}\trss_alt: {}\talt_tvalues: {}".format(n_alt, df_alt, rss_alt, alt_tvalues))
 
-                # Add the covariate to the null matrix if it isn't already.
-                null_matrix = base_matrix.copy()
-                if cov_name not in null_matrix.columns:
-                    covariate_df = covariate.copy()
-                    null_matrix = null_matrix.merge(covariate_df.to_frame(),
-                                                    left_index=True,
-                                                    right_index=True)
+                # Safe the t-values.
+                storage.add_value(cov_name, order_id, "snp_tvalue", alt_tvalues[genotype.name])
+                storage.add_value(cov_name, order_id, "inter_tvalue", alt_tvalues[inter_name])
 
-                # Create the null model.
-                n_null = null_matrix.shape[0]
-                df_null, rss_null, _ = self.create_model(null_matrix,
-                                                         expression)
+                # Make sure the n's are identical.
+                if n_null != n_alt:
+                    print("\t\t\tError due to unequal n_null and n_alt",
+                          flush=True)
+                    storage.set_error()
+                    continue
+
+                # Compare the null and alternative model.
+                fvalue = self.calc_f_value(rss_null, rss_alt,
+                                           df_null, df_alt, n_null)
+                pvalue = self.get_p_value(fvalue, df_null, df_alt, n_null)
 
                 # if self.verbose:
-                #     print("\t\tn_null: {}\tdf_null: {}\trss_null: {}\t".format(n_null, df_null, rss_null))
+                #     print("\t\t\tfvalue: {}\tpvalue: {}".format(fvalue, pvalue))
 
-                # Loop over each permutation sample order. The first order
-                # is the normal order and the remainder are random shuffles.
-                for order_id, sample_order in enumerate(permutation_orders):
-                    if storage.has_error():
-                        break
+                # Safe the p-values.
+                storage.add_value(cov_name, order_id, "pvalue", pvalue)
 
-                    if self.verbose:
-                        print("\t\t\tWorking on 'order_{}'".format(order_id),
-                              flush=True)
-
-                    # Reorder the covariate based on the sample order.
-                    # Make sure the labels are in the same order, just
-                    # shuffle the values.
-                    covariate_all = cov_df.iloc[cov_index, :].copy()
-                    covariate_all_index = covariate_all.index
-                    covariate_all = covariate_all.reindex(
-                        covariate_all.index[sample_order])
-                    covariate_all.index = covariate_all_index
-
-                    # Calculate the interaction effect of the covariate of
-                    # interest. Then drop the NA's from the interaction
-                    # term.
-                    inter_of_interest = covariate_all * genotype_all
-                    inter_name = "{}_X_SNP".format(cov_name)
-                    if inter_name in null_matrix.columns:
-                        inter_name = inter_name + "_2"
-                    inter_of_interest.name = inter_name
-                    inter_of_interest = inter_of_interest.iloc[eqtl_indices]
-
-                    # Check if the drop is identical (see above).
-                    if not inter_of_interest.index.equals(null_matrix.index):
-                        print("\t\t\tError in permutation reordering "
-                              "(ID: {})".format(order_id), flush=True)
-                        storage.set_error()
-                        continue
-
-                    # Create the alternative matrix and add the interaction
-                    # term.
-                    alt_matrix = null_matrix.copy()
-                    alt_matrix = alt_matrix.merge(inter_of_interest.to_frame(),
-                                                  left_index=True,
-                                                  right_index=True)
-
-                    # Create the alternative model.
-                    n_alt = alt_matrix.shape[0]
-                    df_alt, rss_alt, alt_tvalues = self.create_model(alt_matrix,
-                                                                     expression,
-                                                                     tvalue_cols=[genotype.name, inter_name])
-
-                    # if self.verbose:
-                    #     print("\t\t\tn_alt: {}\tdf_alt: {}\trss_alt: {}\talt_tvalues: {}".format(n_alt, df_alt, rss_alt, alt_tvalues))
-
-                    # Safe the t-values.
-                    storage.add_value(cov_name, order_id, "snp_tvalue", alt_tvalues[genotype.name])
-                    storage.add_value(cov_name, order_id, "inter_tvalue", alt_tvalues[inter_name])
-
-                    # Make sure the n's are identical.
-                    if n_null != n_alt:
-                        print("\t\t\tError due to unequal n_null and n_alt",
-                              flush=True)
-                        storage.set_error()
-                        continue
-
-                    # Compare the null and alternative model.
-                    fvalue = self.calc_f_value(rss_null, rss_alt,
-                                               df_null, df_alt, n_null)
-                    pvalue = self.get_p_value(fvalue, df_null, df_alt, n_null)
-
-                    # if self.verbose:
-                    #     print("\t\t\tfvalue: {}\tpvalue: {}".format(fvalue, pvalue))
-
-                    # Safe the p-values.
-                    storage.add_value(cov_name, order_id, "pvalue", pvalue)
-
-                    # Check whether we are almost running out of time.
-                    if time.time() > self.panic_time:
-                        print("\tPanic!!!", flush=True)
-                        return storage
-
-            # Safe the results of the eQTL.
-            storage.store_row()
+        # Safe the results of the eQTL.
+        storage.store_row()
 
         return storage
 
+    def test_covariate_qr(self, cov_name, null_model, null_matrix, expression,
+                          genotype, covariate_all, genotype_all, eqtl_indices,
+                          permutation_orders, storage):
+        """
+        Method that tests all permutation orders of one covariate using
+        the QR factorisation of the null model. Interaction columns that
+        are (nearly) collinear with the null model are fitted with the
+        statsmodels reference instead.
+
+        :param cov_name: string, the name of the covariate.
+        :param null_model: QRModel, the factorised null model.
+        :param null_matrix: DataFrame, the null model matrix.
+        :param expression: Series, the expression of the present samples.
+        :param genotype: Series, the genotype of the present samples.
+        :param covariate_all: ndarray, the covariate of all samples.
+        :param genotype_all: ndarray, the genotype of all samples.
+        :param eqtl_indices: ndarray, the indices of the present samples.
+        :param permutation_orders: list, the sample orders.
+        :param storage: object, the storage object.
+        """
+        # Create the interaction terms of all sample orders.
+        orders = np.array(permutation_orders, dtype=np.intp)[:, eqtl_indices]
+        inter_matrix = covariate_all[orders] * genotype_all[eqtl_indices]
+
+        snp_index = list(null_matrix.columns).index(genotype.name)
+        pvalues, snp_tvalues, inter_tvalues, degenerate = \
+            null_model.test_columns(inter_matrix, snp_index)
+
+        n = null_matrix.shape[0]
+        df_null, rss_null = null_matrix.shape[1], null_model.get_rss()
+        for order_id in np.flatnonzero(degenerate):
+            inter_name = "{}_X_SNP".format(cov_name)
+            if inter_name in null_matrix.columns:
+                inter_name = inter_name + "_2"
+            alt_matrix = null_matrix.copy()
+            alt_matrix[inter_name] = inter_matrix[order_id, :]
+            df_alt, rss_alt, alt_tvalues = self.create_model(alt_matrix,
+                                                             expression,
+                                                             tvalue_cols=[genotype.name, inter_name])
+            fvalue = self.calc_f_value(rss_null, rss_alt, df_null, df_alt, n)
+            pvalues[order_id] = self.get_p_value(fvalue, df_null, df_alt, n)
+            snp_tvalues[order_id] = alt_tvalues[genotype.name]
+            inter_tvalues[order_id] = alt_tvalues[inter_name]
+
+        for order_id in range(len(permutation_orders)):
+            storage.add_value(cov_name, order_id, "snp_tvalue", snp_tvalues[order_id])
+            storage.add_value(cov_name, order_id, "inter_tvalue", inter_tvalues[order_id])
+            storage.add_value(cov_name, order_id, "pvalue", pvalues[order_id])
+
     @staticmethod
     def load_pickle(fpath):
         """
@@ -600,10 +736,13 @@ class Main:
         print("  > Technical covariates: {}".format(self.tech_covs))
         print("  > Output directory: {}".format(self.outdir))
         print("  > Permutations: {}".format(self.n_permutations))
+        print("  > Permutation p-value dtype: {}".format(self.perm_pvalues_dtype))
+        print("  > Fitting mode: {}".format(self.fitting_mode))
         print("  > Panic datetime: {}".format(panic_time_string))
         print("  > Max end datetime: {}".format(end_time_string))
         print("  > Skip rows: {}".format(self.skip_rows))
         print("  > EQTLs: {}".format(self.n_eqtls))
         print("  > Samples: {}".format(self.n_samples))
+        print("  > Cores: {}".format(self.cores))
         print("  > Verbose: {}".format(self.verbose))
         print("", flush=True)
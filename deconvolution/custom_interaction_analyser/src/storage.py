@@ -1,7 +1,7 @@
 """
 File:         storage.py
 Created:      2020/05/06
-Last Changed: 2020/06/02
+Last Changed: 2020/10/29
 Author:       M.Vochteloo
 
 Copyright (C) 2020 M.Vochteloo
@@ -23,20 +23,25 @@ root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
 # Standard imports.
 
 # Third party imports.
-
+import numpy as np
 
 # Local application imports.
 from .container import Container
 
 
 class Storage:
-    def __init__(self, tech_covs, covs):
+    def __init__(self, tech_covs, covs, n_rows, n_permutations,
+                 perm_dtype=np.float64):
         self.tech_covs = tech_covs
         self.covs = covs
+        self.tech_cov_indices = {name: i for i, name in enumerate(tech_covs)}
+        self.cov_indices = {name: i for i, name in enumerate(covs)}
 
         # Initialize containers.
-        self.tech_cov_container = Container(tech_covs)
-        self.cov_container = Container(covs)
+        self.tech_cov_container = Container(tech_covs, n_rows, n_permutations,
+                                            perm_dtype=perm_dtype)
+        self.cov_container = Container(covs, n_rows, n_permutations,
+                                       perm_dtype=perm_dtype)
 
         # Initialize variables.
         self.error = False
@@ -46,28 +51,35 @@ class Storage:
         self.cov_container.add_row(eqtl_index, genotype_name)
 
     def store_row(self):
-        if not self.error:
-            self.tech_cov_container.store_row()
-            self.cov_container.store_row()
-        else:
-            print("Row not saved due to error.")
+        if self.error:
+            print("Row saved as NaN due to error.")
+            self.tech_cov_container.clear_row()
+            self.cov_container.clear_row()
+        self.tech_cov_container.store_row()
+        self.cov_container.store_row()
+
+    def merge(self, other):
+        self.tech_cov_container.extend(other.get_tech_cov_container())
+        self.cov_container.extend(other.get_cov_container())
 
     def add_value(self, cov_name, order_id, category, value):
-        if cov_name in self.tech_covs:
+        if cov_name in self.tech_cov_indices:
             container = self.tech_cov_container
-        elif cov_name in self.covs:
+            col_index = self.tech_cov_indices[cov_name]
+        elif cov_name in self.cov_indices:
             container = self.cov_container
+            col_index = self.cov_indices[cov_name]
         else:
             print("Unrecognised covariate name.")
             self.error = True
             return
 
         if category == "snp_tvalue":
-            container.add_snp_tvalue(order_id, value)
+            container.add_snp_tvalue(col_index, order_id, value)
         elif category == "inter_tvalue":
-            container.add_inter_tvalue(order_id, value)
+            container.add_inter_tvalue(col_index, order_id, value)
         elif category == "pvalue":
-            container.add_pvalue(order_id, value)
+            container.add_pvalue(col_index, order_id, value)
         else:
             print("Unrecognised value category.")
             self.error = True
@@ -0,0 +1,408 @@
+"""
+File:         bgzf.py
+Created:      2020/10/29
+Last Changed: 2020/10/30
+Author:       M.Vochteloo
+
+Copyright (C) 2020 M.Vochteloo
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+A copy of the GNU General Public License can be found in the LICENSE file in the
+root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Standard imports.
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import struct
+import gzip
+import zlib
+import io
+import os
+
+# Third party imports.
+
+# Local application imports.
+
+# Minimal BGZF (blocked gzip) reader and writer. A BGZF file is a series of
+# gzip members of at most 64 KiB that each store their compressed size, so
+# any gzip reader can read it while a position in the uncompressed data can
+# be addressed with a virtual offset:
+# (start of the compressed block << 16) | offset within the block.
+# The blocks are compressed independently, so the writer compresses and the
+# line reader decompresses several blocks at the same time (zlib releases
+# the GIL). The number of threads is given per call or with
+# DECON_BGZF_THREADS (default: the number of cores, at most 4); the output
+# does not depend on the number of threads.
+
+# Maximum number of uncompressed bytes per block (as used by htslib).
+BLOCK_SIZE = 0xff00
+
+# The fixed header of a block; the last two bytes (BSIZE) are block specific.
+HEADER = b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43\x02\x00"
+HEADER_SIZE = 18
+FOOTER_SIZE = 8
+
+# The empty block that marks the end of a BGZF file.
+EOF_BLOCK = b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43" \
+            b"\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+
+THREADS_ENV = "DECON_BGZF_THREADS"
+DEFAULT_MAX_THREADS = 4
+
+
+def get_threads(threads=None):
+    """
+    Method for getting the number of compression threads.
+
+    :param threads: int, the number of threads; None uses DECON_BGZF_THREADS
+                    or the number of cores (at most 4).
+    :return : int, the number of threads.
+    """
+    if threads is None:
+        threads = os.environ.get(THREADS_ENV)
+        if threads is None or threads == "":
+            threads = min(os.cpu_count() or 1, DEFAULT_MAX_THREADS)
+    return max(1, int(threads))
+
+
+def make_virtual_offset(block_start, within_block):
+    return (block_start << 16) | within_block
+
+
+def split_virtual_offset(virtual_offset):
+    return virtual_offset >> 16, virtual_offset & 0xffff
+
+
+def is_bgzf(fpath):
+    with open(fpath, "rb") as f:
+        header = f.read(HEADER_SIZE)
+    f.close()
+
+    return len(header) == HEADER_SIZE and header[:16] == HEADER
+
+
+def compress_block(data, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    bsize = HEADER_SIZE + len(cdata) + FOOTER_SIZE
+    return HEADER + struct.pack("<H", bsize - 1) + cdata + \
+           struct.pack("<II", zlib.crc32(data) & 0xffffffff, len(data))
+
+
+def decompress_block(block):
+    """
+    Method for decompressing a block as read by read_raw_blocks.
+
+    :param block: tuple, (block start, compressed data, crc, size).
+    :return : bytes, the uncompressed data.
+    """
+    block_start, cdata, crc, isize = block
+    data = zlib.decompress(cdata, -15)
+    if len(data) != isize or zlib.crc32(data) & 0xffffffff != crc:
+        raise ValueError("Corrupt BGZF block at offset "
+                         "{}".format(block_start))
+    return data
+
+
+def read_raw_blocks(fh):
+    """
+    Generator returning the compressed blocks of a BGZF file without
+    decompressing them; the block sizes are taken from the headers.
+
+    :param fh: file, the BGZF file opened in binary mode.
+    :return : generator of (block start, compressed data, crc, size) tuples.
+    """
+    block_start = fh.tell()
+    while True:
+        header = fh.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE:
+            break
+        if header[:16] != HEADER:
+            raise ValueError("Invalid BGZF block at offset "
+                             "{}".format(block_start))
+
+        bsize = struct.unpack("<H", header[16:])[0] + 1
+        cdata = fh.read(bsize - HEADER_SIZE - FOOTER_SIZE)
+        footer = fh.read(FOOTER_SIZE)
+        if len(footer) < FOOTER_SIZE:
+            raise ValueError("Truncated BGZF block at offset "
+                             "{}".format(block_start))
+        crc, isize = struct.unpack("<II", footer)
+        yield block_start, cdata, crc, isize
+        block_start += bsize
+
+
+def imap_ordered(function, items, threads):
+    """
+    Method for applying a function to items in a thread pool while keeping
+    the order of the items. At most 4 * threads items are pending at any
+    time, which bounds the memory use.
+    """
+    if threads == 1:
+        for item in items:
+            yield function(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = deque()
+        for item in items:
+            if len(pending) >= 4 * threads:
+                yield pending.popleft().result()
+            pending.append(executor.submit(function, item))
+
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+
+def open_lines(fpath, threads=None):
+    """
+    Method for opening a text file to iterate over its lines (as bytes, like
+    gzip.open(fpath, 'rb')). BGZF files are decompressed in parallel, other
+    gzip files with gzip.
+
+    :param fpath: string, the (compressed) text file.
+    :param threads: int, the number of decompression threads.
+    :return : file like object.
+    """
+    if is_bgzf(fpath):
+        return BgzfLineReader(fpath, threads=threads)
+    if fpath.endswith(".gz"):
+        return gzip.open(fpath, "rb")
+    return open(fpath, "rb")
+
+
+class BgzfWriter:
+    def __init__(self, fpath, level=6, threads=1):
+        self.fh = open(fpath, "wb")
+        self.level = level
+        self.buffer = bytearray()
+        self.block_start = 0
+
+        # Full blocks are compressed in a thread pool; the compressed
+        # blocks are written in order.
+        self.threads = get_threads(threads)
+        self.executor = None
+        self.pending = deque()
+        if self.threads > 1:
+            self.executor = ThreadPoolExecutor(max_workers=self.threads)
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.buffer.extend(data)
+        while len(self.buffer) >= BLOCK_SIZE:
+            self.write_block(bytes(self.buffer[:BLOCK_SIZE]))
+            del self.buffer[:BLOCK_SIZE]
+
+    def write_block(self, data):
+        if self.executor is None:
+            self.write_compressed(compress_block(data, level=self.level))
+            return
+
+        self.pending.append(self.executor.submit(compress_block, data,
+                                                 self.level))
+        while len(self.pending) > 4 * self.threads:
+            self.write_compressed(self.pending.popleft().result())
+
+    def write_compressed(self, block):
+        self.fh.write(block)
+        self.block_start += len(block)
+
+    def write_pending(self):
+        while len(self.pending) > 0:
+            self.write_compressed(self.pending.popleft().result())
+
+    def tell(self):
+        self.write_pending()
+        return make_virtual_offset(self.block_start, len(self.buffer))
+
+    def flush(self):
+        if len(self.buffer) > 0:
+            self.write_block(bytes(self.buffer))
+            self.buffer = bytearray()
+        self.write_pending()
+        self.fh.flush()
+
+    def close(self):
+        if self.fh.closed:
+            return
+        self.flush()
+        self.fh.write(EOF_BLOCK)
+        self.fh.close()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class BgzfReader:
+    def __init__(self, fpath):
+        self.fh = open(fpath, "rb")
+        self.block_start = 0
+        self.next_block_start = 0
+        self.data = b""
+        self.within_block = 0
+        self.load_block(0)
+
+    def load_block(self, block_start):
+        """
+        Method for loading the block that starts at the given position in
+        the compressed file. Returns False at the end of the file.
+        """
+        self.fh.seek(block_start)
+        header = self.fh.read(HEADER_SIZE)
+        self.block_start = block_start
+        self.within_block = 0
+        if len(header) < HEADER_SIZE:
+            self.data = b""
+            self.next_block_start = block_start
+            return False
+        if header[:16] != HEADER:
+            raise ValueError("Invalid BGZF block at offset "
+                             "{}".format(block_start))
+
+        bsize = struct.unpack("<H", header[16:])[0] + 1
+        cdata = self.fh.read(bsize - HEADER_SIZE - FOOTER_SIZE)
+        crc, isize = struct.unpack("<II", self.fh.read(FOOTER_SIZE))
+        self.data = zlib.decompress(cdata, -15)
+        if len(self.data) != isize:
+            raise ValueError("Corrupt BGZF block at offset "
+                             "{}".format(block_start))
+        self.next_block_start = block_start + bsize
+
+        return True
+
+    def next_block(self):
+        # Skip empty blocks (e.g. the EOF marker).
+        while self.load_block(self.next_block_start):
+            if len(self.data) > 0:
+                return True
+        return False
+
+    def seek(self, virtual_offset):
+        block_start, within_block = split_virtual_offset(virtual_offset)
+        if block_start != self.block_start or len(self.data) == 0:
+            self.load_block(block_start)
+        if within_block > len(self.data):
+            raise ValueError("Invalid virtual offset {}".format(virtual_offset))
+        self.within_block = within_block
+
+    def tell(self):
+        return make_virtual_offset(self.block_start, self.within_block)
+
+    def get_line_offsets(self):
+        """
+        Method returning the virtual offsets of the start of every line from
+        the current position onwards. The last offset always points to the
+        end of the file.
+        """
+        offsets = [self.tell()]
+        last_byte = b"\n"
+        while self.within_block < len(self.data) or self.next_block():
+            data = self.data
+            end = data.find(b"\n", self.within_block)
+            while end != -1:
+                offsets.append(make_virtual_offset(self.block_start, end + 1))
+                end = data.find(b"\n", end + 1)
+            last_byte = data[-1:]
+            self.within_block = len(data)
+
+        if last_byte != b"\n":
+            offsets.append(self.tell())
+
+        return offsets
+
+    def readline(self):
+        parts = []
+        while True:
+            if self.within_block >= len(self.data) and not self.next_block():
+                break
+            end = self.data.find(b"\n", self.within_block)
+            if end == -1:
+                parts.append(self.data[self.within_block:])
+                self.within_block = len(self.data)
+            else:
+                parts.append(self.data[self.within_block:end + 1])
+                self.within_block = end + 1
+                break
+
+        return b"".join(parts)
+
+    def readlines(self, n):
+        lines = []
+        for _ in range(n):
+            line = self.readline()
+            if line == b"":
+                break
+            lines.append(line)
+        return lines
+
+    def close(self):
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class BgzfLineReader:
+    def __init__(self, fpath, threads=None):
+        """
+        Line iterator over a BGZF file that decompresses the blocks in
+        parallel.
+
+        :param fpath: string, the BGZF file.
+        :param threads: int, the number of decompression threads.
+        """
+        self.fh = open(fpath, "rb")
+        self.threads = get_threads(threads)
+
+    def iter_data(self):
+        return imap_ordered(decompress_block, read_raw_blocks(self.fh),
+                            self.threads)
+
+    def __iter__(self):
+        # Lines can span blocks; the part after the last newline of a
+        # block is kept until the next newline.
+        remainder = []
+        for data in self.iter_data():
+            end = data.rfind(b"\n")
+            if end == -1:
+                remainder.append(data)
+                continue
+            remainder.append(data[:end + 1])
+            for line in io.BytesIO(b"".join(remainder)):
+                yield line
+            remainder = [data[end + 1:]]
+
+        remainder = b"".join(remainder)
+        if len(remainder) > 0:
+            yield remainder
+
+    def read(self):
+        return b"".join(self.iter_data())
+
+    def close(self):
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
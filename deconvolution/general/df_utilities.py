@@ -1,7 +1,7 @@
 """
 File:         df_utilities.py
 Created:      2020/03/19
-Last Changed: 2020/04/23
+Last Changed: 2020/10/30
 Author(s):    M.Vochteloo
 
 Copyright (C) 2020 M.Vochteloo
@@ -23,14 +23,19 @@ root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
 # Standard imports.
 
 # Third party imports.
+import numpy as np
 import pandas as pd
 
 # Local application imports.
 from .utilities import get_basename
+from .parse_cache import get_parse_cache
+from .bgzf import BgzfWriter
+from .matrix_store import STORE_EXTENSION, is_matrix_store, \
+    find_matrix_store, get_store_path, save_matrix_store, select_dataframe
 
 
 def load_dataframe(inpath, header, index_col, sep="\t", low_memory=True,
-                   nrows=None, skiprows=None):
+                   nrows=None, skiprows=None, rows=None, cols=None):
     """
     Method for reading a comma-separated values (csv) file into a pandas
     DataFrame.
@@ -46,30 +51,142 @@ def load_dataframe(inpath, header, index_col, sep="\t", low_memory=True,
                        possibly mixed type inference.
     :param nrows: int, number of rows of file to read.
     :param skiprows: list, the index of rows to skip.
+    :param rows: list, the rows to select: positions, names or a boolean
+                 mask.
+    :param cols: list, the columns to select: positions, names or a
+                 boolean mask.
     :return df: DataFrame, the pandas dataframe.
+
+    If the file has an up to date matrix store (see matrix_store.py) and is
+    read with a header and index column, the selection is read from the
+    store instead; only the pages of the selected rows are then read.
+
+    Selections of row / column positions are pushed down into the parser:
+    the columns that are not selected are not converted and the rows that
+    are not selected are skipped.
+
+    If the parse cache is enabled (see parse_cache.py) the parsed dataframe
+    is stored in the cache and later reads of the unchanged file with the
+    same arguments are loaded from the cache.
     """
-    df = pd.read_csv(inpath, sep=sep, header=header, index_col=index_col,
-                     low_memory=low_memory, nrows=nrows, skiprows=skiprows)
-    print("\tLoaded dataframe: {} with shape: {}".format(get_basename(inpath),
-                                                         df.shape))
+    # Note: False == 0, so the index column is compared on identity too.
+    first_index_col = index_col is not False and index_col == 0
+    no_index_col = index_col is False or index_col is None
+
+    store = None
+    if is_matrix_store(inpath) or \
+            (header == 0 and first_index_col and skiprows is None):
+        store = find_matrix_store(inpath)
+    if store is not None:
+        df = store.select(rows=rows, cols=cols, nrows=nrows)
+        print("\tLoaded dataframe: {} with shape: {} (matrix "
+              "store)".format(get_basename(inpath), df.shape))
+        return df
+
+    # Translate position selections into parser arguments.
+    usecols = None
+    row_subset = None
+    col_subset = None
+    if header == 0 and (first_index_col or no_index_col):
+        col_subset = get_position_subset(cols)
+    if col_subset is not None:
+        usecols = col_subset.tolist()
+        if first_index_col:
+            usecols = [0] + (col_subset + 1).tolist()
+    if header == 0 and skiprows is None:
+        row_subset = get_position_subset(rows)
+    if row_subset is not None:
+        if nrows is not None and row_subset[-1] >= nrows:
+            raise IndexError("Row position out of bounds for {} "
+                             "rows".format(nrows))
+        skiprows = np.setdiff1d(np.arange(1, row_subset[-1] + 2),
+                                row_subset + 1).tolist()
+        nrows = len(row_subset)
+
+    cache = get_parse_cache()
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.get_key(inpath, header=header, index_col=index_col,
+                                  sep=sep, low_memory=low_memory, nrows=nrows,
+                                  skiprows=skiprows, usecols=usecols)
+
+    df = None
+    if cache_key is not None:
+        df = cache.load(cache_key)
+    cached = df is not None
+    if df is None:
+        df = pd.read_csv(inpath, sep=sep, header=header, index_col=index_col,
+                         low_memory=low_memory, nrows=nrows, skiprows=skiprows,
+                         usecols=usecols)
+        if cache_key is not None:
+            cache.store(cache_key, df, inpath)
+
+    # Put the pushed down selections in the requested order.
+    if row_subset is not None:
+        if df.shape[0] < len(row_subset):
+            raise IndexError("Row position out of bounds for {} "
+                             "rows".format(df.shape[0]))
+        rows = np.searchsorted(row_subset, rows)
+        if no_index_col:
+            df.index = row_subset
+    if col_subset is not None:
+        cols = np.searchsorted(col_subset, cols)
+    df = select_dataframe(df, rows=rows, cols=cols)
+
+    print("\tLoaded dataframe: {} with shape: {}{}".format(
+        get_basename(inpath), df.shape, " (cached)" if cached else ""))
     return df
 
 
-def save_dataframe(df, outpath, header, index, sep="\t"):
+def get_position_subset(selection):
+    """
+    Method for getting the sorted unique positions of a selection.
+
+    :param selection: list, the selection.
+    :return: ndarray, the positions; None if the selection is not a
+             (non-empty) list of non-negative positions.
+    """
+    if selection is None or isinstance(selection, slice):
+        return None
+    selection = np.asarray(selection)
+    if selection.ndim != 1 or len(selection) == 0 or \
+            not np.issubdtype(selection.dtype, np.integer) or \
+            selection.min() < 0:
+        return None
+    return np.unique(selection)
+
+
+def save_dataframe(df, outpath, header, index, sep="\t", store=False,
+                   threads=None):
     """
     Method for writing an dataframe to a comma-separated values (csv) file.
 
     :param df: DataFrame, the pandas dataframe.
-    :param outpath: str, the filepath for the dataframe.
+    :param outpath: str, the filepath for the dataframe; a path ending with
+                    '.mat' is written as matrix store.
     :param header: boolean, write out the column names.
     :param index: boolean, write row names (index).
     :param sep: str, field delimiter for the output file.
+    :param store: boolean, also write a matrix store next to the file.
+    :param threads: int, the number of compression threads of a '.gz'
+                    outpath (written as BGZF, which gzip can read).
     """
-    compression = 'infer'
-    if outpath.endswith('.gz'):
-        compression = 'gzip'
+    if outpath.endswith(STORE_EXTENSION):
+        save_matrix_store(df, outpath)
+        print("\tSaved dataframe: {} with shape: {} (matrix "
+              "store)".format(get_basename(outpath), df.shape))
+        return
 
-    df.to_csv(outpath, sep=sep, index=index, header=header,
-              compression=compression)
+    if outpath.endswith('.gz'):
+        with BgzfWriter(outpath, threads=threads) as f:
+            df.to_csv(f, sep=sep, index=index, header=header)
+        f.close()
+    else:
+        df.to_csv(outpath, sep=sep, index=index, header=header)
     print("\tSaved dataframe: {} with shape: {}".format(get_basename(outpath),
                                                         df.shape))
+
+    if store and header and index:
+        save_matrix_store(df, get_store_path(outpath), source=outpath)
+        print("\tSaved matrix store: "
+              "{}".format(get_basename(get_store_path(outpath))))
@@ -0,0 +1,338 @@
+"""
+File:         matrix_store.py
+Created:      2020/10/30
+Last Changed:
+Author(s):    M.Vochteloo
+
+Copyright (C) 2020 M.Vochteloo
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+A copy of the GNU General Public License can be found in the LICENSE file in the
+root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Standard imports.
+import shutil
+import json
+import os
+
+# Third party imports.
+import numpy as np
+import pandas as pd
+
+# Local application imports.
+
+# A matrix store keeps a matrix as a dense array on disk (values.npy) next to
+# its row names (rows.npy) and column names (columns.npy). The values are
+# memory mapped when reading, so selecting a subset of the rows only reads
+# the pages of those rows. Text columns (e.g. the alleles) are stored as
+# category codes. A store that is created from a text file
+# (genotype_table.txt.gz -> genotype_table.mat) records the size and
+# modification time of that file and is only used while the file is
+# unchanged.
+
+STORE_VERSION = 1
+STORE_EXTENSION = ".mat"
+HEADER_FILENAME = "header.json"
+TEXT_EXTENSIONS = (".txt", ".tsv", ".csv")
+
+
+def get_store_path(inpath):
+    """
+    Method for getting the path of the matrix store of a text file.
+
+    :param inpath: string, the text file.
+    :return: string, the matrix store path.
+    """
+    if inpath.endswith(STORE_EXTENSION):
+        return inpath
+    path = inpath
+    if path.endswith(".gz"):
+        path = path[:-3]
+    root, extension = os.path.splitext(path)
+    if extension in TEXT_EXTENSIONS:
+        path = root
+    return path + STORE_EXTENSION
+
+
+def is_matrix_store(path):
+    return os.path.isfile(os.path.join(path, HEADER_FILENAME))
+
+
+def find_matrix_store(inpath):
+    """
+    Method for finding a usable matrix store of a path.
+
+    :param inpath: string, a matrix store or a text file.
+    :return: MatrixStore, or None if there is no (up to date) store.
+    """
+    if is_matrix_store(inpath):
+        return MatrixStore(inpath)
+
+    store_path = get_store_path(inpath)
+    if store_path == inpath or not is_matrix_store(store_path):
+        return None
+    store = MatrixStore(store_path)
+    if not store.is_source(inpath):
+        return None
+    return store
+
+
+def get_source_info(inpath):
+    stat = os.stat(inpath)
+    return {"filename": os.path.basename(inpath),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns}
+
+
+def save_matrix_store(df, outpath, source=None):
+    """
+    Method for writing a dataframe as matrix store.
+
+    :param df: DataFrame, the pandas dataframe.
+    :param outpath: string, the matrix store path.
+    :param source: string, the text file the dataframe is read from; the
+                   store is only used in place of this file as long as it
+                   is unchanged.
+    """
+    tmp_outpath = "{}.{}.tmp".format(outpath, os.getpid())
+    if os.path.exists(tmp_outpath):
+        shutil.rmtree(tmp_outpath)
+    os.makedirs(tmp_outpath)
+
+    # Text columns are stored as category codes, boolean columns as 0 / 1
+    # and cast back when they are read.
+    dtypes = []
+    categories = {}
+    values = []
+    for i in range(df.shape[1]):
+        column = df.iloc[:, i]
+        if pd.api.types.is_bool_dtype(column.dtype):
+            dtypes.append("bool")
+            values.append(column.to_numpy(dtype=np.float64, na_value=np.nan))
+        elif pd.api.types.is_numeric_dtype(column.dtype):
+            dtypes.append(str(column.dtype))
+            values.append(column.to_numpy())
+        else:
+            codes, uniques = pd.factorize(column)
+            dtypes.append("category")
+            categories[str(i)] = [str(x) for x in uniques]
+            values.append(np.where(codes < 0, np.nan, codes))
+
+    if len(set(dtypes)) == 1 and dtypes[0] not in ("category", "bool"):
+        values = np.ascontiguousarray(df.to_numpy(dtype=dtypes[0]))
+    elif len(values) > 0:
+        values = np.column_stack(values).astype(np.float64)
+    else:
+        values = np.empty(df.shape, dtype=np.float64)
+
+    np.save(os.path.join(tmp_outpath, "values.npy"), values,
+            allow_pickle=False)
+    np.save(os.path.join(tmp_outpath, "rows.npy"),
+            np.array(df.index.astype(str), dtype=str), allow_pickle=False)
+    np.save(os.path.join(tmp_outpath, "columns.npy"),
+            np.array(df.columns.astype(str), dtype=str), allow_pickle=False)
+
+    header = {"version": STORE_VERSION,
+              "shape": list(df.shape),
+              "dtype": str(values.dtype),
+              "column_dtypes": dtypes,
+              "categories": categories,
+              "index_name": df.index.name,
+              "index_dtype": str(df.index.dtype),
+              "columns_name": df.columns.name,
+              "source": None}
+    if source is not None:
+        header["source"] = get_source_info(source)
+    with open(os.path.join(tmp_outpath, HEADER_FILENAME), "w") as f:
+        json.dump(header, f, indent=2)
+    f.close()
+
+    if os.path.exists(outpath):
+        shutil.rmtree(outpath)
+    os.rename(tmp_outpath, outpath)
+
+
+def remove_matrix_store(inpath):
+    store_path = get_store_path(inpath)
+    if is_matrix_store(store_path):
+        shutil.rmtree(store_path)
+
+
+def select_positions(selection, labels):
+    """
+    Method for translating a row or column selection into positions.
+
+    :param selection: list / ndarray / slice, the selection: positions,
+                      labels or a boolean mask. None selects everything.
+    :param labels: Index, the row or column names.
+    :return: ndarray, the positions; None if everything is selected.
+    """
+    if selection is None:
+        return None
+    if isinstance(selection, slice):
+        return np.arange(len(labels))[selection]
+    if isinstance(selection, (pd.Series, pd.Index)):
+        selection = selection.to_numpy()
+
+    selection = np.asarray(selection)
+    if selection.dtype == bool:
+        if len(selection) != len(labels):
+            raise ValueError("Boolean mask of length {} does not match {} "
+                             "labels".format(len(selection), len(labels)))
+        return np.flatnonzero(selection)
+    if len(selection) == 0:
+        return np.array([], dtype=np.int64)
+    if np.issubdtype(selection.dtype, np.integer):
+        if selection.max() >= len(labels) or selection.min() < -len(labels):
+            raise IndexError("Position out of bounds for {} "
+                             "labels".format(len(labels)))
+        return selection.astype(np.int64)
+
+    positions = labels.get_indexer(selection)
+    if np.any(positions < 0):
+        missing = selection[positions < 0]
+        raise KeyError("{} label(s) not found, e.g.: "
+                       "{}".format(len(missing), ", ".join(missing[:5].astype(str))))
+    return positions
+
+
+def select_dataframe(df, rows=None, cols=None):
+    """
+    Method for selecting rows / columns of a dataframe the way a matrix
+    store selects them.
+
+    :param df: DataFrame, the pandas dataframe.
+    :param rows: list / ndarray, positions, labels or a boolean mask.
+    :param cols: list / ndarray, positions, labels or a boolean mask.
+    :return: DataFrame, the selection.
+    """
+    if isinstance(df, MatrixStore):
+        return df.select(rows=rows, cols=cols)
+    if rows is None and cols is None:
+        return df
+
+    row_positions = select_positions(rows, df.index)
+    col_positions = select_positions(cols, df.columns)
+    if row_positions is None:
+        row_positions = slice(None)
+    if col_positions is None:
+        col_positions = slice(None)
+    return df.iloc[row_positions, col_positions]
+
+
+class MatrixStore:
+    def __init__(self, path):
+        """
+        The initializer for the class.
+
+        :param path: string, the matrix store directory.
+        """
+        self.path = path
+        with open(os.path.join(path, HEADER_FILENAME), "r") as f:
+            self.header = json.load(f)
+        f.close()
+        self.shape = tuple(self.header["shape"])
+
+        rows = np.load(os.path.join(path, "rows.npy"), allow_pickle=False)
+        self.rows = pd.Index(rows.astype(object), name=self.header["index_name"])
+        if self.header["index_dtype"].startswith("int"):
+            self.rows = self.rows.astype(self.header["index_dtype"])
+        columns = np.load(os.path.join(path, "columns.npy"), allow_pickle=False)
+        self.columns = pd.Index(columns.astype(object),
+                                name=self.header["columns_name"])
+        self.values = None
+
+    def is_source(self, inpath):
+        source = self.header["source"]
+        if source is None or not os.path.isfile(inpath):
+            return False
+        info = get_source_info(inpath)
+        return info["size"] == source["size"] and \
+            info["mtime"] == source["mtime"]
+
+    def get_path(self):
+        return self.path
+
+    def get_shape(self):
+        return self.shape
+
+    def get_rows(self):
+        return self.rows
+
+    def get_columns(self):
+        return self.columns
+
+    def get_values(self):
+        if self.values is None:
+            self.values = np.load(os.path.join(self.path, "values.npy"),
+                                  mmap_mode="r", allow_pickle=False)
+        return self.values
+
+    def select(self, rows=None, cols=None, nrows=None):
+        """
+        Method for reading a selection of the matrix.
+
+        :param rows: list / ndarray / slice, row positions, row names or a
+                     boolean mask. None selects all rows.
+        :param cols: list / ndarray / slice, column positions, column names
+                     or a boolean mask. None selects all columns.
+        :param nrows: int, only use the first nrows rows (the selection is
+                      relative to these rows).
+        :return df: DataFrame, the selection.
+        """
+        values = self.get_values()
+        row_labels = self.rows
+        if nrows is not None:
+            values = values[:nrows]
+            row_labels = row_labels[:nrows]
+
+        row_positions = select_positions(rows, row_labels)
+        col_positions = select_positions(cols, self.columns)
+
+        # Gather the rows first: with the row-major layout only the pages
+        # of the selected rows are read.
+        if row_positions is not None:
+            data = values[row_positions]
+            row_labels = row_labels[row_positions]
+        else:
+            data = np.array(values)
+        col_labels = self.columns
+        column_dtypes = self.header["column_dtypes"]
+        if col_positions is not None:
+            data = data[:, col_positions]
+            col_labels = col_labels[col_positions]
+            column_dtypes = [column_dtypes[i] for i in col_positions]
+        else:
+            col_positions = np.arange(len(col_labels))
+
+        if "category" not in column_dtypes and \
+                len(set(column_dtypes)) <= 1 and \
+                (len(column_dtypes) == 0 or column_dtypes[0] == str(data.dtype)):
+            return pd.DataFrame(data, index=row_labels, columns=col_labels,
+                                copy=False)
+
+        # Decode the category codes and restore the column dtypes.
+        columns = {}
+        for i, (position, dtype) in enumerate(zip(col_positions, column_dtypes)):
+            column = data[:, i]
+            if dtype == "category":
+                categories = np.array(self.header["categories"][str(position)] +
+                                      [np.nan], dtype=object)
+                codes = np.where(np.isnan(column), -1, column).astype(np.int64)
+                column = categories[codes]
+            elif not np.any(np.isnan(column)):
+                column = column.astype(dtype)
+            columns[i] = column
+        df = pd.DataFrame(columns, index=row_labels)
+        df.columns = col_labels
+        return df
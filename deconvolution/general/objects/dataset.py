@@ -1,7 +1,7 @@
 """
 File:         dataset.py
 Created:      2020/03/16
-Last Changed: 2020/06/19
+Last Changed: 2020/10/30
 Author:       M.Vochteloo
 
 Copyright (C) 2020 M.Vochteloo
@@ -21,10 +21,11 @@ root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
 """
 
 # Standard imports.
-import itertools
+import hashlib
 import os
 
 # Third party imports.
+import numpy as np
 import pandas as pd
 import seaborn as sns
 import scipy.stats as stats
@@ -32,27 +33,61 @@ import scipy.stats as stats
 # Local application imports.
 from general.df_utilities import load_dataframe
 
+# The pairs of table axes that have to be identical: (table, axis), (table,
+# axis), error message, whether the program exits on a mismatch. The axis is
+# 'index', 'columns' or a column name.
+VALIDATIONS = [
+    (("eqtl", "SNPName"), ("geno", "index"),
+     "Order of SNPs in eqtl_df and geno_df are not identical.", True),
+    (("eqtl", "ProbeName"), ("expr", "index"),
+     "Order of Probes in eqtl_df and expr_df are not identical.", False),
+    (("geno", "index"), ("alleles", "index"),
+     "Order of SNPs in geno_df and alleles_df are not identical.", False),
+    (("geno", "columns"), ("expr", "columns"),
+     "Order of samples are not identical.", True),
+    (("geno", "columns"), ("cov", "columns"),
+     "Order of samples are not identical.", True),
+    (("expr", "columns"), ("cov", "columns"),
+     "Order of samples are not identical.", True)
+]
+
 
 class Dataset:
-    def __init__(self, name, settings, alpha=0.05, nrows=None, interest=None):
-        self.input_dir = os.path.join(settings.get_setting("input_dir"), name)
+    def __init__(self, name, settings, alpha=0.05, nrows=None, interest=None,
+                 samples=None):
+        """
+        The initializer for the class.
+
+        :param name: string, the name of the input directories.
+        :param settings: LocalSettings, the settings.
+        :param alpha: float, the significance level.
+        :param nrows: int, the number of eQTLs to use (-1 / None for all).
+        :param interest: list, the indices of the eQTLs to use.
+        :param samples: list, the samples to use (names or positions).
+        """
+        input_dir = os.path.join(settings.get_setting("input_dir"), name)
         filenames = settings.get_setting("filenames")
-        self.eqtl_filename = filenames["eqtl"]
-        self.geno_filename = filenames["genotype"]
-        self.alleles_filename = filenames["alleles"]
-        self.expr_filename = filenames["expression"]
-        self.cov_filename = filenames["covariates"]
-        self.markers_filename = filenames["markers"]
-
-        self.inter_input_dir = os.path.join(settings.get_setting("interaction_input_dir"), name)
+
+        inter_input_dir = os.path.join(settings.get_setting("interaction_input_dir"), name)
         inter_subdirs = settings.get_setting("interaction_input_subfolders")
-        self.inter_cov_subdir = inter_subdirs["covariates_of_interest"]
-        self.inter_tech_cov_subdir = inter_subdirs["technical_covariates"]
+        inter_cov_dir = os.path.join(inter_input_dir, inter_subdirs["covariates_of_interest"])
+        inter_tech_cov_dir = os.path.join(inter_input_dir, inter_subdirs["technical_covariates"])
         inter_filenames = settings.get_setting("interaction_filenames")
-        self.pvalue_filename = inter_filenames["pvalues"]
-        self.zscore_filename = inter_filenames["zscores"]
-        self.snp_tvalue_filename = inter_filenames["snp_tvalues"]
-        self.inter_tvalue_filename = inter_filenames["inter_tvalues"]
+
+        # The tables: name -> (path, index column, eQTL axis, sample axis).
+        self.tables = {
+            "eqtl": (os.path.join(input_dir, filenames["eqtl"]), False, 0, None),
+            "geno": (os.path.join(input_dir, filenames["genotype"]), 0, 0, 1),
+            "alleles": (os.path.join(input_dir, filenames["alleles"]), 0, 0, None),
+            "expr": (os.path.join(input_dir, filenames["expression"]), 0, 0, 1),
+            "cov": (os.path.join(input_dir, filenames["covariates"]), 0, None, 1),
+            "markers": (os.path.join(input_dir, filenames["markers"]), False, None, None)
+        }
+        for prefix, directory in (("inter_cov", inter_cov_dir),
+                                  ("inter_tech_cov", inter_tech_cov_dir)):
+            for key in ("pvalues", "zscores", "snp_tvalues", "inter_tvalues"):
+                self.tables["{}_{}".format(prefix, key)] = \
+                    (os.path.join(directory, inter_filenames[key]), 0, 1, None)
 
         self.groups = settings.get_setting("groups")
         self.celltypes = settings.get_setting("celltypes")
@@ -61,6 +96,7 @@ class Dataset:
         self.marker_genes = settings.get_setting("marker_genes_prefix")
         self.signif_cutoff = stats.norm.isf(alpha)
         self.interest = interest
+        self.samples = samples
         if nrows == -1:
             nrows = None
         if nrows is not None and nrows <= 0:
@@ -71,41 +107,18 @@ class Dataset:
         self.nrows = nrows
 
         # Declare empty variables.
-        self.eqtl_df = None
-        self.geno_df = None
-        self.alleles_df = None
-        self.expr_df = None
-        self.cov_df = None
-        self.inter_cov_pvalue_df = None
-        self.inter_tech_cov_pvalue_df = None
-        self.inter_cov_zscore_df = None
-        self.inter_tech_cov_zscore_df = None
-        self.inter_cov_snp_tvalue_df = None
-        self.inter_tech_cov_snp_tvalue_df = None
-        self.inter_cov_inter_tvalue_df = None
-        self.inter_tech_cov_inter_tvalue_df = None
+        self.dfs = {}
+        self.fingerprints = {}
+        self.validated = set()
         self.eqtl_and_interactions_df = None
-        self.marker_df = None
 
     def load_all(self):
         print("Loading all dataframes for validation.")
         self.nrows = None
         self.get_celltypes()
-        self.get_eqtl_df()
-        self.get_geno_df()
-        self.get_alleles_df()
-        self.get_expr_df()
-        self.get_cov_df()
-        self.get_inter_cov_pvalue_df()
-        self.get_inter_tech_cov_pvalue_df()
-        self.get_inter_cov_zscore_df()
-        self.get_inter_tech_cov_zscore_df()
-        self.get_inter_cov_snp_tvalue_df()
-        self.get_inter_tech_cov_snp_tvalue_df()
-        self.get_inter_cov_inter_tvalue_df()
-        self.get_inter_tech_cov_inter_tvalue_df()
+        for name in self.tables.keys():
+            self.get_df(name)
         self.get_eqtl_and_interactions_df()
-        self.get_marker_df()
         print("Validation finished.")
         exit()
 
@@ -130,202 +143,84 @@ class Dataset:
     def get_significance_cutoff(self):
         return self.signif_cutoff
 
+    def get_df(self, name):
+        """
+        Method for getting a table. The table is loaded on first use with the
+        eQTLs of interest and the samples selected while reading.
+
+        :param name: string, the table name (see self.tables).
+        :return: DataFrame, the table.
+        """
+        if name not in self.dfs:
+            inpath, index_col, eqtl_axis, sample_axis = self.tables[name]
+            nrows = None
+            selection = {0: None, 1: None}
+            if eqtl_axis == 0:
+                nrows = self.nrows
+            if eqtl_axis is not None:
+                selection[eqtl_axis] = self.interest
+            if sample_axis is not None:
+                selection[sample_axis] = self.samples
+
+            self.dfs[name] = load_dataframe(inpath=inpath,
+                                            header=0,
+                                            index_col=index_col,
+                                            nrows=nrows,
+                                            rows=selection[0],
+                                            cols=selection[1])
+            self.validate(name)
+        return self.dfs[name]
+
     def get_eqtl_df(self):
-        if self.eqtl_df is None:
-            eqtl_df = load_dataframe(inpath=os.path.join(self.input_dir,
-                                                         self.eqtl_filename),
-                                     header=0,
-                                     index_col=False,
-                                     nrows=self.nrows)
-            if self.interest is not None:
-                eqtl_df = eqtl_df.iloc[self.interest, :]
-            self.eqtl_df = eqtl_df
-
-            self.validate()
-        return self.eqtl_df
+        return self.get_df("eqtl")
 
     def get_geno_df(self):
-        if self.geno_df is None:
-            geno_df = load_dataframe(inpath=os.path.join(self.input_dir,
-                                                         self.geno_filename),
-                                     header=0,
-                                     index_col=0,
-                                     nrows=self.nrows)
-            if self.interest is not None:
-                geno_df = geno_df.iloc[self.interest, :]
-            self.geno_df = geno_df
-
-            self.validate()
-        return self.geno_df
+        return self.get_df("geno")
 
     def get_alleles_df(self):
-        if self.alleles_df is None:
-            alleles_df = load_dataframe(inpath=os.path.join(self.input_dir,
-                                                            self.alleles_filename),
-                                        header=0,
-                                        index_col=0,
-                                        nrows=self.nrows)
-            if self.interest is not None:
-                alleles_df = alleles_df.iloc[self.interest, :]
-            self.alleles_df = alleles_df
-
-            self.validate()
-        return self.alleles_df
+        return self.get_df("alleles")
 
     def get_expr_df(self):
-        if self.expr_df is None:
-            expr_df = load_dataframe(inpath=os.path.join(self.input_dir,
-                                                         self.expr_filename),
-                                     header=0,
-                                     index_col=0,
-                                     nrows=self.nrows)
-
-            if self.interest is not None:
-                expr_df = expr_df.iloc[self.interest, :]
-            self.expr_df = expr_df
-
-            self.validate()
-        return self.expr_df
+        return self.get_df("expr")
 
     def get_cov_df(self):
-        if self.cov_df is None:
-            self.cov_df = load_dataframe(inpath=os.path.join(self.input_dir,
-                                                             self.cov_filename),
-                                         header=0,
-                                         index_col=0)
-            self.validate()
-        return self.cov_df
+        return self.get_df("cov")
 
     def get_inter_cov_pvalue_df(self):
-        if self.inter_cov_pvalue_df is None:
-            inter_cov_pvalue_df = load_dataframe(
-                inpath=os.path.join(self.inter_input_dir,
-                                    self.inter_cov_subdir,
-                                    self.pvalue_filename),
-                header=0,
-                index_col=0)
-            if self.interest is not None:
-                inter_cov_pvalue_df = inter_cov_pvalue_df.iloc[:, self.interest]
-            self.inter_cov_pvalue_df = inter_cov_pvalue_df
-
-            self.validate()
-        return self.inter_cov_pvalue_df
+        return self.get_df("inter_cov_pvalues")
 
     def get_inter_tech_cov_pvalue_df(self):
-        if self.inter_tech_cov_pvalue_df is None:
-            inter_tech_cov_pvalue_df = load_dataframe(
-                inpath=os.path.join(self.inter_input_dir,
-                                    self.inter_tech_cov_subdir,
-                                    self.pvalue_filename),
-                header=0,
-                index_col=0)
-            if self.interest is not None:
-                inter_tech_cov_pvalue_df = inter_tech_cov_pvalue_df.iloc[:, self.interest]
-            self.inter_tech_cov_pvalue_df = inter_tech_cov_pvalue_df
-
-            self.validate()
-        return self.inter_tech_cov_pvalue_df
+        return self.get_df("inter_tech_cov_pvalues")
 
     def get_inter_cov_zscore_df(self):
-        if self.inter_cov_zscore_df is None:
-            inter_cov_zscore_df = load_dataframe(
-                inpath=os.path.join(self.inter_input_dir,
-                                    self.inter_cov_subdir,
-                                    self.zscore_filename),
-                header=0,
-                index_col=0)
-            if self.interest is not None:
-                inter_cov_zscore_df = inter_cov_zscore_df.iloc[:,
-                                           self.interest]
-            self.inter_cov_zscore_df = inter_cov_zscore_df
-
-            self.validate()
-        return self.inter_cov_zscore_df
+        return self.get_df("inter_cov_zscores")
 
     def get_inter_tech_cov_zscore_df(self):
-        if self.inter_tech_cov_zscore_df is None:
-            inter_tech_cov_zscore_df = load_dataframe(
-                inpath=os.path.join(self.inter_input_dir,
-                                    self.inter_tech_cov_subdir,
-                                    self.zscore_filename),
-                header=0,
-                index_col=0)
-            if self.interest is not None:
-                inter_tech_cov_zscore_df = inter_tech_cov_zscore_df.iloc[:,
-                                           self.interest]
-            self.inter_tech_cov_zscore_df = inter_tech_cov_zscore_df
-
-            self.validate()
-        return self.inter_tech_cov_zscore_df
+        return self.get_df("inter_tech_cov_zscores")
 
     def get_inter_cov_snp_tvalue_df(self):
-        if self.inter_cov_snp_tvalue_df is None:
-            inter_cov_snp_tvalue_df = load_dataframe(
-                inpath=os.path.join(self.inter_input_dir,
-                                    self.inter_cov_subdir,
-                                    self.snp_tvalue_filename),
-                header=0,
-                index_col=0)
-            if self.interest is not None:
-                inter_cov_snp_tvalue_df = inter_cov_snp_tvalue_df.iloc[:, self.interest]
-            self.inter_cov_snp_tvalue_df = inter_cov_snp_tvalue_df
-
-            self.validate()
-        return self.inter_cov_snp_tvalue_df
+        return self.get_df("inter_cov_snp_tvalues")
 
     def get_inter_tech_cov_snp_tvalue_df(self):
-        if self.inter_tech_cov_snp_tvalue_df is None:
-            inter_tech_cov_snp_tvalue_df = load_dataframe(
-                inpath=os.path.join(self.inter_input_dir,
-                                    self.inter_tech_cov_subdir,
-                                    self.snp_tvalue_filename),
-                header=0,
-                index_col=0)
-            if self.interest is not None:
-                inter_tech_cov_snp_tvalue_df = inter_tech_cov_snp_tvalue_df.iloc[:, self.interest]
-            self.inter_tech_cov_snp_tvalue_df = inter_tech_cov_snp_tvalue_df
-
-            self.validate()
-        return self.inter_tech_cov_snp_tvalue_df
+        return self.get_df("inter_tech_cov_snp_tvalues")
 
     def get_inter_cov_inter_tvalue_df(self):
-        if self.inter_cov_inter_tvalue_df is None:
-            inter_cov_inter_tvalue_df = load_dataframe(
-                inpath=os.path.join(self.inter_input_dir,
-                                    self.inter_cov_subdir,
-                                    self.inter_tvalue_filename),
-                header=0,
-                index_col=0)
-            if self.interest is not None:
-                inter_cov_inter_tvalue_df = inter_cov_inter_tvalue_df.iloc[:, self.interest]
-            self.inter_cov_inter_tvalue_df = inter_cov_inter_tvalue_df
-
-            self.validate()
-        return self.inter_cov_inter_tvalue_df
+        return self.get_df("inter_cov_inter_tvalues")
 
     def get_inter_tech_cov_inter_tvalue_df(self):
-        if self.inter_tech_cov_inter_tvalue_df is None:
-            inter_tech_cov_inter_tvalue_df = load_dataframe(
-                inpath=os.path.join(self.inter_input_dir,
-                                    self.inter_tech_cov_subdir,
-                                    self.inter_tvalue_filename),
-                header=0,
-                index_col=0)
-            if self.interest is not None:
-                inter_tech_cov_inter_tvalue_df = inter_tech_cov_inter_tvalue_df.iloc[:, self.interest]
-            self.inter_tech_cov_inter_tvalue_df = inter_tech_cov_inter_tvalue_df
-
-            self.validate()
-        return self.inter_tech_cov_inter_tvalue_df
+        return self.get_df("inter_tech_cov_inter_tvalues")
+
+    def get_marker_df(self):
+        return self.get_df("markers")
 
     def get_eqtl_and_interactions_df(self):
+        if self.eqtl_and_interactions_df is not None:
+            return self.eqtl_and_interactions_df
+
         # Get the complete input dataframes.
-        df1 = load_dataframe(inpath=os.path.join(self.input_dir,
-                                                 self.eqtl_filename),
+        df1 = load_dataframe(inpath=self.tables["eqtl"][0],
                              header=0, index_col=False)
-        df2 = load_dataframe(inpath=os.path.join(self.inter_input_dir,
-                                                 self.inter_cov_subdir,
-                                                 self.zscore_filename),
+        df2 = load_dataframe(inpath=self.tables["inter_cov_zscores"][0],
                              header=0, index_col=0).T
 
         # Check if the files math up.
@@ -353,43 +248,46 @@ class Dataset:
 
         return self.eqtl_and_interactions_df
 
-    def get_marker_df(self):
-        if self.marker_df is None:
-            self.marker_df = load_dataframe(inpath=os.path.join(self.input_dir,
-                                                                self.markers_filename),
-                                            header=0,
-                                            index_col=False)
-            self.validate()
-        return self.marker_df
-
-    def validate(self):
-        if self.eqtl_df is not None:
-            if self.geno_df is not None:
-                reference = self.eqtl_df["SNPName"].copy()
-                reference.rename("-", inplace=True)
-                alternative = pd.Series(self.geno_df.index, index=reference.index, name="-")
-                if not alternative.equals(reference):
-                    print("Order of SNPs in eqtl_df and geno_df "
-                          "are not identical.")
+    def get_fingerprint(self, name, axis):
+        """
+        Method for getting the (cached) fingerprint of the labels of a table
+        axis; two axes have the same fingerprint if they have the same
+        labels in the same order.
+
+        :param name: string, the table name.
+        :param axis: string, 'index', 'columns' or a column name.
+        :return: string, the fingerprint.
+        """
+        key = (name, axis)
+        if key not in self.fingerprints:
+            df = self.dfs[name]
+            if axis == "index":
+                labels = df.index
+            elif axis == "columns":
+                labels = df.columns
+            else:
+                labels = df[axis]
+            hashes = pd.util.hash_array(np.asarray(labels, dtype=object))
+            self.fingerprints[key] = hashlib.sha1(hashes.tobytes()).hexdigest()
+        return self.fingerprints[key]
+
+    def validate(self, name):
+        """
+        Method for validating a loaded table against the other loaded
+        tables. Every pair of tables is compared once.
+
+        :param name: string, the name of the loaded table.
+        """
+        for i, ((name_a, axis_a), (name_b, axis_b), message, fatal) in enumerate(VALIDATIONS):
+            if i in self.validated or name not in (name_a, name_b) or \
+                    name_a not in self.dfs or name_b not in self.dfs:
+                continue
+            self.validated.add(i)
+
+            if self.get_fingerprint(name_a, axis_a) != \
+                    self.get_fingerprint(name_b, axis_b):
+                print(message)
+                if fatal:
                     exit()
-            if self.expr_df is not None:
-                reference = self.eqtl_df["ProbeName"].copy()
-                reference.rename("-", inplace=True)
-                alternative = pd.Series(self.expr_df.index, index=reference.index, name="-")
-                if not alternative.equals(reference):
-                    print("Order of Probes in eqtl_df and expr_df "
-                          "are not identical.")
-
-        if self.geno_df is not None and self.alleles_df is not None:
-            if not self.geno_df.index.identical(self.alleles_df.index):
-                print("Order of SNPs in geno_df and alleles_df are not "
-                      "identical.")
-
-        dfs = [self.geno_df, self.expr_df, self.cov_df]
-        for (a, b) in list(itertools.combinations(dfs, 2)):
-            if a is not None and b is not None and \
-                    not a.columns.identical(b.columns):
-                print("Order of samples are not identical.")
-                exit()
 
         print("\tValid.")
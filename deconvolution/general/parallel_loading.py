@@ -0,0 +1,114 @@
+"""
+File:         parallel_loading.py
+Created:      2020/10/30
+Last Changed:
+Author:       M.Vochteloo
+
+Copyright (C) 2020 M.Vochteloo
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+A copy of the GNU General Public License can be found in the LICENSE file in the
+root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Standard imports.
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Third party imports.
+import numpy as np
+
+# Local application imports.
+
+
+def imap_bounded(function, items, n_workers=1, max_in_flight=None):
+    """
+    Method for applying a function to items in a thread pool. Reading many
+    small files is latency bound, so threads are enough to keep multiple
+    reads in flight. At most max_in_flight items are submitted and not yet
+    consumed at any time, which bounds the memory use.
+
+    :param function: function, applied to every item.
+    :param items: iterable, the items.
+    :param n_workers: int, the number of threads.
+    :param max_in_flight: int, the maximum number of pending items,
+                          default: 2 * n_workers.
+    :return : generator of (item index, result) tuples in the order in
+              which the items finish.
+    """
+    n_workers = max(1, n_workers)
+    if max_in_flight is None:
+        max_in_flight = 2 * n_workers
+    max_in_flight = max(1, max_in_flight)
+
+    if n_workers == 1:
+        for index, item in enumerate(items):
+            yield index, function(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        pending = {}
+        for index, item in enumerate(items):
+            if len(pending) >= max_in_flight:
+                done, _ = wait(pending.keys(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+            pending[executor.submit(function, item)] = index
+
+        while len(pending) > 0:
+            done, _ = wait(pending.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+
+
+def assemble_rows(parts, n_columns):
+    """
+    Method for assembling row parts into arrays indexed by eQTL index. The
+    arrays are preallocated from the lowest to the highest eQTL index, so
+    they come out sorted, missing eQTLs are NaN rows and duplicated eQTLs
+    are stored once.
+
+    :param parts: list, (eqtl_indices, names, values) tuples in priority
+                  order; of duplicated eQTLs the first row is kept.
+    :param n_columns: int, the number of value columns.
+    :return eqtl_indices: ndarray, the eQTL indices (lowest to highest).
+    :return names: ndarray, the row names (NaN for missing eQTLs).
+    :return values: ndarray, the values (NaN for missing eQTLs).
+    :return missing: ndarray, the missing eQTL indices.
+    :return duplicated: ndarray, the duplicated eQTL indices.
+    """
+    parts = [part for part in parts if len(part[0]) > 0]
+    if len(parts) == 0:
+        return np.array([], dtype=np.int64), \
+               np.array([], dtype=object), \
+               np.empty((0, n_columns)), \
+               np.array([], dtype=np.int64), \
+               np.array([], dtype=np.int64)
+
+    start = min(int(np.min(part[0])) for part in parts)
+    end = max(int(np.max(part[0])) for part in parts) + 1
+    n_rows = end - start
+
+    names = np.full(n_rows, np.nan, dtype=object)
+    values = np.full((n_rows, n_columns), np.nan, dtype=np.float64)
+    occurrences = np.zeros(n_rows, dtype=np.int64)
+
+    # Write the parts and rows in reverse, so the first row of a duplicated
+    # eQTL is the one that is written last.
+    for eqtl_indices, part_names, part_values in reversed(parts):
+        positions = np.asarray(eqtl_indices, dtype=np.int64)[::-1] - start
+        names[positions] = np.asarray(part_names, dtype=object)[::-1]
+        values[positions, :] = np.asarray(part_values, dtype=np.float64)[::-1]
+        occurrences += np.bincount(positions, minlength=n_rows)
+
+    return np.arange(start, end), names, values, \
+        np.flatnonzero(occurrences == 0) + start, \
+        np.flatnonzero(occurrences > 1) + start
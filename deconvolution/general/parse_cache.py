@@ -0,0 +1,248 @@
+"""
+File:         parse_cache.py
+Created:      2020/10/30
+Last Changed:
+Author:       M.Vochteloo
+
+Copyright (C) 2020 M.Vochteloo
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+A copy of the GNU General Public License can be found in the LICENSE file in the
+root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Standard imports.
+import hashlib
+import shutil
+import pickle
+import json
+import time
+import os
+
+# Third party imports.
+import numpy as np
+import pandas as pd
+
+# Local application imports.
+
+# Opt-in cache of parsed text matrices. Set DECON_PARSE_CACHE to a
+# directory (or to 1 for ~/.cache/decon_parse_cache) to enable it and
+# DECON_PARSE_CACHE_SIZE_GB to limit its size (default: 20). Every entry is
+# keyed on the path, size and modification time of the file plus the read
+# arguments, so a changed file or different arguments never hit an old
+# entry. Frames with one numeric dtype are stored as a .npy matrix that is
+# memory mapped copy-on-write when loaded (changes stay in memory), other
+# frames are pickled. When the cache exceeds its size the least recently
+# used entries are removed.
+
+CACHE_VERSION = 1
+CACHE_ENV = "DECON_PARSE_CACHE"
+CACHE_SIZE_ENV = "DECON_PARSE_CACHE_SIZE_GB"
+DEFAULT_CACHE_DIR = os.path.join("~", ".cache", "decon_parse_cache")
+DEFAULT_MAX_SIZE_GB = 20
+ENTRY_FILENAME = "entry.json"
+
+
+def get_parse_cache():
+    """
+    Method for getting the parse cache as configured in the environment.
+
+    :return : ParseCache, or None if the cache is not enabled.
+    """
+    cache_dir = os.environ.get(CACHE_ENV)
+    if cache_dir is None or cache_dir in ("", "0"):
+        return None
+    if cache_dir == "1":
+        cache_dir = DEFAULT_CACHE_DIR
+
+    max_size = float(os.environ.get(CACHE_SIZE_ENV, DEFAULT_MAX_SIZE_GB))
+    return ParseCache(os.path.expanduser(cache_dir),
+                      max_size=int(max_size * 1024 ** 3))
+
+
+class ParseCache:
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE_GB * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    @staticmethod
+    def get_key(inpath, **read_args):
+        """
+        Method for creating the key of a file and its read arguments.
+
+        :return : string, the key, or None if the read can not be cached.
+        """
+        if not os.path.isfile(inpath):
+            return None
+
+        arguments = {}
+        for name, value in sorted(read_args.items()):
+            if isinstance(value, range):
+                value = list(value)
+            if callable(value):
+                return None
+            arguments[name] = value
+
+        stat = os.stat(inpath)
+        content = json.dumps({"version": CACHE_VERSION,
+                              "path": os.path.abspath(inpath),
+                              "size": stat.st_size,
+                              "mtime": stat.st_mtime_ns,
+                              "arguments": arguments},
+                             sort_keys=True, default=str)
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    def get_entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key):
+        """
+        Method for loading a cached frame.
+
+        :param key: string, the key.
+        :return : DataFrame, or None if the key is not in the cache.
+        """
+        entry_dir = self.get_entry_dir(key)
+        entry_path = os.path.join(entry_dir, ENTRY_FILENAME)
+        if not os.path.isfile(entry_path):
+            return None
+
+        try:
+            with open(entry_path, "r") as f:
+                entry = json.load(f)
+            f.close()
+
+            if entry["format"] == "matrix":
+                with open(os.path.join(entry_dir, "axes.pkl"), "rb") as f:
+                    index, columns = pickle.load(f)
+                f.close()
+                values = np.load(os.path.join(entry_dir, "values.npy"),
+                                 mmap_mode="c", allow_pickle=False)
+                df = pd.DataFrame(values, index=index, columns=columns,
+                                  copy=False)
+            else:
+                df = pd.read_pickle(os.path.join(entry_dir, "frame.pkl"))
+        except (OSError, ValueError, KeyError, EOFError, pickle.UnpicklingError):
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+
+        # Mark the entry as recently used.
+        os.utime(entry_path, None)
+
+        return df
+
+    def store(self, key, df, inpath):
+        """
+        Method for storing a parsed frame.
+
+        :param key: string, the key.
+        :param df: DataFrame, the parsed frame.
+        :param inpath: string, the file the frame was parsed from.
+        """
+        entry_dir = self.get_entry_dir(key)
+        tmp_entry_dir = "{}.{}.tmp".format(entry_dir, os.getpid())
+        if os.path.exists(tmp_entry_dir):
+            shutil.rmtree(tmp_entry_dir)
+        os.makedirs(tmp_entry_dir)
+
+        dtypes = df.dtypes.unique() if df.shape[1] > 0 else []
+        if len(dtypes) == 1 and dtypes[0].kind in "biuf" and \
+                isinstance(dtypes[0], np.dtype):
+            storage_format = "matrix"
+            np.save(os.path.join(tmp_entry_dir, "values.npy"),
+                    np.ascontiguousarray(df.values), allow_pickle=False)
+            with open(os.path.join(tmp_entry_dir, "axes.pkl"), "wb") as f:
+                pickle.dump((df.index, df.columns), f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            f.close()
+        else:
+            storage_format = "frame"
+            df.to_pickle(os.path.join(tmp_entry_dir, "frame.pkl"))
+
+        size = sum(os.path.getsize(os.path.join(tmp_entry_dir, fname))
+                   for fname in os.listdir(tmp_entry_dir))
+        with open(os.path.join(tmp_entry_dir, ENTRY_FILENAME), "w") as f:
+            json.dump({"version": CACHE_VERSION,
+                       "path": os.path.abspath(inpath),
+                       "format": storage_format,
+                       "shape": list(df.shape),
+                       "size": size,
+                       "created": int(time.time())}, f, indent=2)
+        f.close()
+
+        if os.path.exists(entry_dir):
+            shutil.rmtree(entry_dir)
+        try:
+            os.rename(tmp_entry_dir, entry_dir)
+        except OSError:
+            # Another process stored the same entry first.
+            shutil.rmtree(tmp_entry_dir, ignore_errors=True)
+
+        self.evict()
+
+    def list_entries(self):
+        """
+        Method for listing the cache entries, most recently used first.
+
+        :return : list, dicts with the key, path, format, shape, size,
+                  created and last used time of every entry.
+        """
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+
+        for key in os.listdir(self.cache_dir):
+            entry_path = os.path.join(self.cache_dir, key, ENTRY_FILENAME)
+            if not os.path.isfile(entry_path):
+                continue
+            try:
+                with open(entry_path, "r") as f:
+                    entry = json.load(f)
+                f.close()
+            except (OSError, ValueError):
+                continue
+            entry["key"] = key
+            entry["last_used"] = os.path.getmtime(entry_path)
+            entries.append(entry)
+
+        entries.sort(key=lambda entry: entry["last_used"], reverse=True)
+        return entries
+
+    def get_size(self):
+        return sum(entry["size"] for entry in self.list_entries())
+
+    def evict(self, max_size=None):
+        """
+        Method for removing the least recently used entries until the
+        cache is at most max_size bytes.
+
+        :return : int, the number of removed entries.
+        """
+        if max_size is None:
+            max_size = self.max_size
+
+        entries = self.list_entries()
+        total = sum(entry["size"] for entry in entries)
+        n_removed = 0
+        while total > max_size and len(entries) > 0:
+            entry = entries.pop()
+            shutil.rmtree(self.get_entry_dir(entry["key"]), ignore_errors=True)
+            total -= entry["size"]
+            n_removed += 1
+
+        return n_removed
+
+    def remove(self, key):
+        shutil.rmtree(self.get_entry_dir(key), ignore_errors=True)
+
+    def clear(self):
+        return self.evict(max_size=0)
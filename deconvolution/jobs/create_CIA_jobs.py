@@ -64,7 +64,7 @@ class main():
         self.outdir = Path(__file__).parent.absolute()
         self.log_file_outdir = os.path.join(self.outdir, 'output')
         self.time = "05:59:00"
-        self.cores = 1
+        self.cores = getattr(arguments, 'cores')
         self.mem = 2
 
         if not os.path.exists(self.log_file_outdir):
@@ -118,6 +118,11 @@ class main():
                             type=int,
                             required=True,
                             help="The number of samples.")
+        parser.add_argument("-c",
+                            "--cores",
+                            type=int,
+                            default=1,
+                            help="The number of cores per job. Default: 1.")
         parser.add_argument("-e",
                             "--exclude",
                             type=str,
@@ -164,7 +169,7 @@ class main():
                  "module load Python/3.6.3-foss-2015b\n",
                  "source $HOME/venv/bin/activate\n",
                  "\n",
-                 "python3 /groups/umcg-biogen/tmp03/output/2019-11-06-FreezeTwoDotOne/2020-03-12-deconvolution/custom_interaction_analyser.py -n {} -s {}{} -ne {} -ns {}\n".format(self.name, self.settings, skip_rows, batch_size, self.n_samples),
+                 "python3 /groups/umcg-biogen/tmp03/output/2019-11-06-FreezeTwoDotOne/2020-03-12-deconvolution/custom_interaction_analyser.py -n {} -s {}{} -ne {} -ns {} -c {}\n".format(self.name, self.settings, skip_rows, batch_size, self.n_samples, self.cores),
                  "\n",
                  "deactivate\n"]
 
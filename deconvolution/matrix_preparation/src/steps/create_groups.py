@@ -1,7 +1,7 @@
 """
 File:         create_groups.py
 Created:      2020/03/12
-Last Changed: 2020/03/20
+Last Changed: 2020/10/30
 Author:       M.Vochteloo
 
 Copyright (C) 2020 M.Vochteloo
@@ -28,6 +28,7 @@ import os
 # Local application imports.
 from general.utilities import prepare_output_dir, check_file_exists, get_basename
 from general.df_utilities import save_dataframe
+from general.matrix_store import select_dataframe
 
 
 class CreateGroups:
@@ -135,25 +136,29 @@ class CreateGroups:
                 del group_eqtl
 
             if not check_file_exists(geno_outpath) or self.force:
-                group_geno = self.geno_df.iloc[snp_mask, sample_mask].copy()
+                group_geno = select_dataframe(self.geno_df,
+                                              rows=snp_mask, cols=sample_mask)
                 save_dataframe(outpath=geno_outpath, df=group_geno,
                                index=True, header=True)
                 del group_geno
 
             if not check_file_exists(alleles_outpath) or self.force:
-                group_alleles = self.alleles_df.iloc[snp_mask, :].copy()
+                group_alleles = select_dataframe(self.alleles_df,
+                                                 rows=snp_mask)
                 save_dataframe(outpath=alleles_outpath, df=group_alleles,
                                index=True, header=True)
                 del group_alleles
 
             if not check_file_exists(expr_outpath) or self.force:
-                group_expr = self.expr_df.iloc[snp_mask, sample_mask].copy()
+                group_expr = select_dataframe(self.expr_df,
+                                              rows=snp_mask, cols=sample_mask)
                 save_dataframe(outpath=expr_outpath, df=group_expr,
                                index=True, header=True)
                 del group_expr
 
             if not check_file_exists(cov_outpath) or self.force:
-                group_cov = self.cov_df.iloc[:, sample_mask].copy()
+                group_cov = select_dataframe(self.cov_df,
+                                             cols=sample_mask)
                 save_dataframe(outpath=cov_outpath, df=group_cov,
                                index=True, header=True)
                 del group_cov
@@ -1,7 +1,7 @@
 """
 File:         create_matrices.py
 Created:      2020/03/12
-Last Changed: 2020/06/02
+Last Changed: 2020/10/30
 Author:       M.Vochteloo
 
 Copyright (C) 2020 M.Vochteloo
@@ -29,6 +29,8 @@ import os
 # Local application imports.
 from general.utilities import prepare_output_dir, check_file_exists
 from general.df_utilities import load_dataframe
+from general.matrix_store import find_matrix_store, get_store_path, \
+    save_matrix_store
 from general.objects.eqtl import Eqtl
 from general.objects.group import Group
 
@@ -79,6 +81,7 @@ class CreateMatrices:
                 check_file_exists(self.expr_outpath) and \
                 not self.force:
             print("Skipping step.")
+            self.create_matrix_stores()
             return
 
         # Remove the output files.
@@ -211,6 +214,25 @@ class CreateMatrices:
         # Remove old dataframes.
         del geno_df, expr_df
 
+        self.create_matrix_stores()
+
+    def create_matrix_stores(self):
+        """
+        Method for creating the matrix stores of the output files that do
+        not have an up to date one, so later steps can read subsets of the
+        matrices without parsing them.
+        """
+        for outfile in [self.geno_outpath, self.alleles_outpath,
+                        self.expr_outpath]:
+            if find_matrix_store(outfile) is not None:
+                continue
+
+            print("Creating matrix store: "
+                  "{}".format(os.path.basename(get_store_path(outfile))))
+            df = load_dataframe(outfile, header=0, index_col=0)
+            save_matrix_store(df, get_store_path(outfile), source=outfile)
+            del df
+
     @staticmethod
     def write_buffer(filename, buffer):
         """
@@ -1,7 +1,7 @@
 """
 File:         main.py
 Created:      2020/03/19
-Last Changed: 2020/03/20
+Last Changed: 2020/10/30
 Author:       M.Vochteloo
 
 Copyright (C) 2020 M.Vochteloo
@@ -166,10 +166,11 @@ class Main:
             geno_df = load_dataframe(inpath=os.path.join(self.data_indir,
                                                          self.geno_filename),
                                      header=0,
-                                     index_col=0)
-            geno_df = geno_df.iloc[snp_mask, sample_mask]
+                                     index_col=0,
+                                     rows=snp_mask,
+                                     cols=sample_mask)
             save_dataframe(outpath=geno_outpath, df=geno_df,
-                           index=True, header=True)
+                           index=True, header=True, store=True)
             del geno_df
         else:
             print("\tSkipping step.")
@@ -180,10 +181,10 @@ class Main:
             alleles_df = load_dataframe(inpath=os.path.join(self.data_indir,
                                                             self.alleles_filename),
                                         header=0,
-                                        index_col=0)
-            alleles_df = alleles_df.iloc[snp_mask, :]
+                                        index_col=0,
+                                        rows=snp_mask)
             save_dataframe(outpath=alleles_outpath, df=alleles_df,
-                           index=True, header=True)
+                           index=True, header=True, store=True)
             del alleles_df
         else:
             print("\tSkipping step.")
@@ -194,10 +195,11 @@ class Main:
             expr_df = load_dataframe(inpath=os.path.join(self.data_indir,
                                                          self.expr_filename),
                                      header=0,
-                                     index_col=0)
-            expr_df = expr_df.iloc[snp_mask, sample_mask]
+                                     index_col=0,
+                                     rows=snp_mask,
+                                     cols=sample_mask)
             save_dataframe(outpath=expr_outpath, df=expr_df,
-                           index=True, header=True)
+                           index=True, header=True, store=True)
             del expr_df
         else:
             print("\tSkipping step.")
@@ -207,10 +209,10 @@ class Main:
         if not check_file_exists(cov_outpath) or self.force:
             cov_df = load_dataframe(inpath=self.cov_inpath,
                                     header=0,
-                                    index_col=0)
-            cov_df = cov_df.iloc[:, sample_mask].copy()
+                                    index_col=0,
+                                    cols=sample_mask)
             save_dataframe(outpath=cov_outpath, df=cov_df,
-                           index=True, header=True)
+                           index=True, header=True, store=True)
             del cov_df
         else:
             print("\tSkipping step.")
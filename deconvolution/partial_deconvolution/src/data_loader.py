@@ -1,7 +1,7 @@
 """
 File:         data_loader.py
 Created:      2020/06/29
-Last Changed: 2020/09/04
+Last Changed: 2020/10/30
 Author:       M.Vochteloo
 
 Copyright (C) 2020 M.Vochteloo
@@ -22,7 +22,6 @@ root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
 
 # Standard imports.
 from __future__ import print_function
-import gzip
 import json
 import os
 
@@ -31,6 +30,7 @@ import numpy as np
 import pandas as pd
 
 # Local application imports.
+from general.bgzf import open_lines
 
 
 class DataLoader:
@@ -97,7 +97,7 @@ class DataLoader:
         data_collection = []
 
         print("\tLoading expression matrix")
-        with gzip.open(filepath, 'rb') as f:
+        with open_lines(filepath) as f:
             for i, line in enumerate(f):
                 if (i == 0) or (i % 1000 == 0):
                     print("\t\tfound {}/{} genes".format(len(data_collection),
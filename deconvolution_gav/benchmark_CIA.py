@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+
+"""
+File:         benchmark_CIA.py
+Created:      2020/10/30
+Last Changed:
+Author:       M.Vochteloo
+
+Copyright (C) 2020 M.Vochteloo
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+A copy of the GNU General Public License can be found in the LICENSE file in the
+root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Standard imports.
+from __future__ import print_function
+from pathlib import Path
+import subprocess
+import argparse
+import shutil
+import json
+import time
+import sys
+import os
+
+# Third party imports.
+import numpy as np
+import pandas as pd
+
+# Local application imports.
+from synthetic_data import generate_cia_data
+from custom_interaction_analyser.src.shard import Shard
+from utilities import save_dataframe
+
+# Metadata
+__program__ = "Benchmark CIA"
+__author__ = "Martijn Vochteloo"
+__maintainer__ = "Martijn Vochteloo"
+__email__ = "m.vochteloo@rug.nl"
+__license__ = "GPLv3"
+__version__ = 1.0
+__description__ = "{} is a program developed and maintained by {}. " \
+                  "This program is licensed under the {} license and is " \
+                  "provided 'as-is' without any warranty or indemnification " \
+                  "of any kind.".format(__program__,
+                                        __author__,
+                                        __license__)
+
+"""
+Syntax:
+./benchmark_CIA.py -ne 100 -ns 500 -np 10
+./benchmark_CIA.py -ne 1000 -ns 3000 -np 100 -e numpy -c 1 4 8 -o benchmark_large
+"""
+
+# The CIA log lines that start a phase.
+PHASE_MARKERS = [("Loading data", "loading"),
+                 ("Starting interaction analyser", "analysis"),
+                 ("Fitting beta approximation", "beta"),
+                 ("Saving output files", "saving")]
+REFERENCE_ENGINE = "statsmodels"
+COMPARED_ARRAYS = ["pvalues", "coefficients", "std_errors", "perm_pvalues"]
+# The absolute difference below which values agree. The small p-values are
+# the significant results, so those are compared on relative difference
+# only; coefficients can be (close to) zero.
+COMPARED_ATOL = {"pvalues": 1e-300,
+                 "coefficients": 1e-12,
+                 "std_errors": 1e-12,
+                 "perm_pvalues": 1e-300}
+
+
+class main():
+    def __init__(self):
+        # Get the command line arguments.
+        arguments = self.create_argument_parser()
+        self.n_eqtls = getattr(arguments, 'n_eqtls')
+        self.n_samples = getattr(arguments, 'n_samples')
+        self.n_tech_covs = getattr(arguments, 'n_tech_covs')
+        self.n_covs = getattr(arguments, 'n_covs')
+        self.missing_rate = getattr(arguments, 'missing_rate')
+        self.n_perm = getattr(arguments, 'n_permutations')
+        self.engines = getattr(arguments, 'engines')
+        self.cores = getattr(arguments, 'cores')
+        self.seed = getattr(arguments, 'seed')
+        self.tolerance = getattr(arguments, 'tolerance')
+        self.keep = getattr(arguments, 'keep')
+
+        # Set variables.
+        self.current_dir = str(Path(__file__).parent)
+        self.outdir = os.path.abspath(getattr(arguments, 'output'))
+        self.data_dir = os.path.join(self.outdir, "data")
+        self.settings_dir = os.path.join(self.current_dir,
+                                         "custom_interaction_analyser",
+                                         "settings")
+        self.cia_path = os.path.join(self.current_dir,
+                                     "custom_interaction_analyser.py")
+
+    @staticmethod
+    def create_argument_parser():
+        parser = argparse.ArgumentParser(prog=__program__,
+                                         description=__description__)
+
+        # Add optional arguments.
+        parser.add_argument("-v",
+                            "--version",
+                            action="version",
+                            version="{} {}".format(__program__,
+                                                   __version__),
+                            help="show program's version number and exit")
+        parser.add_argument("-ne",
+                            "--n_eqtls",
+                            type=int,
+                            default=100,
+                            help="The number of eQTLs. Default: 100.")
+        parser.add_argument("-ns",
+                            "--n_samples",
+                            type=int,
+                            default=500,
+                            help="The number of samples. Default: 500.")
+        parser.add_argument("-ntc",
+                            "--n_tech_covs",
+                            type=int,
+                            default=4,
+                            help="The number of technical covariates. "
+                                 "Default: 4.")
+        parser.add_argument("-nc",
+                            "--n_covs",
+                            type=int,
+                            default=5,
+                            help="The number of covariates. Default: 5.")
+        parser.add_argument("-mr",
+                            "--missing_rate",
+                            type=float,
+                            default=0.05,
+                            help="The mean fraction of missing genotypes. "
+                                 "Default: 0.05.")
+        parser.add_argument("-np",
+                            "--n_permutations",
+                            type=int,
+                            default=10,
+                            help="The number of permutations. Default: 10.")
+        parser.add_argument("-e",
+                            "--engines",
+                            nargs="+",
+                            type=str,
+                            default=["numpy", "statsmodels"],
+                            choices=["numpy", "statsmodels"],
+                            help="The engines to time. The {} reference is "
+                                 "always run once (single core) to check "
+                                 "the results against. Default: numpy "
+                                 "statsmodels.".format(REFERENCE_ENGINE))
+        parser.add_argument("-c",
+                            "--cores",
+                            nargs="+",
+                            type=int,
+                            default=[1],
+                            help="The core counts to time every engine with. "
+                                 "Default: 1.")
+        parser.add_argument("-seed",
+                            type=int,
+                            default=0,
+                            help="The seed of the data and permutations. "
+                                 "Default: 0.")
+        parser.add_argument("-tol",
+                            "--tolerance",
+                            type=float,
+                            default=1e-6,
+                            help="The maximal relative difference with the "
+                                 "reference. Default: 1e-6.")
+        parser.add_argument("-o",
+                            "--output",
+                            type=str,
+                            default="benchmark",
+                            help="The output directory. Default: "
+                                 "'benchmark'.")
+        parser.add_argument("-keep",
+                            action='store_true',
+                            help="Keep the data and CIA output. "
+                                 "Default: False.")
+
+        return parser.parse_args()
+
+    def start(self):
+        self.print_arguments()
+
+        print("Generating data.", flush=True)
+        if os.path.exists(self.data_dir):
+            shutil.rmtree(self.data_dir)
+        filenames = generate_cia_data(outdir=self.data_dir,
+                                      n_eqtls=self.n_eqtls,
+                                      n_samples=self.n_samples,
+                                      n_tech_covs=self.n_tech_covs,
+                                      n_covs=self.n_covs,
+                                      missing_rate=self.missing_rate,
+                                      seed=self.seed)
+
+        runs = [(REFERENCE_ENGINE, 1)]
+        for engine in self.engines:
+            for cores in self.cores:
+                if (engine, cores) not in runs:
+                    runs.append((engine, cores))
+
+        results = []
+        reference = None
+        settings_paths = []
+        try:
+            for engine, cores in runs:
+                settings_name = "benchmark_{}".format(engine)
+                settings_path = os.path.join(self.settings_dir,
+                                             settings_name + ".json")
+                if settings_path not in settings_paths:
+                    self.write_settings(settings_path, engine, filenames)
+                    settings_paths.append(settings_path)
+
+                print("Running {} engine on {} core(s).".format(engine, cores),
+                      flush=True)
+                run_outdir = os.path.join(self.outdir, "{}_{}".format(engine, cores))
+                result = self.run_cia(settings_name, run_outdir, cores)
+                result["engine"] = engine
+                result["cores"] = cores
+
+                arrays = self.load_arrays(run_outdir)
+                if reference is None:
+                    reference = arrays
+                result.update(self.compare(arrays, reference))
+                self.print_result(result)
+                results.append(result)
+        finally:
+            for settings_path in settings_paths:
+                os.remove(settings_path)
+
+        report_df = pd.DataFrame(results)
+        report_df = report_df.loc[:, ["engine", "cores"] +
+                                     [x for x in report_df.columns if x not in ["engine", "cores"]]]
+        save_dataframe(df=report_df,
+                       outpath=os.path.join(self.outdir, "benchmark.txt"),
+                       header=True, index=False)
+        print("")
+        print(report_df.to_string(index=False))
+
+        if not self.keep:
+            shutil.rmtree(self.data_dir)
+            for engine, cores in runs:
+                shutil.rmtree(os.path.join(self.outdir, "{}_{}".format(engine, cores)))
+
+        if not all(result["agrees"] for result in results):
+            print("Not all engines agree with the {} "
+                  "reference.".format(REFERENCE_ENGINE))
+            exit(1)
+
+    def write_settings(self, settings_path, engine, filenames):
+        with open(os.path.join(self.settings_dir, "default_settings.json"), "r") as f:
+            settings = json.load(f)
+        f.close()
+
+        settings["input_dir"] = self.outdir
+        settings["filenames"] = filenames
+        settings["n_permutations"] = self.n_perm
+        settings["permutation_seed"] = self.seed
+        settings["engine"] = engine
+        settings["adaptive_permutations"] = False
+        settings["beta_approximation"] = False
+        settings["max_runtime_in_hours"] = 24 * 365
+        with open(settings_path, "w") as f:
+            json.dump(settings, f, indent=2)
+        f.close()
+
+    def run_cia(self, settings_name, run_outdir, cores):
+        """
+        Method for running the CIA in a sub process. The phases are timed on
+        the log lines that start them and the peak resident set size is
+        taken from the resource usage of the process.
+        """
+        command = [sys.executable, "-u", self.cia_path,
+                   "-i", os.path.basename(self.data_dir),
+                   "-o", run_outdir,
+                   "-s", settings_name,
+                   "-ne", str(self.n_eqtls),
+                   "-ns", str(self.n_samples),
+                   "-c", str(cores)]
+        log_path = run_outdir + ".log"
+
+        # Start clean, the CIA would otherwise resume from the shards and
+        # checkpoints of an earlier benchmark.
+        if os.path.exists(run_outdir):
+            shutil.rmtree(run_outdir)
+        os.makedirs(run_outdir)
+
+        phases = {}
+        phase = "setup"
+        start_time = time.time()
+        phase_start = start_time
+        process = subprocess.Popen(command, cwd=self.current_dir,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT,
+                                   universal_newlines=True)
+        with open(log_path, "w") as f:
+            for line in process.stdout:
+                f.write(line)
+                for marker, next_phase in PHASE_MARKERS:
+                    if line.strip().startswith(marker):
+                        now = time.time()
+                        phases[phase] = phases.get(phase, 0) + now - phase_start
+                        phase = next_phase
+                        phase_start = now
+                        break
+        f.close()
+        _, status, rusage = os.wait4(process.pid, 0)
+        if os.WIFEXITED(status):
+            process.returncode = os.WEXITSTATUS(status)
+        else:
+            process.returncode = -os.WTERMSIG(status)
+        end_time = time.time()
+        phases[phase] = phases.get(phase, 0) + end_time - phase_start
+
+        if process.returncode != 0:
+            raise RuntimeError("CIA run failed, see {}".format(log_path))
+
+        n_analyses = self.n_eqtls * (self.n_perm + 1)
+        total = end_time - start_time
+        analysis = phases.get("analysis", total)
+        result = {"total_sec": round(total, 2),
+                  "analyses_per_min": round(n_analyses / (max(total, 1e-6) / 60), 2),
+                  "analysis_analyses_per_min": round(n_analyses / (max(analysis, 1e-6) / 60), 2),
+                  "peak_rss_mb": round(rusage.ru_maxrss / 1024, 1)}
+        for _, name in [("", "setup")] + PHASE_MARKERS:
+            result["{}_sec".format(name)] = round(phases.get(name, 0), 2)
+
+        return result
+
+    @staticmethod
+    def load_arrays(run_outdir):
+        arrays = {name: [] for name in ["eqtl_indices"] + COMPARED_ARRAYS}
+        for fpath in Shard.list_shards(os.path.join(run_outdir, "shards")):
+            shard = Shard.load(fpath, mmap_mode=None)
+            if shard is None:
+                continue
+            for name in arrays.keys():
+                arrays[name].append(shard.get_array(name))
+
+        arrays = {name: np.concatenate(values) for name, values in arrays.items()}
+        order = np.argsort(arrays["eqtl_indices"], kind="mergesort")
+        return {name: values[order] for name, values in arrays.items()}
+
+    def compare(self, arrays, reference):
+        """
+        Method for comparing the results of a run with the reference run.
+
+        :return : dict, the maximal relative difference per array and
+                  whether all values are within the tolerance.
+        """
+        comparison = {}
+        agrees = np.array_equal(arrays["eqtl_indices"], reference["eqtl_indices"])
+        for name in COMPARED_ARRAYS:
+            a = np.asarray(arrays[name], dtype=np.float64)
+            b = np.asarray(reference[name], dtype=np.float64)
+            if a.shape != b.shape:
+                comparison["{}_max_rel_diff".format(name)] = np.nan
+                agrees = False
+                continue
+
+            nan_mismatch = np.isnan(a) != np.isnan(b)
+            mask = ~np.isnan(a) & ~np.isnan(b)
+            atol = COMPARED_ATOL[name]
+            diff = np.abs(a[mask] - b[mask])
+            rel_diff = diff / np.maximum(np.abs(b[mask]), 1e-300)
+            rel_diff[diff <= atol] = 0
+            max_rel_diff = float(np.max(rel_diff)) if rel_diff.size > 0 else 0.0
+            comparison["{}_max_rel_diff".format(name)] = max_rel_diff
+            close = np.isclose(a[mask], b[mask], rtol=self.tolerance, atol=atol)
+            if np.any(nan_mismatch) or not np.all(close):
+                agrees = False
+        comparison["agrees"] = bool(agrees)
+
+        return comparison
+
+    @staticmethod
+    def print_result(result):
+        print("\tfinished in {:.2f} second(s) [setup: {:.2f}, loading: {:.2f}, "
+              "analysis: {:.2f}, beta: {:.2f}, saving: {:.2f}]".format(result["total_sec"],
+                                                                       result["setup_sec"],
+                                                                       result["loading_sec"],
+                                                                       result["analysis_sec"],
+                                                                       result["beta_sec"],
+                                                                       result["saving_sec"]))
+        print("\t{:.2f} analyses per minute ({:.2f} during the analysis "
+              "phase)".format(result["analyses_per_min"],
+                              result["analysis_analyses_per_min"]))
+        print("\tpeak RSS: {:.1f} MB".format(result["peak_rss_mb"]))
+        print("\tagrees with reference: {}".format(result["agrees"]),
+              flush=True)
+
+    def print_arguments(self):
+        print("Arguments:")
+        print("  > N eQTLs: {}".format(self.n_eqtls))
+        print("  > N samples: {}".format(self.n_samples))
+        print("  > N technical covariates: {}".format(self.n_tech_covs))
+        print("  > N covariates: {}".format(self.n_covs))
+        print("  > Missing rate: {}".format(self.missing_rate))
+        print("  > N permutations: {}".format(self.n_perm))
+        print("  > Engines: {}".format(self.engines))
+        print("  > Cores: {}".format(self.cores))
+        print("  > Seed: {}".format(self.seed))
+        print("  > Tolerance: {}".format(self.tolerance))
+        print("  > Output directory: {}".format(self.outdir))
+        print("  > Keep: {}".format(self.keep))
+        print("")
+
+
+if __name__ == '__main__':
+    m = main()
+    m.start()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+"""
+File:         create_row_index.py
+Created:      2020/10/29
+Last Changed:
+Author:       M.Vochteloo
+
+Copyright (C) 2020 M.Vochteloo
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+A copy of the GNU General Public License can be found in the LICENSE file in the
+root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Standard imports.
+from __future__ import print_function
+import argparse
+import time
+import os
+
+# Third party imports.
+
+# Local application imports.
+from bgzf import is_bgzf
+from row_index import convert_to_bgzf, build_row_index
+
+# Metadata
+__program__ = "Create Row Index"
+__author__ = "Martijn Vochteloo"
+__maintainer__ = "Martijn Vochteloo"
+__email__ = "m.vochteloo@rug.nl"
+__license__ = "GPLv3"
+__version__ = 1.0
+__description__ = "{} is a program developed and maintained by {}. " \
+                  "This program is licensed under the {} license and is " \
+                  "provided 'as-is' without any warranty or indemnification " \
+                  "of any kind.".format(__program__,
+                                        __author__,
+                                        __license__)
+
+"""
+Syntax:
+./create_row_index.py -m /path/to/genotype_table.txt.gz /path/to/expression_table.txt.gz -convert
+"""
+
+
+class main():
+    def __init__(self):
+        # Get the command line arguments.
+        arguments = self.create_argument_parser()
+        self.matrices = getattr(arguments, 'matrices')
+        self.convert = getattr(arguments, 'convert')
+
+    @staticmethod
+    def create_argument_parser():
+        parser = argparse.ArgumentParser(prog=__program__,
+                                         description=__description__)
+
+        # Add optional arguments.
+        parser.add_argument("-v",
+                            "--version",
+                            action="version",
+                            version="{} {}".format(__program__,
+                                                   __version__),
+                            help="show program's version number and exit")
+        parser.add_argument("-m",
+                            "--matrices",
+                            nargs="+",
+                            type=str,
+                            required=True,
+                            help="The paths of the matrices to index.")
+        parser.add_argument("-convert",
+                            action='store_true',
+                            help="Rewrite regular gzip files as BGZF (still "
+                                 "gzip compatible) so they can be indexed. "
+                                 "Default: False.")
+
+        return parser.parse_args()
+
+    def start(self):
+        self.print_arguments()
+
+        for inpath in self.matrices:
+            if not os.path.isfile(inpath):
+                print("File {} does not exist".format(inpath))
+                continue
+
+            start_time = time.time()
+            print("Indexing {}".format(os.path.basename(inpath)), flush=True)
+            if inpath.endswith(".gz") and not is_bgzf(inpath):
+                if not self.convert:
+                    print("\t{} is not BGZF compressed, use -convert to "
+                          "rewrite it".format(os.path.basename(inpath)))
+                    continue
+
+                print("\tConverting to BGZF", flush=True)
+                convert_to_bgzf(inpath)
+
+            outpath = build_row_index(inpath)
+            print("\tCreated {} in {:.2f} second(s)".format(os.path.basename(outpath),
+                                                          time.time() - start_time),
+                  flush=True)
+
+    def print_arguments(self):
+        print("Arguments:")
+        print("  > Matrices: {}".format(", ".join(self.matrices)))
+        print("  > Convert: {}".format(self.convert))
+        print("")
+
+
+if __name__ == '__main__':
+    m = main()
+    m.start()
@@ -3,7 +3,7 @@
 """
 File:         custom_interaction_analyser.py
 Created:      2020/10/15
-Last Changed: 2020/10/27
+Last Changed: 2020/10/30
 Author:       M.Vochteloo
 
 Copyright (C) 2020 M.Vochteloo
@@ -28,6 +28,7 @@ root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
 
 # Local application imports.
 from custom_interaction_analyser.src.main import Main
+from custom_interaction_analyser.src.local_runner import LocalRunner
 from custom_interaction_analyser.src.combiner import Combine
 from custom_interaction_analyser.src.cmd_line_arguments import \
     CommandLineArguments
@@ -54,24 +55,53 @@ if __name__ == '__main__':
     OUTPUT = CLA.get_argument("output")
     SETTINGS_FILE = CLA.get_argument("settings")
     COMBINE = CLA.get_argument("combine")
+    LOCAL = CLA.get_argument("local")
 
     if OUTPUT is None:
         OUTPUT = INPUT
 
     if COMBINE:
         ALPHA = CLA.get_argument("alpha")
+        BETA = CLA.get_argument("beta")
+        PER_COVARIATE = CLA.get_argument("per_covariate")
+        TSV = CLA.get_argument("tsv")
         FORCE = CLA.get_argument("force")
+        CORES = CLA.get_argument("cores")
 
         # Start the program.
         PROGRAM = Combine(input_folder=OUTPUT,
                           settings_file=SETTINGS_FILE,
                           alpha=ALPHA,
-                          force=FORCE)
+                          beta=BETA,
+                          per_covariate=PER_COVARIATE,
+                          export_tsv=TSV,
+                          force=FORCE,
+                          cores=CORES)
+        PROGRAM.start()
+    elif LOCAL:
+        SKIP_ROWS = CLA.get_argument("skip_rows")
+        N_EQTLS = CLA.get_argument("n_eqtls")
+        N_SAMPLES = CLA.get_argument("n_samples")
+        CORES = CLA.get_argument("cores")
+        CHUNK_SIZE = CLA.get_argument("chunk_size")
+        VERBOSE = CLA.get_argument("verbose")
+
+        # Start the program.
+        PROGRAM = LocalRunner(input_folder=INPUT,
+                              output_folder=OUTPUT,
+                              settings_file=SETTINGS_FILE,
+                              skip_rows=SKIP_ROWS,
+                              n_eqtls=N_EQTLS,
+                              n_samples=N_SAMPLES,
+                              cores=CORES,
+                              chunk_size=CHUNK_SIZE,
+                              verbose=VERBOSE)
         PROGRAM.start()
     else:
         SKIP_ROWS = CLA.get_argument("skip_rows")
         N_EQTLS = CLA.get_argument("n_eqtls")
         N_SAMPLES = CLA.get_argument("n_samples")
+        CORES = CLA.get_argument("cores")
         VERBOSE = CLA.get_argument("verbose")
 
         # Start the program.
@@ -81,5 +111,6 @@ if __name__ == '__main__':
                        skip_rows=SKIP_ROWS,
                        n_eqtls=N_EQTLS,
                        n_samples=N_SAMPLES,
+                       cores=CORES,
                        verbose=VERBOSE)
         PROGRAM.start()
@@ -0,0 +1,136 @@
+"""
+File:         beta_approximation.py
+Created:      2020/10/30
+Last Changed:
+Author:       M.Vochteloo
+
+Copyright (C) 2020 M.Vochteloo
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+A copy of the GNU General Public License can be found in the LICENSE file in the
+root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Standard imports.
+
+# Third party imports.
+import numpy as np
+from scipy import special, stats
+
+# Local application imports.
+
+
+class BetaApproximation:
+    """
+    Beta approximation of the permutation p-values (as in FastQTL). Per
+    eQTL a beta distribution is fitted to the minimum p-value over the
+    covariates of every permutation, and the real p-values of the eQTL are
+    adjusted with the CDF of that fit. The adjusted p-value of the best
+    covariate is the eQTL level p-value, corrected for testing all
+    covariates. The shape parameters are initialised with the method of
+    moments and refined with Newton-Raphson steps on the log-likelihood,
+    for all eQTLs at once.
+    """
+    MIN_PERMUTATIONS = 10
+    N_ITERATIONS = 20
+    EPS = 1e-300
+
+    @staticmethod
+    def get_min_perm_pvalues(perm_pvalues):
+        """
+        Method for taking the minimum permuted p-value over the covariates.
+
+        :param perm_pvalues: ndarray, the permuted p-values (eQTLs x
+                             covariates x n_perm).
+        :return : ndarray, the minimum of every permutation (eQTLs x
+                  n_perm), NaN if all covariates are NaN.
+        """
+        perm_pvalues = np.asarray(perm_pvalues, dtype=np.float64)
+        min_pvalues = np.where(np.isnan(perm_pvalues), np.inf,
+                               perm_pvalues).min(axis=-2)
+        min_pvalues[np.isinf(min_pvalues)] = np.nan
+
+        return min_pvalues
+
+    @staticmethod
+    def fit(perm_pvalues):
+        """
+        Method for fitting the beta distributions.
+
+        :param perm_pvalues: ndarray, the permuted p-values with the
+                             permutations on the last axis (... x n_perm).
+                             NaN values are ignored.
+        :return shape1: ndarray, the alpha parameters (...).
+        :return shape2: ndarray, the beta parameters (...).
+        """
+        perm_pvalues = np.asarray(perm_pvalues, dtype=np.float64)
+        mask = ~np.isnan(perm_pvalues)
+        n = mask.sum(axis=-1).astype(np.float64)
+        x = np.clip(np.where(mask, perm_pvalues, 0.5),
+                    BetaApproximation.EPS, 1 - 1e-16)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Method of moments start values.
+            mean = np.where(mask, x, 0).sum(axis=-1) / n
+            var = np.where(mask, (x - mean[..., np.newaxis]) ** 2, 0).sum(axis=-1) / (n - 1)
+            common = mean * (1 - mean) / var - 1
+            shape1 = mean * common
+            shape2 = (1 - mean) * common
+
+            valid = (n >= BetaApproximation.MIN_PERMUTATIONS) & \
+                    (shape1 > 0) & (shape2 > 0) & \
+                    np.isfinite(shape1) & np.isfinite(shape2)
+            shape1 = np.where(valid, shape1, 1.0)
+            shape2 = np.where(valid, shape2, 1.0)
+
+            # Maximum likelihood refinement.
+            sum_log_x = np.where(mask, np.log(x), 0).sum(axis=-1)
+            sum_log_1mx = np.where(mask, np.log1p(-x), 0).sum(axis=-1)
+            for _ in range(BetaApproximation.N_ITERATIONS):
+                psi_ab = special.digamma(shape1 + shape2)
+                grad1 = n * (psi_ab - special.digamma(shape1)) + sum_log_x
+                grad2 = n * (psi_ab - special.digamma(shape2)) + sum_log_1mx
+                tri_ab = special.polygamma(1, shape1 + shape2)
+                hess11 = n * (tri_ab - special.polygamma(1, shape1))
+                hess22 = n * (tri_ab - special.polygamma(1, shape2))
+                hess12 = n * tri_ab
+                det = hess11 * hess22 - hess12 ** 2
+                step1 = (hess22 * grad1 - hess12 * grad2) / det
+                step2 = (hess11 * grad2 - hess12 * grad1) / det
+
+                # Halve the step when it would leave the parameter space.
+                new_shape1 = shape1 - step1
+                new_shape2 = shape2 - step2
+                outside = ~((new_shape1 > 0) & (new_shape2 > 0) &
+                            np.isfinite(new_shape1) & np.isfinite(new_shape2))
+                new_shape1 = np.where(outside, shape1 / 2, new_shape1)
+                new_shape2 = np.where(outside, shape2 / 2, new_shape2)
+                shape1 = np.where(valid, new_shape1, shape1)
+                shape2 = np.where(valid, new_shape2, shape2)
+
+        shape1 = np.where(valid, shape1, np.nan)
+        shape2 = np.where(valid, shape2, np.nan)
+
+        return shape1, shape2
+
+    @staticmethod
+    def get_pvalues(pvalues, shape1, shape2):
+        """
+        Method for adjusting the real p-values with the fitted beta
+        distributions.
+
+        :param pvalues: ndarray, the real p-values.
+        :param shape1: ndarray, the alpha parameters.
+        :param shape2: ndarray, the beta parameters.
+        :return : ndarray, the adjusted p-values.
+        """
+        return stats.beta.cdf(pvalues, shape1, shape2)
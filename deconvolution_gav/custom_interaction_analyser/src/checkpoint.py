@@ -0,0 +1,163 @@
+"""
+File:         checkpoint.py
+Created:      2020/10/29
+Last Changed: 2020/10/30
+Author:       M.Vochteloo
+
+Copyright (C) 2020 M.Vochteloo
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+A copy of the GNU General Public License can be found in the LICENSE file in the
+root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Standard imports.
+import struct
+import json
+import os
+
+# Third party imports.
+import numpy as np
+
+# Local application imports.
+
+
+class Checkpoint:
+    """
+    Append-only checkpoint file with the results of finished eQTLs.
+
+    The file starts with a magic string, the length of a JSON header and
+    the header itself. The header describes the fields of a record and the
+    settings the results depend on (e.g. the permutation seed); a
+    checkpoint written with other settings is discarded. Every
+    record is the eQTL index followed by the flattened fields, all
+    float64, so all records have the same size and a record that was
+    only partially written when the job got killed is simply ignored.
+    """
+    MAGIC = b"CIACKPT1"
+
+    def __init__(self, fpath, fields, flush_every=1, metadata=None):
+        """
+        :param fpath: string, the checkpoint file path.
+        :param fields: list, (name, shape) tuples describing a record.
+        :param flush_every: int, the number of eQTLs to buffer before they
+                            are written to disk.
+        :param metadata: dict, the settings the records depend on.
+        """
+        self.fpath = fpath
+        self.fields = [(name, tuple(shape)) for name, shape in fields]
+        self.flush_every = max(1, flush_every)
+        if metadata is None:
+            metadata = {}
+        self.header = json.dumps({"version": 2,
+                                  "fields": self.fields,
+                                  "metadata": metadata},
+                                 sort_keys=True).encode()
+        self.record_size = 1 + sum(int(np.prod(shape)) for _, shape in self.fields)
+        self.data_offset = len(self.MAGIC) + 4 + len(self.header)
+        self.buffer = []
+
+    def load(self):
+        """
+        Method for loading the records of an existing checkpoint file. If
+        the file does not exist or has a different layout it is replaced by
+        an empty checkpoint. This also happens if it was written with
+        different metadata.
+
+        :return : dict, eQTL index -> dict with the field arrays.
+        """
+        records = {}
+        if os.path.isfile(self.fpath):
+            with open(self.fpath, "rb") as f:
+                magic = f.read(len(self.MAGIC))
+                header_length = f.read(4)
+                header = b""
+                if magic == self.MAGIC and len(header_length) == 4:
+                    header = f.read(struct.unpack("<I", header_length)[0])
+                if header == self.header:
+                    data = np.fromfile(f, dtype=np.float64)
+                elif self.get_metadata(header) != self.get_metadata(self.header):
+                    print("\tcheckpoint was written with different settings, "
+                          "starting over")
+                    data = None
+                else:
+                    print("\tinvalid checkpoint, starting over")
+                    data = None
+            f.close()
+
+            if data is not None:
+                n_records = data.size // self.record_size
+                data = data[:n_records * self.record_size].reshape(n_records, self.record_size)
+                for row in data:
+                    records[int(row[0])] = self.unpack(row[1:])
+
+                # Cut off a partially written record.
+                with open(self.fpath, "r+b") as f:
+                    f.truncate(self.data_offset + n_records * self.record_size * 8)
+                f.close()
+
+                return records
+
+        with open(self.fpath, "wb") as f:
+            f.write(self.MAGIC)
+            f.write(struct.pack("<I", len(self.header)))
+            f.write(self.header)
+        f.close()
+
+        return records
+
+    @staticmethod
+    def get_metadata(header):
+        try:
+            return json.loads(header.decode()).get("metadata")
+        except (ValueError, AttributeError):
+            return None
+
+    def unpack(self, values):
+        record = {}
+        start = 0
+        for name, shape in self.fields:
+            size = int(np.prod(shape))
+            record[name] = values[start:start + size].reshape(shape)
+            start += size
+        return record
+
+    def add(self, eqtl_index, record):
+        """
+        Method for adding the results of an eQTL.
+
+        :param eqtl_index: int, the eQTL index.
+        :param record: dict, field name -> array.
+        """
+        row = [np.array([eqtl_index], dtype=np.float64)]
+        for name, shape in self.fields:
+            row.append(np.asarray(record[name], dtype=np.float64).ravel())
+        self.buffer.append(np.concatenate(row))
+
+        if len(self.buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffer) == 0:
+            return
+
+        with open(self.fpath, "ab") as f:
+            f.write(np.vstack(self.buffer).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        f.close()
+        self.buffer = []
+
+    def remove(self):
+        self.buffer = []
+        if os.path.isfile(self.fpath):
+            os.remove(self.fpath)
@@ -1,7 +1,7 @@
 """
 File:         cmd_line_arguments.py
 Created:      2020/10/15
-Last Changed: 2020/10/27
+Last Changed: 2020/10/30
 Author:       M.Vochteloo
 
 Copyright (C) 2020 M.Vochteloo
@@ -87,6 +87,11 @@ class CommandLineArguments:
                             default=None,
                             help="The number of samples in the input files, "
                                  "default: None (determine automatically).")
+        parser.add_argument("-c",
+                            "--cores",
+                            type=int,
+                            default=1,
+                            help="The number of cores to use, default: 1.")
         parser.add_argument("-a",
                             "--alpha",
                             type=float,
@@ -96,10 +101,39 @@ class CommandLineArguments:
                             action='store_true',
                             help="Include steps and command prints, "
                                  "default: False.")
+        parser.add_argument("-local",
+                            action='store_true',
+                            help="Run the full eQTL range on this machine, "
+                                 "handing out chunks of eQTLs to -c / "
+                                 "--cores worker processes and writing a "
+                                 "shard per chunk. Default: False.")
+        parser.add_argument("-chunk",
+                            "--chunk_size",
+                            type=int,
+                            default=10,
+                            help="The number of eQTLs per chunk of the local "
+                                 "runner. Default: 10.")
         parser.add_argument("-combine",
                             action='store_true',
                             help="Combine the created files, alternative "
                                  "functionality. Default: False.")
+        parser.add_argument("-beta",
+                            action='store_true',
+                            help="Use the beta approximation of the "
+                                 "permutation p-values (fitted per eQTL "
+                                 "on the minimum over the covariates) "
+                                 "instead of the permutation FDR when "
+                                 "combining. Default: False.")
+        parser.add_argument("-per_covariate",
+                            action='store_true',
+                            help="Calculate the permutation FDR per "
+                                 "covariate instead of over all covariates "
+                                 "when combining. Default: False.")
+        parser.add_argument("-tsv",
+                            action='store_true',
+                            help="Also export the combined results as the "
+                                 "pivoted and molten TSV tables. "
+                                 "Default: False.")
         parser.add_argument("-force",
                             action='store_true',
                             help="Combine the created files with force."
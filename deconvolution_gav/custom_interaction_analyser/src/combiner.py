@@ -1,7 +1,7 @@
 """
 File:         combiner.py
 Created:      2020/10/15
-Last Changed: 2020/10/28
+Last Changed: 2020/10/30
 Author:       M.Vochteloo
 
 Copyright (C) 2020 M.Vochteloo
@@ -23,10 +23,12 @@ root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
 # Standard imports.
 from __future__ import print_function
 from pathlib import Path
-from bisect import bisect_left
 from itertools import groupby, count
+from functools import partial
 import random
+import shutil
 import pickle
+import json
 import glob
 import time
 import os
@@ -34,16 +36,30 @@ import os
 # Third party imports.
 import numpy as np
 import pandas as pd
-from scipy import stats
 
 # Local application imports.
+from .shard import Shard
+from .shard_manifest import ShardManifest
 from local_settings import LocalSettings
 from utilities import check_file_exists, save_dataframe, load_dataframe
+from parallel_loading import imap_bounded, assemble_rows
+from results_store import ResultsStore, write_store
+from results_index import build_results_index
+from multiple_testing import calc_zscores, calc_bh_fdr, PermutationCounter
 
 
 class Combine:
-    def __init__(self, input_folder, settings_file, alpha, force):
+    # The shard arrays that are kept in the combined shard.
+    COMBINED_ARRAYS = ["eqtl_indices", "names", "pvalues", "coefficients",
+                       "std_errors", "beta_pvalues"]
+
+    def __init__(self, input_folder, settings_file, alpha, beta,
+                 per_covariate, export_tsv, force, cores=1):
         self.alpha = alpha
+        self.export_tsv = export_tsv
+        self.cores = cores
+        self.beta = beta
+        self.per_covariate = per_covariate
         self.force = force
 
         # Define the current directory.
@@ -60,8 +76,35 @@ class Combine:
         self.coef_filename = settings.get_setting("coef_pickle_filename")
         self.std_err_filename = settings.get_setting("std_err_pickle_filename")
         self.tvalue_filename = settings.get_setting("tvalue_pickle_filename")
+        self.beta_pvalues_filename = settings.get_setting("beta_pvalues_filename")
+        if self.beta_pvalues_filename is None:
+            self.beta_pvalues_filename = "beta_pvalue_data"
         self.perm_pvalues_filename = settings.get_setting("permuted_pvalues_pickle_filename")
         self.n_perm = settings.get_setting("n_permutations")
+        self.adaptive_perm = settings.get_setting("adaptive_permutations")
+        if self.adaptive_perm is None:
+            self.adaptive_perm = False
+        shard_folder = settings.get_setting("shard_folder")
+        if shard_folder is None:
+            shard_folder = "shards"
+        self.shard_dir = os.path.join(self.work_dir, shard_folder)
+        self.manifest_path = os.path.join(self.work_dir, ShardManifest.FILENAME)
+        self.combined_dir = os.path.join(self.work_dir, "combined")
+        self.coverage_path = os.path.join(self.work_dir, "coverage_report.json")
+        self.coverage = None
+        store_folder = settings.get_setting("results_store_folder")
+        if store_folder is None:
+            store_folder = "results_store"
+        self.store_dir = os.path.join(self.work_dir, store_folder)
+        self.partition_by = settings.get_setting("results_partition_by")
+        if self.partition_by is None:
+            self.partition_by = "covariate"
+        self.eqtl_block_size = settings.get_setting("results_eqtl_block_size")
+        if self.eqtl_block_size is None:
+            self.eqtl_block_size = 10000
+        self.eqtl_path = settings.get_setting("results_eqtl_file")
+        if not self.eqtl_path:
+            self.eqtl_path = None
 
     def start(self):
         print("Starting interaction analyser - combine and plot.")
@@ -72,24 +115,38 @@ class Combine:
 
         print("")
         print("### Step 1 ###")
-        print("Combine pickle files into dataframe.", flush=True)
+        print("Combine shards into dataframe.", flush=True)
+        shards = self.load_shards(self.shard_dir)
+        combined = None
+        updated = True
+        if len(shards) == 0:
+            print("\tNo shards found, falling back on pickle files.")
+        else:
+            combined, updated = self.update_combined(shards)
         dataframes = {}
-        for filename in [self.pvalues_filename,
-                         self.coef_filename,
-                         self.std_err_filename]:
+        data_arrays = [(self.pvalues_filename, "pvalues"),
+                       (self.coef_filename, "coefficients"),
+                       (self.std_err_filename, "std_errors")]
+        if self.beta:
+            data_arrays.append((self.beta_pvalues_filename, "beta_pvalues"))
+        for filename, array_name in data_arrays:
             outpath = os.path.join(self.work_dir, "{}_table.txt.gz".format(filename))
-            if not check_file_exists(outpath) or self.force:
+            if not check_file_exists(outpath) or self.force or updated:
                 print("Loading {} data.".format(filename), flush=True)
-                columns, data = self.combine_pickles(self.work_dir,
-                                                     filename,
-                                                     columns=True)
-
-                if len(data) == 0:
+                if combined is not None:
+                    columns, data = self.combine_shards([combined], array_name)
+                else:
+                    columns, data = self.combine_pickles(self.work_dir,
+                                                         filename,
+                                                         columns=True)
+
+                if sum(len(part[0]) for part in data) == 0:
                     print("\tNo {} data found.".format(filename))
                     continue
 
                 print("Creating {} dataframe.".format(filename), flush=True)
                 df = self.create_df(data, columns)
+                del columns, data
 
                 print("Saving {} dataframe.".format(filename), flush=True)
                 save_dataframe(df=df,
@@ -98,18 +155,24 @@ class Combine:
 
                 dataframes[filename] = df
 
-                del columns, data, df
+                del df
             else:
                 print("Skipping step for {}".format(outpath))
-                dataframes[filename] = load_dataframe(outpath,
-                                                      header=0,
-                                                      index_col=0)
+                df = load_dataframe(outpath, header=0, index_col=0)
+                # Missing eQTLs are saved without a name, which pandas reads
+                # back as 'Unnamed: <position>'.
+                df.columns = [np.nan if str(x).startswith("Unnamed: ") else x
+                              for x in df.columns]
+                dataframes[filename] = df
+                del df
+        if combined is None and self.coverage is not None:
+            self.save_coverage_report(*self.coverage)
 
         print("")
         print("### Step 2 ###")
         print("Calculate t-values", flush=True)
         outpath = os.path.join(self.work_dir,"{}_table.txt.gz".format(self.tvalue_filename))
-        if not check_file_exists(outpath) or self.force:
+        if not check_file_exists(outpath) or self.force or updated:
             if self.coef_filename in dataframes and self.std_err_filename in dataframes:
                 # Calculate t-values
                 coef_df = dataframes[self.coef_filename]
@@ -154,6 +217,8 @@ class Combine:
             return
 
         pvalue_df = dataframes[self.pvalues_filename]
+        pvalue_df_raw_indices = list(pvalue_df.index)
+        pvalue_df_raw_columns = list(pvalue_df.columns)
         pvalue_df_columns = ["{}_{}".format(x, i) for i, x in enumerate(pvalue_df.columns)]
         pvalue_df.columns = pvalue_df_columns
         pvalue_df_indices = ["{}_{}".format(x, i) for i, x in enumerate(pvalue_df.index)]
@@ -169,53 +234,97 @@ class Combine:
         print("\t{}/{} [{:.2f}%] of pvalues < {}".format(n_signif, n_total, (100/n_total)*n_signif, self.alpha), flush=True)
 
         print("Adding z-scores.", flush=True)
-        dfm["zscore"] = stats.norm.isf(dfm["pvalue"])
-        dfm.loc[dfm["pvalue"] > (1.0 - 1e-16), "zscore"] = -8.209536151601387
-        dfm.loc[dfm["pvalue"] < 1e-323, "zscore"] = 38.44939448087599
-        self.pivot_and_save(dfm, "zscore", pvalue_df_indices, pvalue_df_columns)
+        dfm["zscore"] = calc_zscores(dfm["pvalue"].values)
+        table_columns = ["zscore"]
 
         print("Adding BH-FDR.", flush=True)
-        dfm["BH-FDR"] = dfm["pvalue"] * (n_total / (dfm["rank"] + 1))
-        dfm.loc[dfm["BH-FDR"] > 1, "BH-FDR"] = 1
-        prev_bh_fdr = -np.Inf
-        for i in range(n_total):
-            bh_fdr = dfm.loc[i, "BH-FDR"]
-            if bh_fdr > prev_bh_fdr:
-                prev_bh_fdr = bh_fdr
-            else:
-                dfm.loc[i, "BH-FDR"] = prev_bh_fdr
+        dfm["BH-FDR"] = calc_bh_fdr(dfm["pvalue"].values)
         n_signif = dfm[dfm["BH-FDR"] < self.alpha].shape[0]
         print("\t{}/{} [{:.2f}%] of BH-FDR values < {}".format(n_signif, n_total, (100/n_total)*n_signif, self.alpha), flush=True)
-        self.pivot_and_save(dfm, "BH-FDR", pvalue_df_indices, pvalue_df_columns)
-
-        print("Adding permutation FDR.", flush=True)
-        print("\tLoading permutation pvalue data.", flush=True)
-        _, perm_pvalues = self.combine_pickles(self.work_dir,
-                                               self.perm_pvalues_filename)
-        # perm_pvalues = [random.random() for _ in range(n_total * 10)]
-        print("Sorting p-values.", flush=True)
-        perm_pvalues = sorted(perm_pvalues)
-
-        if len(perm_pvalues) > 0:
-            n_perm = len(perm_pvalues) / n_total
-            if n_perm != self.n_perm:
-                print("\tWARNING: not all permutation pvalus are present")
-            perm_ranks = []
-            for pvalue in dfm["pvalue"]:
-                perm_ranks.append(bisect_left(perm_pvalues, pvalue))
-            dfm["perm-rank"] = perm_ranks
-            dfm["perm-FDR"] = (dfm["perm-rank"] / n_perm) / dfm["rank"]
-            dfm.loc[(dfm.index == 0) | (dfm["perm-rank"] == 0), "perm-FDR"] = 0
-            dfm.loc[dfm["perm-FDR"] > 1, "perm-FDR"] = 1
-
-            self.pivot_and_save(dfm, "perm-FDR", pvalue_df_indices,
-                                pvalue_df_columns)
-
-        print("Saving full dataframe.", flush=True)
-        save_dataframe(df=dfm,
-                       outpath=os.path.join(self.work_dir,
-                                            "molten_table.txt.gz"),
-                       header=True, index=True)
+        table_columns.append("BH-FDR")
+
+        if self.beta:
+            print("Adding beta approximation FDR.", flush=True)
+            if self.beta_pvalues_filename not in dataframes:
+                print("\tNo beta approximation data found.")
+            else:
+                beta_df = dataframes[self.beta_pvalues_filename]
+                if list(beta_df.index) != pvalue_df_raw_indices or \
+                        list(beta_df.columns) != pvalue_df_raw_columns:
+                    print("\tBeta approximation data does not match the "
+                          "pvalue data.")
+                else:
+                    # The molten data frame is ordered column by column.
+                    dfm["beta-pvalue"] = beta_df.values.ravel(order="F")
+                    beta_pvalues = dfm["beta-pvalue"].values.reshape(-1, beta_df.shape[0])
+                    dfm["beta-FDR"] = self.calc_beta_fdr(beta_pvalues).ravel()
+                    n_signif = dfm[dfm["beta-FDR"] < self.alpha].shape[0]
+                    print("\t{}/{} [{:.2f}%] of beta-FDR values < {}".format(n_signif, n_total, (100/n_total)*n_signif, self.alpha), flush=True)
+                    table_columns.append("beta-FDR")
+        else:
+            print("Adding permutation FDR.", flush=True)
+            print("\tCounting permutation pvalue data.", flush=True)
+            # The molten data frame is ordered eQTL by eQTL, so the
+            # covariate of every row is its position within the eQTL.
+            n_covariates = len(pvalue_df_indices)
+            pvalues = dfm["pvalue"].values.reshape(-1, n_covariates)
+            counts = self.count_perm_pvalues(shards, pvalues, combined)
+            if counts is not None:
+                counters, fdr_n_perm = counts
+                perm_ranks = np.empty(pvalues.shape, dtype=np.int64)
+                perm_fdr = np.empty(pvalues.shape, dtype=np.float64)
+                n_perm_pvalues = 0
+                for columns, counter in counters:
+                    perm_ranks[:, columns] = counter.get_counts()
+                    perm_fdr[:, columns] = counter.get_fdr(fdr_n_perm)
+                    n_perm_pvalues += counter.get_n_perm_pvalues()
+
+                n_perm = n_perm_pvalues / n_total
+                if n_perm != self.n_perm and not self.adaptive_perm:
+                    print("\tWARNING: not all permutation pvalus are present")
+                dfm["perm-rank"] = perm_ranks.ravel()
+                dfm["perm-FDR"] = perm_fdr.ravel()
+                n_signif = dfm[dfm["perm-FDR"] < self.alpha].shape[0]
+                print("\t{}/{} [{:.2f}%] of perm-FDR values < {}".format(n_signif, n_total, (100/n_total)*n_signif, self.alpha), flush=True)
+
+                table_columns.append("perm-FDR")
+
+        print("Saving results store.", flush=True)
+        n_covariates = len(pvalue_df_raw_indices)
+        n_eqtls = len(pvalue_df_raw_columns)
+        covariates = [str(x) for x in pvalue_df_raw_indices]
+        # eQTLs missing from the CIA output have no name.
+        eqtls = ["" if pd.isna(x) else str(x) for x in pvalue_df_raw_columns]
+        covariate_indices = np.tile(np.arange(n_covariates), n_eqtls)
+        eqtl_indices = np.repeat(np.arange(n_eqtls), n_covariates)
+        dfm["covariate"] = np.array(covariates, dtype=object)[covariate_indices]
+        dfm["SNP"] = np.array(eqtls, dtype=object)[eqtl_indices]
+        dfm.insert(2, "covariate_index", covariate_indices)
+        dfm.insert(3, "eqtl_index", eqtl_indices)
+        write_store(outdir=self.store_dir,
+                    df=dfm,
+                    covariates=covariates,
+                    eqtls=eqtls,
+                    partition_by=self.partition_by,
+                    eqtl_block_size=self.eqtl_block_size,
+                    first_eqtl_index=self.get_first_eqtl_index(combined))
+        print("\tSaved results store: {} with {} rows".format(os.path.basename(self.store_dir),
+                                                            dfm.shape[0]))
+        try:
+            build_results_index(self.store_dir, eqtl_path=self.eqtl_path)
+            print("\tSaved results lookup index")
+        except ValueError as e:
+            print("\tWARNING: could not build the results lookup "
+                  "index: {}".format(e))
+
+        if self.export_tsv:
+            print("Exporting TSV tables.", flush=True)
+            store = ResultsStore(self.store_dir)
+            for col in table_columns:
+                store.export_table(col, os.path.join(self.work_dir,
+                                                     "{}_table.txt.gz".format(col)))
+            store.export_molten(os.path.join(self.work_dir,
+                                             "molten_table.txt.gz"))
         print("")
 
         # Print the time.
@@ -226,86 +335,445 @@ class Combine:
                                      int(run_time_min),
                                      int(run_time_sec)), flush=True)
 
+    def load_shards(self, indir):
+        fpaths = Shard.list_shards(indir)
+        loaded = [None] * len(fpaths)
+        for i, shard in imap_bounded(Shard.load, fpaths, n_workers=self.cores):
+            loaded[i] = shard
+
+        shards = []
+        covariates = None
+        for fpath, shard in zip(fpaths, loaded):
+            if shard is None:
+                continue
+            if covariates is None:
+                covariates = shard.get_covariates()
+            elif shard.get_covariates() != covariates:
+                print("\t\tCovariates do not match in: "
+                      "{}".format(os.path.basename(fpath)))
+                continue
+            shards.append(shard)
+
+        return shards
+
+    def update_combined(self, shards):
+        """
+        Merge the new and replaced shards into the combined shard, so
+        shards that were combined before are not read again.
+
+        :param shards: list, the loaded shards.
+        :return combined: Shard, the combined shard.
+        :return updated: boolean, whether the combined shard changed.
+        """
+        covariates = shards[0].get_covariates()
+        array_names = [name for name in self.COMBINED_ARRAYS
+                       if all(name in shard.get_array_names() for shard in shards)]
+
+        manifest = None
+        combined = None
+        if not self.force:
+            manifest = ShardManifest.load(self.manifest_path)
+            combined_paths = Shard.list_shards(self.combined_dir)
+            if len(combined_paths) == 1:
+                combined = Shard.load(combined_paths[0])
+        if manifest is None or combined is None or \
+                manifest.get_covariates() != covariates or \
+                combined.get_covariates() != covariates or \
+                sorted(combined.get_array_names()) != sorted(array_names + ["sources"]):
+            manifest = ShardManifest(covariates)
+            combined = None
+
+        new, replaced, unchanged, removed = manifest.compare(shards)
+        print("\tShards: {} new, {} replaced, {} unchanged, "
+              "{} removed".format(len(new), len(replaced), len(unchanged),
+                                  len(removed)), flush=True)
+
+        updated = len(new) > 0 or len(replaced) > 0 or len(removed) > 0
+        if updated:
+            drop = set(removed + [manifest.get_key(shard) for shard in replaced])
+            for key in removed:
+                manifest.remove(key)
+
+            # Preallocate the combined arrays from the shard headers.
+            ingest = new + replaced
+            parts = []
+            if combined is not None:
+                keep = ~np.isin(combined.get_array("sources"), list(drop))
+                parts.append(combined)
+            offsets = [0]
+            for shard in parts + ingest:
+                n_rows = shard.get_header()["arrays"]["eqtl_indices"]["shape"][0]
+                if shard is combined:
+                    n_rows = int(np.sum(keep))
+                offsets.append(offsets[-1] + n_rows)
+            arrays = {}
+            for name in array_names + ["sources"]:
+                if name == "sources":
+                    dtypes = [np.dtype(str)] + \
+                             [np.array(manifest.get_key(shard)).dtype for shard in ingest]
+                else:
+                    dtypes = [np.dtype(shard.get_header()["arrays"][name]["dtype"])
+                              for shard in ingest]
+                if combined is not None:
+                    dtypes.append(combined.get_array(name).dtype)
+                # A rerun that only removes shards has nothing to ingest,
+                # the combined shard then gives the trailing shape.
+                template = ingest[0] if len(ingest) > 0 else combined
+                shape = template.get_header()["arrays"][name]["shape"][1:] \
+                    if name != "sources" else []
+                arrays[name] = np.empty([offsets[-1]] + shape,
+                                        dtype=np.result_type(*dtypes))
+
+            if combined is not None:
+                for name in arrays.keys():
+                    arrays[name][:offsets[1]] = combined.get_array(name)[keep]
+
+            # Read the shards in parallel, straight into place.
+            print("\tReading {} shard(s)".format(len(ingest)), flush=True)
+            read_shard = partial(self.read_shard, array_names=array_names)
+            for i, (shard_arrays, entry) in imap_bounded(read_shard, ingest,
+                                                         n_workers=self.cores):
+                shard = ingest[i]
+                start = offsets[len(parts) + i]
+                end = offsets[len(parts) + i + 1]
+                for name, array in shard_arrays.items():
+                    arrays[name][start:end] = array
+                arrays["sources"][start:end] = manifest.get_key(shard)
+                manifest.add(shard, entry=entry)
+
+            # Keep the rows in shard order, so for duplicated eQTLs the same
+            # shard wins as in a full rebuild.
+            order = np.argsort(arrays["sources"], kind="mergesort")
+            arrays = {name: array[order] for name, array in arrays.items()}
+
+            eqtl_indices = arrays["eqtl_indices"]
+            start = int(eqtl_indices.min()) if len(eqtl_indices) > 0 else 0
+            end = int(eqtl_indices.max()) + 1 if len(eqtl_indices) > 0 else 0
+            path = Shard.write(directory=self.combined_dir,
+                               start=start,
+                               end=end,
+                               covariates=covariates,
+                               arrays=arrays)
+            for old_path in Shard.list_shards(self.combined_dir):
+                if old_path != path:
+                    shutil.rmtree(old_path)
+            combined = Shard.load(path)
+            manifest.save(self.manifest_path)
+        elif manifest.is_modified():
+            manifest.save(self.manifest_path)
+
+        missing, duplicated = manifest.get_coverage()
+        print("\tMissing shard ranges: {}".format(self.group_consecutive_numbers(missing)))
+        print("\tDuplicate shard ranges: {}".format(self.group_consecutive_numbers(duplicated)))
+
+        # The combined shard holds every eQTL once, the duplicates come from
+        # the shard ranges. Saved on every run, so the report is never
+        # older than the shards.
+        present = np.unique(combined.get_array("eqtl_indices")).astype(np.int64)
+        self.save_coverage_report(present, missing, duplicated)
+
+        return combined, updated
+
+    @staticmethod
+    def calc_beta_fdr(beta_pvalues):
+        """
+        Method for calculating the FDR of the beta approximation. The beta
+        p-values are corrected for the covariates of their eQTL, so the
+        BH FDR is taken over the eQTL level p-values (the best covariate).
+        A covariate gets the FDR of the first eQTL level p-value that is
+        not smaller than its own, so it is significant when its beta
+        p-value is below the eQTL level threshold (as in FastQTL).
+
+        :param beta_pvalues: ndarray, the beta p-values (eQTLs x
+                             covariates).
+        :return : ndarray, the FDR values (eQTLs x covariates).
+        """
+        beta_pvalues = np.asarray(beta_pvalues, dtype=np.float64)
+        fdr = np.full(beta_pvalues.shape, np.nan)
+        eqtl_pvalues = np.where(np.isnan(beta_pvalues), np.inf,
+                                beta_pvalues).min(axis=1)
+        eqtl_pvalues = np.sort(eqtl_pvalues[np.isfinite(eqtl_pvalues)])
+        if len(eqtl_pvalues) == 0:
+            return fdr
+
+        eqtl_fdr = calc_bh_fdr(eqtl_pvalues)
+        mask = ~np.isnan(beta_pvalues)
+        positions = np.searchsorted(eqtl_pvalues, beta_pvalues[mask],
+                                    side="left")
+        fdr[mask] = np.where(positions < len(eqtl_pvalues),
+                             eqtl_fdr[np.minimum(positions, len(eqtl_pvalues) - 1)],
+                             1)
+
+        return fdr
+
+    @staticmethod
+    def read_shard(shard, array_names):
+        arrays = {name: np.array(shard.get_array(name)) for name in array_names}
+        return arrays, ShardManifest.create_entry(shard)
+
+    @staticmethod
+    def combine_shards(shards, name):
+        for shard in shards:
+            if name not in shard.get_array_names():
+                print("\t\tNo {} array in: "
+                      "{}".format(name, os.path.basename(shard.get_path())))
+                return None, []
+
+        columns = [-1, "-"] + shards[0].get_covariates()
+        data = [(shard.get_array("eqtl_indices"),
+                 shard.get_array("names"),
+                 shard.get_array(name)) for shard in shards]
+
+        return columns, data
+
+    def count_perm_pvalues(self, shards, pvalues, combined=None):
+        """
+        Stream the permuted p-values shard by shard (or pickle by pickle)
+        through permutation counters, so they never have to be in memory
+        at once.
+
+        :param shards: list, the loaded shards.
+        :param pvalues: ndarray, the real p-values (eQTLs x covariates).
+        :param combined: Shard, the combined shard; of a duplicated eQTL
+                         only the rows of the shard that provided its real
+                         p-values are counted.
+        :return counters: list of (covariate columns, PermutationCounter)
+                          tuples.
+        :return n_perm: float, the n_perm to calculate the FDR with.
+        Returns None if there are no permuted p-values.
+        """
+        n_covariates = pvalues.shape[1]
+        if self.per_covariate and len(shards) > 0:
+            groups = [[i] for i in range(n_covariates)]
+        else:
+            if self.per_covariate:
+                print("\tPer covariate permutation FDR requires shards, "
+                      "counting over all covariates.")
+            groups = [list(range(n_covariates))]
+        counters = [(columns, PermutationCounter(pvalues[:, columns]))
+                    for columns in groups]
+
+        if len(shards) > 0:
+            owners = None
+            if combined is not None:
+                owners = self.get_row_owners(combined)
+            for shard in shards:
+                rows = None
+                if owners is not None:
+                    rows = self.get_owned_rows(shard, owners)
+                for perm_pvalues, perm_weights in self.iterate_shard_perm_pvalues(shard, rows=rows):
+                    for columns, counter in counters:
+                        counter.add(perm_pvalues[:, columns, :],
+                                    perm_weights[:, columns, :])
+        else:
+            for perm_pvalues in self.iterate_pickles(self.work_dir,
+                                                     self.perm_pvalues_filename):
+                for _, counter in counters:
+                    counter.add(perm_pvalues)
+
+        n_perm_pvalues = sum(counter.get_n_perm_pvalues() for _, counter in counters)
+        if n_perm_pvalues == 0:
+            print("\tNo permutation pvalue data found.")
+            return None
+
+        # The shard permuted p-values are weighted by one over their number
+        # of permutations already. Pickles have no per test permutation
+        # count, so there every permuted p-value gets the same weight.
+        n_perm = 1
+        if len(shards) == 0:
+            n_perm = n_perm_pvalues / pvalues.size
+
+        return counters, n_perm
+
     @staticmethod
-    def combine_pickles(indir, filename, columns=False):
+    def get_row_owners(combined):
+        """
+        Method for finding the shard that provided the combined row of
+        every eQTL. The combined rows are in shard order, so the first row
+        of an eQTL is the one that is kept (see assemble_rows).
+
+        :param combined: Shard, the combined shard.
+        :return : dict, shard key -> ndarray with the eQTL indices it owns.
+        """
+        eqtl_indices, first = np.unique(combined.get_array("eqtl_indices"),
+                                        return_index=True)
+        sources = np.asarray(combined.get_array("sources"))[first]
+        return {key: eqtl_indices[sources == key] for key in np.unique(sources)}
+
+    @staticmethod
+    def get_owned_rows(shard, owners):
+        """
+        Method for selecting the rows of a shard that made it into the
+        combined table.
+
+        :param shard: Shard, the shard.
+        :param owners: dict, see get_row_owners.
+        :return : ndarray, boolean mask over the shard rows.
+        """
+        eqtl_indices = np.asarray(shard.get_array("eqtl_indices"))
+        owned = owners.get(ShardManifest.get_key(shard),
+                           np.array([], dtype=eqtl_indices.dtype))
+        first = np.zeros(len(eqtl_indices), dtype=bool)
+        first[np.unique(eqtl_indices, return_index=True)[1]] = True
+        return first & np.isin(eqtl_indices, owned)
+
+    @staticmethod
+    def iterate_shard_perm_pvalues(shard, chunk_size=1000, rows=None):
+        perm_pvalues = shard.get_array("perm_pvalues")
+        if "n_perm_used" in shard.get_array_names():
+            n_perm_used = shard.get_array("n_perm_used")
+        else:
+            n_perm_used = None
+        for start in range(0, perm_pvalues.shape[0], chunk_size):
+            chunk = np.asarray(perm_pvalues[start:start + chunk_size])
+            if n_perm_used is None:
+                chunk_n_perm_used = np.sum(~np.isnan(chunk), axis=2)
+            else:
+                chunk_n_perm_used = np.asarray(n_perm_used[start:start + chunk_size])
+            if rows is not None:
+                # Skip the rows of which the real p-values are not used.
+                chunk_rows = rows[start:start + chunk_size]
+                chunk = chunk[chunk_rows]
+                chunk_n_perm_used = chunk_n_perm_used[chunk_rows]
+            # Every permuted p-value is weighted by one over the number of
+            # permutations of its eQTL - covariate pair, so pairs for which
+            # adaptive permutation stopped early are not under-counted.
+            with np.errstate(divide='ignore'):
+                weights = np.where(chunk_n_perm_used > 0,
+                                   1 / chunk_n_perm_used, 0)
+            yield chunk, np.broadcast_to(weights[:, :, np.newaxis],
+                                         chunk.shape)
+
+    def iterate_pickles(self, indir, filename):
+        fpaths = glob.glob(os.path.join(indir, filename, filename + "*.pkl"))
+        for _, content in imap_bounded(self.load_pickle, fpaths,
+                                       n_workers=self.cores):
+            if content is not None:
+                yield content
+
+    def combine_pickles(self, indir, filename, columns=False):
+        fpaths = sorted(glob.glob(os.path.join(indir, filename,
+                                               filename + "*.pkl")))
+        contents = [None] * len(fpaths)
+        for i, content in imap_bounded(self.load_pickle, fpaths,
+                                       n_workers=self.cores):
+            contents[i] = content
+        contents = [content for content in contents if content is not None]
+
+        if not columns:
+            if len(contents) == 0:
+                return None, np.array([], dtype=np.float64)
+            return None, np.concatenate([np.asarray(content, dtype=np.float64)
+                                         for content in contents])
+
         col_list = None
         data = []
-
-        for i, fpath in enumerate(glob.glob(os.path.join(indir, filename,
-                                                         filename + "*.pkl"))):
-            with open(fpath, "rb") as f:
-                try:
-                    content = pickle.load(f)
-                    if columns and i == 0:
-                        col_list = content[0]
-                    data.extend(content[1:])
-                except EOFError:
-                    print("\t\tEOFError in: {} ".format(os.path.basename(fpath)))
-            f.close()
+        for content in contents:
+            if col_list is None:
+                col_list = content[0]
+            rows = content[1:]
+            data.append(([row[0] for row in rows],
+                         [row[1] for row in rows],
+                         np.array([row[2:] for row in rows],
+                                  dtype=np.float64).reshape(len(rows), -1)))
 
         return col_list, data
 
+    @staticmethod
+    def load_pickle(fpath):
+        content = None
+        with open(fpath, "rb") as f:
+            try:
+                content = pickle.load(f)
+            except EOFError:
+                print("\t\tEOFError in: {} ".format(os.path.basename(fpath)))
+        f.close()
+
+        return content
+
     def create_df(self, data, columns):
-        # Crate the data frame.
-        df = pd.DataFrame(data, columns=columns)
-        order_col = df.columns[0]
-        df.sort_values(by=order_col, inplace=True)
-        print("\tInput shape: {}".format(df.shape))
-
-        # Check what eQTLs are present, missing, duplicated.
-        reference = set(np.arange(df[order_col].min(), df[order_col].max() + 1))
-        present = set(df[order_col])
+        n_rows = sum(len(part[0]) for part in data)
+        print("\tInput shape: {}".format((n_rows, len(columns))))
+
+        # Place the rows by eQTL index, so missing eQTLs become NaN rows and
+        # of duplicated eQTLs the first part wins.
+        eqtl_indices, names, values, missing, duplicated = \
+            assemble_rows(data, len(columns) - 2)
+        present = np.setdiff1d(eqtl_indices, missing)
         print("\tPresent indices: {}".format(self.group_consecutive_numbers(present)))
-        missing = list(set(df[order_col]).symmetric_difference(reference))
         print("\tMissing indices: {}".format(self.group_consecutive_numbers(missing)))
-        duplicated = list(df.loc[df.duplicated([order_col]), order_col].values)
         print("\tDuplicate indices: {}".format(self.group_consecutive_numbers(duplicated)))
+        self.coverage = (present, missing, duplicated)
 
-        # Remove duplicate eQTLs.
-        df.drop_duplicates(subset=order_col, keep="first", inplace=True)
-
-        # Insert missing eQTLs.
-        if len(missing) > 0:
-            print("\tInserting missing indices")
-            missing_df = pd.Series(missing).to_frame()
-            missing_df.columns = [order_col]
-            df = pd.concat([df, missing_df], axis=0).reset_index(drop=True)
-            df.sort_values(by=order_col, inplace=True)
-
-        # Remove the eQTL order column and set the SNPName as index.
-        df.drop([order_col], axis=1, inplace=True)
-        df.set_index("-", inplace=True)
+        # Set the SNPName as index.
+        df = pd.DataFrame(values, index=names, columns=columns[2:])
+        df.index.name = columns[1]
         df = df.T
         print("\tOutput shape: {}".format(df.shape))
 
         return df
 
+    def get_first_eqtl_index(self, combined):
+        """
+        Method for getting the CIA eQTL index of the first column of the
+        tables, which start at the lowest present eQTL.
+        """
+        if combined is not None:
+            eqtl_indices = combined.get_array("eqtl_indices")
+            return int(np.min(eqtl_indices)) if len(eqtl_indices) > 0 else 0
+        if self.coverage is not None:
+            present = self.coverage[0]
+            return int(present[0]) if len(present) > 0 else 0
+
+        # The tables were not rebuilt, the coverage report belongs to them.
+        if os.path.exists(self.coverage_path):
+            with open(self.coverage_path, "r") as f:
+                report = json.load(f)
+            f.close()
+            if report.get("first") is not None:
+                return report["first"]
+        return 0
+
+    def save_coverage_report(self, present, missing, duplicated):
+        """
+        Method for saving the eQTL coverage as JSON. The ranges use the
+        same notation as the printed ones ('12' or '12-15', inclusive),
+        so they can be given to jobs/create_extra_CIA_jobs.py.
+        """
+        # The missing eQTLs always lie between the first and last present
+        # one.
+        first = None
+        last = None
+        if len(present) > 0:
+            first = int(present[0])
+            last = int(present[-1])
+        report = {"version": 1,
+                  "created": int(time.time()),
+                  "first": first,
+                  "last": last,
+                  "n_present": int(len(present)),
+                  "n_missing": int(len(missing)),
+                  "n_duplicated": int(len(duplicated)),
+                  "present": self.group_consecutive_numbers(present.tolist()),
+                  "missing": self.group_consecutive_numbers(missing.tolist()),
+                  "duplicated": self.group_consecutive_numbers(duplicated.tolist())}
+        with open(self.coverage_path, "w") as f:
+            json.dump(report, f, indent=2)
+        f.close()
+        print("\tSaved coverage report: {}".format(os.path.basename(self.coverage_path)))
+
     @staticmethod
     def group_consecutive_numbers(numbers):
         groups = groupby(numbers, key=lambda item, c=count(): item - next(c))
         tmp = [list(g) for k, g in groups]
         return [str(x[0]) if len(x) == 1 else "{}-{}".format(x[0], x[-1]) for x in tmp]
 
-    def pivot_and_save(self, dfm, col, indices, columns):
-        print("Pivoting table.", flush=True)
-        pivot_df = dfm.pivot(index='covariate', columns='SNP', values=col)
-
-        print("Reorder dataframe.")
-        pivot_df = pivot_df.loc[indices, columns]
-        pivot_df.index = ["_".join(x.split("_")[:-1]) for x in pivot_df.index]
-        pivot_df.index.name = "-"
-        pivot_df.columns = ["_".join(x.split("_")[:-1]) for x in
-                            pivot_df.columns]
-        pivot_df.columns.name = None
-
-        print("Saving {} dataframe.".format(col), flush=True)
-        save_dataframe(df=pivot_df,
-                       outpath=os.path.join(self.work_dir,
-                                            "{}_table.txt.gz".format(col)),
-                       header=True, index=True)
-
     def print_arguments(self):
         print("Arguments:")
         print("  > Alpha: {}".format(self.alpha))
+        print("  > Beta approximation: {}".format(self.beta))
+        print("  > Permutation FDR per covariate: {}".format(self.per_covariate))
+        print("  > Export TSV tables: {}".format(self.export_tsv))
+        print("  > Cores: {}".format(self.cores))
         print("  > Working directory: {}".format(self.work_dir))
         print("")
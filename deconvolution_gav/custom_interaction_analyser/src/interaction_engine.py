@@ -0,0 +1,117 @@
+"""
+File:         interaction_engine.py
+Created:      2020/10/28
+Last Changed:
+Author:       M.Vochteloo
+
+Copyright (C) 2020 M.Vochteloo
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+A copy of the GNU General Public License can be found in the LICENSE file in the
+root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Standard imports.
+
+# Third party imports.
+import numpy as np
+from scipy import stats
+
+# Local application imports.
+
+
+class InteractionEngine:
+    """
+    Closed-form implementation of the models in Main.work. After the base
+    model is regressed out, the null model only contains the covariate
+    (no intercept) and the alternative model adds one interaction column.
+    Both are solved with dot products instead of statsmodels fits, for all
+    permutation orders of a covariate at once.
+
+    Main.create_model / calc_f_value / get_p_value remain the reference
+    implementation.
+    """
+
+    @staticmethod
+    def remove_covariates(y, X):
+        """
+        Method for regressing X out of y. Equivalent to
+        Main.remove_covariates.
+
+        :param y: ndarray, the outcome values (n).
+        :param X: ndarray, the base matrix (n x p).
+        :return : ndarray, the mean of y plus the residuals.
+        """
+        try:
+            beta = np.linalg.lstsq(X, y, rcond=None)[0]
+        except np.linalg.LinAlgError as e:
+            print("\t\tError: {}".format(e))
+            return np.full(y.shape, np.nan)
+
+        return y.mean() + (y - X.dot(beta))
+
+    @staticmethod
+    def test_interactions(y, covariate, inter_matrix):
+        """
+        Method for comparing the null model y ~ covariate with the
+        alternative models y ~ covariate + interaction for every row of
+        the interaction matrix.
+
+        :param y: ndarray, the outcome values (n).
+        :param covariate: ndarray, the covariate values (n).
+        :param inter_matrix: ndarray, the interaction terms, one row per
+                             permutation order (m x n).
+        :return pvalues: ndarray, the F-test p-values (m).
+        :return coefficients: ndarray, the interaction coefficients (m).
+        :return std_errors: ndarray, the interaction standard errors (m).
+        """
+        n = y.shape[0]
+        m = inter_matrix.shape[0]
+        df_null = 1
+        df_alt = 2
+
+        pvalues = np.full(m, np.nan)
+        coefficients = np.full(m, np.nan)
+        std_errors = np.full(m, np.nan)
+
+        cc = covariate.dot(covariate)
+        if df_alt >= n or cc == 0 or np.isnan(cc) or np.isnan(y).any():
+            return pvalues, coefficients, std_errors
+
+        # Null model.
+        null_residuals = y - covariate * (covariate.dot(y) / cc)
+        rss_null = null_residuals.dot(null_residuals)
+
+        # Project the interaction terms on the orthogonal complement of
+        # the covariate (Frisch-Waugh-Lovell).
+        inter_res = inter_matrix - np.outer(inter_matrix.dot(covariate) / cc,
+                                            covariate)
+        inter_ss = np.einsum('ij,ij->i', inter_res, inter_res)
+        inter_ry = inter_res.dot(null_residuals)
+
+        valid = inter_ss > (np.finfo(np.float64).eps * n *
+                            np.einsum('ij,ij->i', inter_matrix, inter_matrix))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            coef = inter_ry / inter_ss
+            rss_alt = np.maximum(rss_null - inter_ry * coef, 0)
+            std_err = np.sqrt((rss_alt / (n - df_alt)) / inter_ss)
+            fvalues = ((rss_null - rss_alt) / (df_alt - df_null)) / \
+                      (rss_alt / (n - df_alt))
+        fvalues[rss_alt >= rss_null] = 0
+
+        coefficients[valid] = coef[valid]
+        std_errors[valid] = std_err[valid]
+        pvalues[valid] = stats.f.sf(fvalues[valid],
+                                    dfn=(df_alt - df_null),
+                                    dfd=(n - df_alt))
+
+        return pvalues, coefficients, std_errors
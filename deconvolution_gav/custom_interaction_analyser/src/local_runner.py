@@ -0,0 +1,272 @@
+"""
+File:         local_runner.py
+Created:      2020/10/30
+Last Changed:
+Author:       M.Vochteloo
+
+Copyright (C) 2020 M.Vochteloo
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+A copy of the GNU General Public License can be found in the LICENSE file in the
+root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Standard imports.
+from __future__ import print_function
+from collections import deque
+from pathlib import Path
+from datetime import datetime
+import multiprocessing as mp
+import traceback
+import time
+
+# Third party imports.
+import numpy as np
+
+# Local application imports.
+from .main import Main
+from .shard import Shard
+from .storage_container import StorageContainer
+from local_settings import LocalSettings
+
+
+class LocalRunner(Main):
+    """
+    Runs the CIA over a full eQTL range on one machine. The eQTLs that are
+    not in a shard yet are split into chunks of consecutive eQTLs, and every
+    worker process starts on its own block of chunks. A worker that runs
+    out of chunks takes the last chunk of the worker with the most chunks
+    left (work stealing), so eQTLs that are slower than others (e.g. due to
+    fewer missing genotypes or adaptive permutations) do not leave workers
+    idle. Every finished chunk is written as a shard, so an interrupted run
+    resumes with the chunks that are missing.
+
+    The SLURM walltime (max_runtime_in_hours) does not apply; a local run
+    only stops early if local_max_runtime_in_hours is set.
+    """
+    def __init__(self, input_folder, output_folder, settings_file, skip_rows,
+                 n_eqtls, n_samples, cores, chunk_size, verbose):
+        super().__init__(input_folder=input_folder,
+                         output_folder=output_folder,
+                         settings_file=settings_file,
+                         skip_rows=skip_rows,
+                         n_eqtls=n_eqtls,
+                         n_samples=n_samples,
+                         cores=cores,
+                         verbose=verbose)
+        self.chunk_size = max(1, chunk_size)
+
+        # Replace the SLURM panic time by the local one.
+        settings = LocalSettings(str(Path(__file__).parent.parent), settings_file)
+        max_runtime = settings.get_setting("local_max_runtime_in_hours")
+        self.max_end_time = None
+        self.panic_time = None
+        if max_runtime is not None:
+            self.max_end_time = int(time.time()) + max_runtime * 60 * 60
+            self.panic_time = self.max_end_time - (settings.get_setting("panic_time_in_min") * 60)
+
+    def start(self):
+        self.print_arguments()
+        print("Starting Custom Interaction Analyser - local runner "
+              "[{}]".format(datetime.now().strftime("%d-%m-%Y, %H:%M:%S")))
+
+        # Start the timer.
+        start_time = int(time.time())
+
+        # Get the permutation orders.
+        permutation_orders = self.get_permutation_orders()
+
+        geno_df, expr_df, covs_df = self.load_data(permutation_orders)
+        self.names = ["{}_{}".format(snp_name, probe_name) for snp_name, probe_name
+                      in zip(geno_df.index, expr_df.index)]
+        self.colnames = covs_df.index.to_list()
+        self.n_orders = len(permutation_orders)
+        n_rows = geno_df.shape[0]
+
+        print("Loading existing shards")
+        finished = self.get_finished_rows(n_rows)
+        print("\t{}/{} eQTL(s) already finished".format(int(np.sum(finished)),
+                                                         n_rows))
+        chunks = self.create_chunks(finished, self.chunk_size)
+        print("\t{} chunk(s) of at most {} eQTL(s) to do".format(len(chunks),
+                                                                 self.chunk_size),
+              flush=True)
+
+        n_done = 0
+        if len(chunks) > 0:
+            print("Start the analysis", flush=True)
+            n_done = self.run_chunks(chunks)
+
+        # Print the process time.
+        run_time = int(time.time()) - start_time
+        run_time_min, run_time_sec = divmod(run_time, 60)
+        run_time_hour, run_time_min = divmod(run_time_min, 60)
+        print("Finished in  {} hour(s), {} minute(s) and "
+              "{} second(s)".format(int(run_time_hour),
+                                    int(run_time_min),
+                                    int(run_time_sec)))
+        print("Received {:.2f} analyses per minute".format((n_done * (self.n_perm + 1)) /
+                                                           (max(run_time, 1) / 60)))
+        if n_done < sum(end - start for start, end in chunks):
+            print("Not all eQTLs are finished, run again to resume.")
+
+        print("Shutting down local runner [{}]".format(
+            datetime.now().strftime("%d-%m-%Y, %H:%M:%S")), flush=True)
+
+    def get_finished_rows(self, n_rows):
+        finished = np.zeros(n_rows, dtype=bool)
+        for fpath in Shard.list_shards(self.shard_dir):
+            shard = Shard.load(fpath)
+            if shard is None or shard.get_end() <= self.skip_rows or \
+                    shard.get_start() >= self.skip_rows + n_rows:
+                continue
+            rows = np.asarray(shard.get_array("eqtl_indices")) - self.skip_rows
+            finished[rows[(rows >= 0) & (rows < n_rows)]] = True
+
+        return finished
+
+    @staticmethod
+    def create_chunks(finished, chunk_size):
+        """
+        Method for splitting the unfinished rows into chunks of consecutive
+        rows.
+
+        :param finished: ndarray, whether every row is finished.
+        :param chunk_size: int, the maximum number of rows per chunk.
+        :return : list, (start row, end row) tuples.
+        """
+        chunks = []
+        todo = np.flatnonzero(~finished)
+        if len(todo) == 0:
+            return chunks
+
+        breaks = np.flatnonzero(np.diff(todo) != 1) + 1
+        for group in np.split(todo, breaks):
+            for start in range(int(group[0]), int(group[-1]) + 1, chunk_size):
+                chunks.append((start, min(start + chunk_size, int(group[-1]) + 1)))
+
+        return chunks
+
+    def run_chunks(self, chunks):
+        n_workers = min(self.cores, len(chunks))
+
+        # Give every worker an equal block of consecutive chunks.
+        queues = [deque(block.tolist()) for block in
+                  np.array_split(np.arange(len(chunks)), n_workers)]
+
+        if n_workers == 1:
+            n_done = 0
+            for chunk_index in queues[0]:
+                start, end = chunks[chunk_index]
+                self.save_chunk(start, self.process_chunk(start, end))
+                n_done += end - start
+                if self.is_panic():
+                    print("\tPanic!!!", flush=True)
+                    break
+            return n_done
+
+        print("\tUsing {} worker(s)".format(n_workers), flush=True)
+        context = mp.get_context("fork")
+        result_queue = context.Queue()
+        task_queues = [context.Queue() for _ in range(n_workers)]
+        workers = [context.Process(target=self.run_worker,
+                                   args=(worker_id, task_queues[worker_id],
+                                         result_queue))
+                   for worker_id in range(n_workers)]
+        for worker in workers:
+            worker.start()
+
+        for worker_id in range(n_workers):
+            task_queues[worker_id].put(self.get_next_chunk(chunks, queues, worker_id))
+
+        n_done = 0
+        n_active = n_workers
+        panic = False
+        while n_active > 0:
+            worker_id, chunk, results = result_queue.get()
+            if chunk is None:
+                n_active -= 1
+                continue
+            if isinstance(results, str):
+                print("\tError in worker {}:\n{}".format(worker_id, results),
+                      flush=True)
+                panic = True
+            else:
+                self.save_chunk(chunk[0], results)
+                n_done += chunk[1] - chunk[0]
+
+            if not panic and self.is_panic():
+                print("\tPanic!!!", flush=True)
+                panic = True
+            task = None
+            if not panic:
+                task = self.get_next_chunk(chunks, queues, worker_id)
+            task_queues[worker_id].put(task)
+
+        for worker in workers:
+            worker.join()
+
+        return n_done
+
+    def is_panic(self):
+        return self.panic_time is not None and time.time() > self.panic_time
+
+    @staticmethod
+    def get_next_chunk(chunks, queues, worker_id):
+        """
+        Method for getting the next chunk of a worker: the first chunk of its
+        own block or, if that is empty, the last chunk of the largest block.
+        """
+        if len(queues[worker_id]) > 0:
+            return chunks[queues[worker_id].popleft()]
+
+        victim = max(range(len(queues)), key=lambda i: len(queues[i]))
+        if len(queues[victim]) == 0:
+            return None
+        return chunks[queues[victim].pop()]
+
+    def run_worker(self, worker_id, task_queue, result_queue):
+        while True:
+            chunk = task_queue.get()
+            if chunk is None:
+                result_queue.put((worker_id, None, None))
+                break
+
+            try:
+                results = self.process_chunk(*chunk)
+            except Exception:
+                results = traceback.format_exc()
+            result_queue.put((worker_id, chunk, results))
+
+    def process_chunk(self, start, end):
+        return [self.process_eqtl(row_index) for row_index in range(start, end)]
+
+    def save_chunk(self, start, results):
+        storage = StorageContainer(colnames=self.colnames,
+                                   n_rows=len(results),
+                                   n_permutations=self.n_orders - 1,
+                                   perm_dtype=self.perm_pvalues_dtype)
+        for row_index, result in enumerate(results, start=start):
+            pvalues, coefficients, std_errors, n_perm_used, run_time = result
+            storage.add_row(self.skip_rows + row_index, self.names[row_index])
+            storage.set_values(pvalues, coefficients[:, 0], std_errors[:, 0],
+                               n_perm_used)
+            storage.set_run_time(run_time)
+            storage.store_row()
+
+        if self.beta_approximation:
+            self.fit_beta_approximation(storage)
+
+        print("\tFinished eQTL {}-{}".format(self.skip_rows + start,
+                                             self.skip_rows + start + len(results) - 1),
+              flush=True)
+        self.write_shard(storage, self.skip_rows + start)
@@ -1,7 +1,7 @@
 """
 File:         main.py
 Created:      2020/10/14
-Last Changed: 2020/10/27
+Last Changed: 2020/10/30
 Author:       M.Vochteloo
 
 Copyright (C) 2020 M.Vochteloo
@@ -25,8 +25,9 @@ from __future__ import print_function
 from pathlib import Path
 from datetime import datetime
 import itertools
+import multiprocessing as mp
+import hashlib
 import pickle
-import random
 import time
 import gzip
 import os
@@ -40,13 +41,28 @@ from functools import reduce
 
 # Local application imports.
 from .storage_container import StorageContainer
+from .interaction_engine import InteractionEngine
+from .checkpoint import Checkpoint
+from .shard import Shard
+from .beta_approximation import BetaApproximation
+from .permutation_orders import PermutationOrders
 from local_settings import LocalSettings
 from utilities import check_file_exists, prepare_output_dir, load_dataframe
+from row_index import load_dataframe_rows
+from dtype_policy import get_genotype_read_dtype, encode_genotype, \
+    decode_genotype, decode_genotype_df, check_dtype, EXPRESSION_DTYPES
+
+# The Main instance that forked worker processes work on.
+_MAIN = None
+
+
+def _process_eqtl(row_index):
+    return _MAIN.process_eqtl(row_index)
 
 
 class Main:
     def __init__(self, input_folder, output_folder, settings_file, skip_rows, n_eqtls,
-                 n_samples, verbose):
+                 n_samples, cores, verbose):
         # Define the current directory.
         current_dir = str(Path(__file__).parent.parent)
 
@@ -67,17 +83,60 @@ class Main:
         self.covs_inpath = os.path.join(input_dir, input_folder, filenames["covariates"])
 
         self.correct_snp_tc_inter = settings.get_setting("correct_for_snp_tech_cov_interaction")
-        self.pvalues_filename = settings.get_setting("real_pvalues_pickle_filename")
-        self.coef_filename = settings.get_setting("coef_pickle_filename")
-        self.std_err_filename = settings.get_setting("std_err_pickle_filename")
         self.perm_order_filename = settings.get_setting("permutations_order_pickle_filename")
-        self.perm_pvalues_filename = settings.get_setting("permuted_pvalues_pickle_filename")
         self.n_perm = settings.get_setting("n_permutations")
+        self.perm_seed = settings.get_setting("permutation_seed")
+        checkpoint_folder = settings.get_setting("checkpoint_folder")
+        if checkpoint_folder is None:
+            checkpoint_folder = "checkpoints"
+        self.checkpoint_dir = os.path.join(self.outdir, checkpoint_folder)
+        shard_folder = settings.get_setting("shard_folder")
+        if shard_folder is None:
+            shard_folder = "shards"
+        self.shard_dir = os.path.join(self.outdir, shard_folder)
+        self.checkpoint_every = settings.get_setting("checkpoint_every_n_eqtls")
+        if self.checkpoint_every is None:
+            self.checkpoint_every = 1
+        self.perm_pvalues_dtype = settings.get_setting("perm_pvalues_dtype")
+        if self.perm_pvalues_dtype is None:
+            self.perm_pvalues_dtype = "float64"
+        self.engine = settings.get_setting("engine")
+        if self.engine is None:
+            self.engine = "statsmodels"
+        self.adaptive_perm = settings.get_setting("adaptive_permutations")
+        if self.adaptive_perm is None:
+            self.adaptive_perm = False
+        if self.adaptive_perm and self.engine != "numpy":
+            print("Adaptive permutations require the numpy engine, "
+                  "running all permutations.")
+            self.adaptive_perm = False
+        self.adaptive_exceedances = settings.get_setting("adaptive_permutations_exceedances")
+        if self.adaptive_exceedances is None:
+            self.adaptive_exceedances = 10
+        self.adaptive_chunk_size = settings.get_setting("adaptive_permutations_chunk_size")
+        if self.adaptive_chunk_size is None:
+            self.adaptive_chunk_size = 100
+        self.geno_dtype = settings.get_setting("genotype_dtype")
+        if self.geno_dtype is None:
+            self.geno_dtype = "float64"
+        get_genotype_read_dtype(self.geno_dtype)
+        self.expr_dtype = settings.get_setting("expression_dtype")
+        if self.expr_dtype is None:
+            self.expr_dtype = "float64"
+        check_dtype(self.expr_dtype, EXPRESSION_DTYPES, "expression")
+        self.beta_approximation = settings.get_setting("beta_approximation")
+        if self.beta_approximation is None:
+            self.beta_approximation = False
+        if self.beta_approximation and self.adaptive_perm:
+            print("The beta approximation requires all permutations, "
+                  "disabling it.")
+            self.beta_approximation = False
         self.max_end_time = int(time.time()) + settings.get_setting("max_runtime_in_hours") * 60 * 60
         self.panic_time = self.max_end_time - (settings.get_setting("panic_time_in_min") * 60)
         self.skip_rows = skip_rows
         self.n_eqtls = n_eqtls
         self.n_samples = n_samples
+        self.cores = cores
         self.verbose = verbose
 
     def start(self):
@@ -89,12 +148,175 @@ class Main:
         start_time = int(time.time())
 
         # Get the permutation orders.
+        permutation_orders = self.get_permutation_orders()
+
+        # Start the work.
+        print("Start the analysis", flush=True)
+        storage = self.work(permutation_orders)
+
+        print("Saving output files", flush=True)
+        self.write_shard(storage, self.skip_rows)
+
+        # The output is safe, remove the checkpoint if the batch is
+        # complete.
+        if storage.get_n_rows() == self.n_rows:
+            self.checkpoint.remove()
+
+        # Print the process time.
+        run_time = int(time.time()) - start_time
+        run_time_min, run_time_sec = divmod(run_time, 60)
+        run_time_hour, run_time_min = divmod(run_time_min, 60)
+        print("Finished in  {} hour(s), {} minute(s) and "
+              "{} second(s)".format(int(run_time_hour),
+                                    int(run_time_min),
+                                    int(run_time_sec)))
+        print("Received {:.2f} analyses per minute".format((self.n_eqtls * (self.n_perm + 1)) /
+                                                           (max(run_time, 1) / 60)))
+
+        # Shutdown the manager.
+        print("Shutting down manager [{}]".format(
+            datetime.now().strftime("%d-%m-%Y, %H:%M:%S")), flush=True)
+
+    def work(self, permutation_orders):
+        geno_df, expr_df, covs_df = self.load_data(permutation_orders)
+
+        # Initialize the storage object.
+        print("Creating storage object")
+        storage = StorageContainer(colnames=covs_df.index.to_list(),
+                                   n_rows=geno_df.shape[0],
+                                   n_permutations=len(permutation_orders) - 1,
+                                   perm_dtype=self.perm_pvalues_dtype)
+
+        # Load the eQTLs that were finished by an earlier run of this
+        # batch.
+        n_rows = geno_df.shape[0]
+        self.n_rows = n_rows
+        prepare_output_dir(self.checkpoint_dir)
+        self.checkpoint = Checkpoint(os.path.join(self.checkpoint_dir,
+                                                  "checkpoint_{}_{}.bin".format(self.skip_rows,
+                                                                                self.skip_rows + n_rows)),
+                                     fields=[("pvalues", (covs_df.shape[0], len(permutation_orders))),
+                                             ("coefficients", (covs_df.shape[0],)),
+                                             ("std_errors", (covs_df.shape[0],)),
+                                             ("n_perm_used", (covs_df.shape[0],))],
+                                     flush_every=self.checkpoint_every,
+                                     metadata=self.get_checkpoint_metadata(permutation_orders,
+                                                                           covs_df))
+        print("Loading checkpoint")
+        finished = self.checkpoint.load()
+        print("\t{} eQTL(s) already finished".format(len(finished)))
+        todo_rows = [row_index for row_index in range(n_rows)
+                     if (self.skip_rows + row_index) not in finished]
+
+        # Start working.
+        print("Starting interaction analyser", flush=True)
+        pool = None
+        if self.cores > 1:
+            print("\tUsing {} cores".format(self.cores), flush=True)
+            global _MAIN
+            _MAIN = self
+            pool = mp.get_context("fork").Pool(processes=self.cores)
+            results = pool.imap(_process_eqtl, todo_rows)
+        else:
+            results = (self.process_eqtl(row_index) for row_index in todo_rows)
+
+        for row_index in range(n_rows):
+            eqtl_index = self.skip_rows + row_index
+            print("\tProcessing eQTL {}/{} "
+                  "[{:.0f}%]".format(row_index + 1,
+                                     n_rows,
+                                     (100 / n_rows) * (row_index + 1)),
+                  flush=True)
+
+            if eqtl_index in finished:
+                record = finished[eqtl_index]
+                print("\t\tloaded from checkpoint.", flush=True)
+            else:
+                pvalues, coefficients, std_errors, n_perm_used, run_time = next(results)
+                record = {"pvalues": pvalues,
+                          "coefficients": coefficients[:, 0],
+                          "std_errors": std_errors[:, 0],
+                          "n_perm_used": n_perm_used}
+                self.checkpoint.add(eqtl_index, record)
+
+                # Print the time.
+                print("\t\tfinished in {:.4f} second(s).".format(run_time), flush=True)
+                storage.set_run_time(run_time)
+
+            storage.add_row(eqtl_index, "{}_{}".format(geno_df.index[row_index],
+                                                       expr_df.index[row_index]))
+            storage.set_values(record["pvalues"],
+                               record["coefficients"],
+                               record["std_errors"],
+                               record["n_perm_used"])
+            storage.store_row()
+
+            # Check whether we are almost running out of time.
+            if time.time() > self.panic_time:
+                print("\tPanic!!!", flush=True)
+                break
+
+        self.checkpoint.flush()
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+        if self.beta_approximation:
+            print("Fitting beta approximation", flush=True)
+            self.fit_beta_approximation(storage)
+
+        return storage
+
+    def get_checkpoint_metadata(self, permutation_orders, covs_df):
+        """
+        Method for getting the settings the results of an eQTL depend on.
+        Finished eQTLs of a checkpoint are only reused if these are equal.
+
+        :param permutation_orders: PermutationOrders / list, the orders.
+        :param covs_df: DataFrame, the covariates that are tested.
+        :return : dict, the checkpoint metadata.
+        """
+        if isinstance(permutation_orders, PermutationOrders):
+            permutations = {"seed": permutation_orders.get_seed()}
+        else:
+            # Legacy pickled orders have no seed, use their content.
+            permutations = {"orders": hashlib.sha1(
+                pickle.dumps([None if order is None else list(order)
+                              for order in permutation_orders])).hexdigest()}
+        permutations["n_permutations"] = len(permutation_orders) - 1
+
+        return {"permutations": permutations,
+                "engine": self.engine,
+                "adaptive_permutations": self.adaptive_perm,
+                "adaptive_permutations_exceedances": self.adaptive_exceedances,
+                "adaptive_permutations_chunk_size": self.adaptive_chunk_size,
+                "correct_for_snp_tech_cov_interaction": self.correct_snp_tc_inter,
+                "genotype_dtype": self.geno_dtype,
+                "expression_dtype": self.expr_dtype,
+                "covariates": [str(x) for x in covs_df.index],
+                "samples": [str(x) for x in covs_df.columns]}
+
+    def get_permutation_orders(self):
         permutation_orders = None
         perm_orders_outfile = os.path.join(self.outdir,
-                                           self.perm_order_filename + ".pkl")
+                                           self.perm_order_filename + ".json")
+        legacy_perm_orders_outfile = os.path.join(self.outdir,
+                                                  self.perm_order_filename + ".pkl")
         if check_file_exists(perm_orders_outfile):
+            print("Loading permutation seed")
+            permutation_orders = PermutationOrders.load(perm_orders_outfile)
+
+            # Validate the permutation orders for the given input.
+            if permutation_orders is None or \
+                    permutation_orders.get_n_permutations() != self.n_perm or \
+                    permutation_orders.get_n_samples() != self.n_samples:
+                print("\tinvalid")
+                permutation_orders = None
+            else:
+                print("\tvalid")
+        elif check_file_exists(legacy_perm_orders_outfile):
             print("Loading permutation order")
-            permutation_orders = self.load_pickle(perm_orders_outfile)
+            permutation_orders = self.load_pickle(legacy_perm_orders_outfile)
 
             # Validate the permutation orders for the given input.
             if len(permutation_orders) != (self.n_perm + 1):
@@ -114,67 +336,29 @@ class Main:
             print("\tvalid")
 
         if permutation_orders is None:
-            print("Creating permutation order")
-            permutation_orders = self.create_perm_orders()
-            self.dump_pickle(permutation_orders, self.outdir,
-                             self.perm_order_filename)
-
-        # Start the work.
-        print("Start the analysis", flush=True)
-        storage = self.work(permutation_orders)
-
-        print("Saving output files", flush=True)
-        filename_suffix = "{}_{}".format(self.skip_rows, self.skip_rows + storage.get_n_rows())
-        self.dump_pickle(storage.get_pvalues(),
-                         self.outdir,
-                         self.pvalues_filename,
-                         filename_suffix=filename_suffix,
-                         subdir=True, unique=True)
-        self.dump_pickle(storage.get_perm_pvalues(),
-                         self.outdir,
-                         self.perm_pvalues_filename,
-                         filename_suffix=filename_suffix,
-                         subdir=True, unique=True)
-        self.dump_pickle(storage.get_coefficients(),
-                         self.outdir,
-                         self.coef_filename,
-                         filename_suffix=filename_suffix,
-                         subdir=True, unique=True)
-        self.dump_pickle(storage.get_std_errors(),
-                         self.outdir,
-                         self.std_err_filename,
-                         filename_suffix=filename_suffix,
-                         subdir=True, unique=True)
-
-        # Print the process time.
-        run_time = int(time.time()) - start_time
-        run_time_min, run_time_sec = divmod(run_time, 60)
-        run_time_hour, run_time_min = divmod(run_time_min, 60)
-        print("Finished in  {} hour(s), {} minute(s) and "
-              "{} second(s)".format(int(run_time_hour),
-                                    int(run_time_min),
-                                    int(run_time_sec)))
-        print("Received {:.2f} analyses per minute".format((self.n_eqtls * (self.n_perm + 1)) /
-                                                           (run_time / 60)))
+            print("Creating permutation seed")
+            permutation_orders = PermutationOrders.create(n_permutations=self.n_perm,
+                                                          n_samples=self.n_samples,
+                                                          seed=self.perm_seed)
+            permutation_orders.save(perm_orders_outfile)
+            print("\tseed: {}".format(permutation_orders.get_seed()))
 
-        # Shutdown the manager.
-        print("Shutting down manager [{}]".format(
-            datetime.now().strftime("%d-%m-%Y, %H:%M:%S")), flush=True)
+        return permutation_orders
 
-    def work(self, permutation_orders):
+    def load_data(self, permutation_orders):
         # Load the data
         print("Loading data", flush=True)
         tech_covs_df = load_dataframe(self.tech_covs_inpath, header=0, index_col=0)
         covs_df = load_dataframe(self.covs_inpath, header=0, index_col=0)
 
-        geno_df = load_dataframe(self.geno_inpath, header=0, index_col=0,
-                                 skiprows=[i for i in
-                                           range(1,  self.skip_rows + 1)],
-                                 nrows=self.n_eqtls)
-        expr_df = load_dataframe(self.expr_inpath, header=0, index_col=0,
-                                 skiprows=[i for i in
-                                           range(1,  self.skip_rows + 1)],
-                                 nrows=self.n_eqtls)
+        geno_df = load_dataframe_rows(self.geno_inpath, header=0, index_col=0,
+                                      skip_rows=self.skip_rows,
+                                      nrows=self.n_eqtls,
+                                      dtype=get_genotype_read_dtype(self.geno_dtype))
+        expr_df = load_dataframe_rows(self.expr_inpath, header=0, index_col=0,
+                                      skip_rows=self.skip_rows,
+                                      nrows=self.n_eqtls,
+                                      dtype=self.expr_dtype)
 
         # Validate the dataframes match up.
         dfs = [tech_covs_df, covs_df, geno_df, expr_df]
@@ -184,177 +368,320 @@ class Main:
                 print("Order of samples are not identical.")
                 exit()
 
-        # Replace -1 with NaN in the genotype dataframe. This way we can
-        # drop missing values.
-        geno_df.replace(-1, np.nan, inplace=True)
-
-        # Initialize the storage object.
-        print("Creating storage object")
-        storage = StorageContainer(colnames=covs_df.index.to_list())
-
-        # Start working.
-        print("Starting interaction analyser", flush=True)
-        for row_index, eqtl_index in enumerate([i for i in
-                                                range(self.skip_rows,
-                                                      self.skip_rows +
-                                                      self.n_eqtls)]):
-            print("\tProcessing eQTL {}/{} "
-                  "[{:.0f}%]".format(row_index + 1,
-                                     self.n_eqtls,
-                                     (100 / self.n_eqtls) * (row_index + 1)),
-                  flush=True)
-            start_time = time.time()
-
-            # Get the complete genotype row for the permutation later.
-            genotype_all = geno_df.iloc[row_index, :].copy()
-
-            # Get the missing genotype indices.
-            indices = np.arange(geno_df.shape[1])
-            eqtl_indices = indices[~geno_df.iloc[row_index, :].isnull().values]
-
-            # Subset the row and present samples for this eQTL.
-            genotype = geno_df.iloc[row_index, eqtl_indices].copy()
-            expression = expr_df.iloc[row_index, eqtl_indices].copy()
-            technical_covs = tech_covs_df.iloc[:, eqtl_indices].copy()
-
-            # Initialize variables.
-            storage.add_row(eqtl_index, "{}_{}".format(genotype.name, expression.name))
-
-            # Create the base model. Null model are all the technical
-            # covariates multiplied with the genotype + the SNP.
-            intercept = pd.DataFrame(1, index=genotype.index,
-                                     columns=["intercept"])
-            base_matrix = reduce(lambda left, right: pd.merge(left,
-                                                              right,
-                                                              left_index=True,
-                                                              right_index=True),
-                                 [intercept,
-                                  genotype.to_frame(),
-                                  technical_covs.T])
-            if self.correct_snp_tc_inter:
-                tech_inter_matrix = technical_covs.mul(genotype, axis=1)
-                tech_inter_matrix.index = ["{}_X_SNP".format(x) for x in
-                                           technical_covs.index]
-                base_matrix = base_matrix.merge(tech_inter_matrix.T,
-                                                left_index=True,
-                                                right_index=True)
-
-            # Regress out the base model from the expression values.
-            expression_hat = self.remove_covariates(expression, base_matrix)
-
-            # Loop over the covariates.
-            for cov_index in range(len(covs_df.index)):
-                if storage.has_error():
-                    break
-
-                # Get the covariate we are processing.
-                covariate = covs_df.iloc[cov_index, eqtl_indices].copy()
-                cov_name = covariate.name
+        # Replace -1 with NaN (or the uint8 missing value) in the genotype
+        # dataframe. This way we can drop missing values. The reference
+        # engine works on float64 dataframes, the numpy engine keeps the
+        # matrices in their storage dtype and upcasts one eQTL at a time.
+        geno_df = encode_genotype(geno_df, self.geno_dtype)
+        if self.engine != "numpy":
+            geno_df = decode_genotype_df(geno_df)
+            expr_df = expr_df.astype(np.float64)
+
+        # Safe the data on the instance. Worker processes are forked and
+        # share these objects read-only (copy-on-write) instead of having
+        # them pickled per task.
+        self.tech_covs_df = tech_covs_df
+        self.covs_df = covs_df
+        self.geno_df = geno_df
+        self.expr_df = expr_df
+        self.permutation_orders = permutation_orders
+        if self.engine == "numpy":
+            self.geno_m = geno_df.values
+            self.expr_m = expr_df.values
+            self.tech_covs_m = tech_covs_df.values.astype(np.float64)
+            self.covs_m = covs_df.values.astype(np.float64)
+            self.perm_m = self.get_perm_matrix(permutation_orders)
+
+        return geno_df, expr_df, covs_df
 
+    @staticmethod
+    def fit_beta_approximation(storage):
+        arrays = storage.get_arrays()
+        min_perm_pvalues = BetaApproximation.get_min_perm_pvalues(arrays["perm_pvalues"])
+        shape1, shape2 = BetaApproximation.fit(min_perm_pvalues)
+        storage.set_beta_values(shape1, shape2,
+                                BetaApproximation.get_pvalues(arrays["pvalues"],
+                                                              shape1[:, np.newaxis],
+                                                              shape2[:, np.newaxis]))
+
+    def write_shard(self, storage, start):
+        shard_path = Shard.write(directory=self.shard_dir,
+                                 start=start,
+                                 end=start + storage.get_n_rows(),
+                                 covariates=storage.get_colnames(),
+                                 arrays=storage.get_arrays(),
+                                 info={"n_samples": self.n_samples,
+                                       "n_permutations": self.n_perm,
+                                       "cores": self.cores,
+                                       "engine": self.engine,
+                                       "adaptive_permutations": self.adaptive_perm})
+        print("\tcreated {}".format(os.path.join(os.path.basename(self.shard_dir),
+                                                 os.path.basename(shard_path))))
+
+        # A rerun of an interrupted batch replaces its partial shard, the
+        # range must not be covered twice.
+        for path in Shard.remove_covered(directory=self.shard_dir,
+                                         start=start,
+                                         end=start + storage.get_n_rows(),
+                                         keep=shard_path):
+            print("\tremoved {}".format(os.path.join(os.path.basename(self.shard_dir),
+                                                     os.path.basename(path))))
+
+        return shard_path
+
+    def process_eqtl(self, row_index):
+        start_time = time.time()
+
+        if self.engine == "numpy":
+            pvalues, coefficients, std_errors, n_perm_used = self.test_eqtl(decode_genotype(self.geno_m[row_index, :]),
+                                                                            self.expr_m[row_index, :].astype(np.float64),
+                                                                            self.tech_covs_m,
+                                                                            self.covs_m,
+                                                                            self.perm_m)
+        else:
+            pvalues, coefficients, std_errors = self.test_eqtl_reference(row_index)
+            n_perm_used = np.full(pvalues.shape[0], pvalues.shape[1] - 1)
+
+        return pvalues, coefficients, std_errors, n_perm_used, time.time() - start_time
+
+    def test_eqtl_reference(self, row_index):
+        geno_df = self.geno_df
+        expr_df = self.expr_df
+        tech_covs_df = self.tech_covs_df
+        covs_df = self.covs_df
+
+        n_covs = covs_df.shape[0]
+        n_orders = len(self.permutation_orders)
+        pvalues = np.full((n_covs, n_orders), np.nan)
+        coefficients = np.full((n_covs, n_orders), np.nan)
+        std_errors = np.full((n_covs, n_orders), np.nan)
+
+        # Get the complete genotype row for the permutation later.
+        genotype_all = geno_df.iloc[row_index, :].copy()
+
+        # Get the missing genotype indices.
+        indices = np.arange(geno_df.shape[1])
+        eqtl_indices = indices[~geno_df.iloc[row_index, :].isnull().values]
+
+        # Subset the row and present samples for this eQTL.
+        genotype = geno_df.iloc[row_index, eqtl_indices].copy()
+        expression = expr_df.iloc[row_index, eqtl_indices].copy()
+        technical_covs = tech_covs_df.iloc[:, eqtl_indices].copy()
+
+        # Create the base model. Null model are all the technical
+        # covariates multiplied with the genotype + the SNP.
+        intercept = pd.DataFrame(1, index=genotype.index,
+                                 columns=["intercept"])
+        base_matrix = reduce(lambda left, right: pd.merge(left,
+                                                          right,
+                                                          left_index=True,
+                                                          right_index=True),
+                             [intercept,
+                              genotype.to_frame(),
+                              technical_covs.T])
+        if self.correct_snp_tc_inter:
+            tech_inter_matrix = technical_covs.mul(genotype, axis=1)
+            tech_inter_matrix.index = ["{}_X_SNP".format(x) for x in
+                                       technical_covs.index]
+            base_matrix = base_matrix.merge(tech_inter_matrix.T,
+                                            left_index=True,
+                                            right_index=True)
+
+        # Regress out the base model from the expression values.
+        expression_hat = self.remove_covariates(expression, base_matrix)
+
+        # Loop over the covariates.
+        for cov_index in range(n_covs):
+            # Get the covariate we are processing.
+            covariate = covs_df.iloc[cov_index, eqtl_indices].copy()
+            cov_name = covariate.name
+
+            if self.verbose:
+                print("\t\tWorking on '{}'".format(cov_name), flush=True)
+
+            # Create the null model.
+            null_matrix = covariate.to_frame()
+            n_null = null_matrix.shape[0]
+            df_null, rss_null, _, _ = self.create_model(null_matrix,
+                                                        expression_hat)
+
+            if self.verbose:
+                print("\t\tn_null: {}\tdf_null: {}\trss_null: {}\t".format(n_null, df_null, rss_null))
+
+            # Loop over each permutation sample order. The first order
+            # is the normal order and the remainder are random shuffles.
+            for order_id, sample_order in enumerate(self.permutation_orders):
                 if self.verbose:
-                    print("\t\tWorking on '{}'".format(cov_name), flush=True)
-
-                # Create the null model.
-                null_matrix = covariate.to_frame()
-                n_null = null_matrix.shape[0]
-                df_null, rss_null, _, _ = self.create_model(null_matrix,
-                                                            expression_hat)
+                    print("\t\t\tWorking on 'order_{}'".format(order_id),
+                          flush=True)
+
+                # Reorder the covariate based on the sample order.
+                # Make sure the labels are in the same order, just
+                # shuffle the values.
+                covariate_all = covs_df.iloc[cov_index, :].copy()
+                if sample_order is not None:
+                    covariate_all_index = covariate_all.index
+                    covariate_all = covariate_all.reindex(covariate_all.index[sample_order])
+                    covariate_all.index = covariate_all_index
+
+                # Calculate the interaction effect of the covariate of
+                # interest. Then drop the NA's from the interaction
+                # term.
+                inter_of_interest = covariate_all * genotype_all
+                inter_name = "{}_X_SNP".format(cov_name)
+                inter_of_interest.name = inter_name
+                inter_of_interest = inter_of_interest.iloc[eqtl_indices]
+
+                del covariate_all
+
+                # Check if the drop is identical (see above).
+                if not inter_of_interest.index.equals(null_matrix.index):
+                    print("\t\t\tError in permutation reordering "
+                          "(ID: {})".format(order_id), flush=True)
+                    continue
+
+                # Create the alternative matrix and add the interaction
+                # term.
+                alt_matrix = null_matrix.copy()
+                alt_matrix = alt_matrix.merge(inter_of_interest.to_frame(),
+                                              left_index=True,
+                                              right_index=True)
+
+                del inter_of_interest
+
+                # Create the alternative model.
+                n_alt = alt_matrix.shape[0]
+                df_alt, rss_alt, coefficients_alt, std_errors_alt = self.create_model(alt_matrix,
+                                                                                      expression_hat,
+                                                                                      cols=[inter_name])
+
+                del alt_matrix
 
                 if self.verbose:
-                    print("\t\tn_null: {}\tdf_null: {}\trss_null: {}\t".format(n_null, df_null, rss_null))
+                    print("\t\t\tn_alt: {}\tdf_alt: {}\trss_alt: {}\talt_coefficients: {}\talt_std_erros: {}".format(n_alt, df_alt, rss_alt, coefficients_alt, std_errors_alt))
 
-                # Loop over each permutation sample order. The first order
-                # is the normal order and the remainder are random shuffles.
-                for order_id, sample_order in enumerate(permutation_orders):
-                    if storage.has_error():
-                        break
+                # Make sure the n's are identical.
+                if n_null != n_alt:
+                    print("\t\t\tError due to unequal n_null and n_alt",
+                          flush=True)
+                    continue
 
-                    if self.verbose:
-                        print("\t\t\tWorking on 'order_{}'".format(order_id),
-                              flush=True)
-
-                    # Reorder the covariate based on the sample order.
-                    # Make sure the labels are in the same order, just
-                    # shuffle the values.
-                    covariate_all = covs_df.iloc[cov_index, :].copy()
-                    if sample_order is not None:
-                        covariate_all_index = covariate_all.index
-                        covariate_all = covariate_all.reindex(covariate_all.index[sample_order])
-                        covariate_all.index = covariate_all_index
-
-                    # Calculate the interaction effect of the covariate of
-                    # interest. Then drop the NA's from the interaction
-                    # term.
-                    inter_of_interest = covariate_all * genotype_all
-                    inter_name = "{}_X_SNP".format(cov_name)
-                    inter_of_interest.name = inter_name
-                    inter_of_interest = inter_of_interest.iloc[eqtl_indices]
-
-                    del covariate_all
-
-                    # Check if the drop is identical (see above).
-                    if not inter_of_interest.index.equals(null_matrix.index):
-                        print("\t\t\tError in permutation reordering "
-                              "(ID: {})".format(order_id), flush=True)
-                        storage.set_error()
-                        continue
-
-                    # Create the alternative matrix and add the interaction
-                    # term.
-                    alt_matrix = null_matrix.copy()
-                    alt_matrix = alt_matrix.merge(inter_of_interest.to_frame(),
-                                                  left_index=True,
-                                                  right_index=True)
-
-                    del inter_of_interest
-
-                    # Create the alternative model.
-                    n_alt = alt_matrix.shape[0]
-                    df_alt, rss_alt, coefficients_alt, std_errors_alt = self.create_model(alt_matrix,
-                                                                                          expression_hat,
-                                                                                          cols=[inter_name])
-
-                    del alt_matrix
-
-                    if self.verbose:
-                        print("\t\t\tn_alt: {}\tdf_alt: {}\trss_alt: {}\talt_coefficients: {}\talt_std_erros: {}".format(n_alt, df_alt, rss_alt, coefficients_alt, std_errors_alt))
-
-                    # Make sure the n's are identical.
-                    if n_null != n_alt:
-                        print("\t\t\tError due to unequal n_null and n_alt",
-                              flush=True)
-                        storage.set_error()
-                        continue
-
-                    # Safe the coefficient and std error.
-                    storage.add_coefficient(order_id, coefficients_alt[inter_name])
-                    storage.add_std_error(order_id, std_errors_alt[inter_name])
-
-                    # Compare the null and alternative model.
-                    fvalue = self.calc_f_value(rss_null, rss_alt,
-                                               df_null, df_alt, n_null)
-                    pvalue = self.get_p_value(fvalue, df_null, df_alt, n_null)
-
-                    if self.verbose:
-                        print("\t\t\tfvalue: {}\tpvalue: {}".format(fvalue, pvalue))
-
-                    # Safe the p-values.
-                    storage.add_pvalue(order_id, pvalue)
-
-                    del fvalue, pvalue
-
-                    # Check whether we are almost running out of time.
-                    if time.time() > self.panic_time:
-                        print("\tPanic!!!", flush=True)
-                        return storage
-
-            # Safe the results of the eQTL.
-            storage.store_row()
+                # Safe the coefficient and std error.
+                coefficients[cov_index, order_id] = coefficients_alt[inter_name]
+                std_errors[cov_index, order_id] = std_errors_alt[inter_name]
 
-            # Print the time.
-            print("\t\tfinished in {:.4f} second(s).".format(time.time() - start_time, flush=True))
+                # Compare the null and alternative model.
+                fvalue = self.calc_f_value(rss_null, rss_alt,
+                                           df_null, df_alt, n_null)
+                pvalue = self.get_p_value(fvalue, df_null, df_alt, n_null)
 
-        return storage
+                if self.verbose:
+                    print("\t\t\tfvalue: {}\tpvalue: {}".format(fvalue, pvalue))
+
+                # Safe the p-values.
+                pvalues[cov_index, order_id] = pvalue
+
+                del fvalue, pvalue
+
+        return pvalues, coefficients, std_errors
+
+    def test_eqtl(self, genotype_all, expression_all, tech_covs, covs,
+                  perm_matrix):
+        # Get the present genotype indices.
+        eqtl_indices = np.flatnonzero(~np.isnan(genotype_all))
+        genotype = genotype_all[eqtl_indices]
+        expression = expression_all[eqtl_indices]
+        technical_covs = tech_covs[:, eqtl_indices]
+
+        # Create the base model and regress it out of the expression.
+        base_matrix = [np.ones_like(genotype), genotype, technical_covs]
+        if self.correct_snp_tc_inter:
+            base_matrix.append(technical_covs * genotype)
+        base_matrix = np.vstack(base_matrix).T
+        expression_hat = InteractionEngine.remove_covariates(expression,
+                                                             base_matrix)
+
+        # Shuffle the covariate values of the present samples only.
+        perm_subset = perm_matrix[:, eqtl_indices]
+
+        n_covs = covs.shape[0]
+        n_orders = perm_matrix.shape[0]
+        pvalues = np.empty((n_covs, n_orders))
+        coefficients = np.empty((n_covs, n_orders))
+        std_errors = np.empty((n_covs, n_orders))
+        n_perm_used = np.full(n_covs, n_orders - 1)
+        for cov_index in range(n_covs):
+            covariate_all = covs[cov_index, :]
+            if self.adaptive_perm:
+                pvalues[cov_index, :], coefficients[cov_index, :], std_errors[cov_index, :], n_perm_used[cov_index] = \
+                    self.test_covariate_adaptive(expression_hat,
+                                                 covariate_all,
+                                                 genotype,
+                                                 perm_subset)
+                continue
+
+            inter_matrix = covariate_all[perm_subset] * genotype
+            pvalues[cov_index, :], coefficients[cov_index, :], std_errors[cov_index, :] = \
+                InteractionEngine.test_interactions(expression_hat,
+                                                    covariate_all[eqtl_indices],
+                                                    inter_matrix)
+
+        return pvalues, coefficients, std_errors, n_perm_used
+
+    def test_covariate_adaptive(self, expression_hat, covariate_all, genotype,
+                                perm_subset):
+        """
+        Sequential (Besag-Clifford) permutations: the permutation orders are
+        tested in chunks and permuting stops at the permutation where the
+        number of permuted p-values <= the real p-value reaches
+        adaptive_permutations_exceedances. Orders after that stay NaN.
+
+        :return : the p-values, coefficients and std errors per order and
+                  the number of permutations that were used.
+        """
+        n_orders = perm_subset.shape[0]
+        pvalues = np.full(n_orders, np.nan)
+        coefficients = np.full(n_orders, np.nan)
+        std_errors = np.full(n_orders, np.nan)
+
+        # The first order is the real (identity) order.
+        covariate = covariate_all[perm_subset[0, :]]
+        real_pvalue = np.nan
+        n_exceedances = 0
+        start = 0
+        while start < n_orders:
+            end = min(start + self.adaptive_chunk_size, n_orders)
+            inter_matrix = covariate_all[perm_subset[start:end, :]] * genotype
+            pvalues[start:end], coefficients[start:end], std_errors[start:end] = \
+                InteractionEngine.test_interactions(expression_hat,
+                                                    covariate,
+                                                    inter_matrix)
+            if start == 0:
+                real_pvalue = pvalues[0]
+                if np.isnan(real_pvalue):
+                    return pvalues, coefficients, std_errors, 0
+                start = 1
+
+            exceedances = n_exceedances + np.cumsum(pvalues[start:end] <= real_pvalue)
+            if exceedances[-1] >= self.adaptive_exceedances:
+                last_order = start + int(np.argmax(exceedances >= self.adaptive_exceedances))
+                pvalues[last_order + 1:] = np.nan
+                coefficients[last_order + 1:] = np.nan
+                std_errors[last_order + 1:] = np.nan
+                return pvalues, coefficients, std_errors, last_order
+
+            n_exceedances = exceedances[-1]
+            start = end
+
+        return pvalues, coefficients, std_errors, n_orders - 1
+
+    def get_perm_matrix(self, permutation_orders):
+        if isinstance(permutation_orders, PermutationOrders):
+            return permutation_orders.get_matrix()
+
+        identity = np.arange(self.n_samples)
+        return np.array([identity if order is None else order
+                         for order in permutation_orders], dtype=np.intp)
 
     @staticmethod
     def load_pickle(fpath):
@@ -395,17 +722,6 @@ class Main:
                                  os.path.basename(fpath))
         print("\tcreated {}".format(print_str))
 
-    def create_perm_orders(self):
-        sample_orders = [None]
-        for _ in range(self.n_perm):
-            sample_orders.append(self.create_random_shuffle())
-        return sample_orders
-
-    def create_random_shuffle(self):
-        column_indices = [x for x in range(self.n_samples)]
-        random.shuffle(column_indices)
-        return column_indices
-
     @staticmethod
     def write_buffer(filename, buffer):
         with gzip.open(filename, 'wb') as f:
@@ -485,10 +801,13 @@ class Main:
         return stats.f.sf(f_value, dfn=(df2 - df1), dfd=(n - df2))
 
     def print_arguments(self):
-        panic_time_string = datetime.fromtimestamp(self.panic_time).strftime(
-            "%d-%m-%Y, %H:%M:%S")
-        end_time_string = datetime.fromtimestamp(self.max_end_time).strftime(
-            "%d-%m-%Y, %H:%M:%S")
+        panic_time_string = "none"
+        end_time_string = "none"
+        if self.panic_time is not None:
+            panic_time_string = datetime.fromtimestamp(self.panic_time).strftime(
+                "%d-%m-%Y, %H:%M:%S")
+            end_time_string = datetime.fromtimestamp(self.max_end_time).strftime(
+                "%d-%m-%Y, %H:%M:%S")
         print("Arguments:")
         print("  > Input directory: {}".format(self.input))
         print("  > Output directory: {}".format(self.outdir))
@@ -501,6 +820,14 @@ class Main:
         print("  > Skip rows: {}".format(self.skip_rows))
         print("  > EQTLs: {}".format(self.n_eqtls))
         print("  > Samples: {}".format(self.n_samples))
+        print("  > Cores: {}".format(self.cores))
         print("  > Permutations: {}".format(self.n_perm))
+        print("  > Engine: {}".format(self.engine))
+        print("  > Genotype dtype: {}".format(self.geno_dtype))
+        print("  > Expression dtype: {}".format(self.expr_dtype))
+        print("  > Adaptive permutations: {}".format(self.adaptive_perm))
+        if self.adaptive_perm:
+            print("  > Adaptive exceedances: {}".format(self.adaptive_exceedances))
+        print("  > Beta approximation: {}".format(self.beta_approximation))
         print("  > Verbose: {}".format(self.verbose))
         print("", flush=True)
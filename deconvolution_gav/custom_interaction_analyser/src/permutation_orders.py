@@ -0,0 +1,137 @@
+"""
+File:         permutation_orders.py
+Created:      2020/10/30
+Last Changed:
+Author:       M.Vochteloo
+
+Copyright (C) 2020 M.Vochteloo
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+A copy of the GNU General Public License can be found in the LICENSE file in the
+root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Standard imports.
+import random
+import json
+import os
+
+# Third party imports.
+import numpy as np
+
+# Local application imports.
+
+
+class PermutationOrders:
+    """
+    Sample orders that are generated on demand from a seed. Order i > 0 is
+    drawn from a Philox (counter-based) generator keyed with (seed, i), so
+    every order can be recreated by index without generating the others.
+    Order 0 is the real order (None), like in the old pickled list.
+    """
+    VERSION = 1
+
+    def __init__(self, seed, n_permutations, n_samples):
+        self.seed = int(seed)
+        self.n_permutations = n_permutations
+        self.n_samples = n_samples
+
+    @staticmethod
+    def create(n_permutations, n_samples, seed=None):
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(63)
+        return PermutationOrders(seed, n_permutations, n_samples)
+
+    @staticmethod
+    def load(fpath):
+        with open(fpath, "r") as f:
+            content = json.load(f)
+        f.close()
+
+        if content.get("version") != PermutationOrders.VERSION or \
+                content.get("generator") != "philox":
+            return None
+
+        return PermutationOrders(content["seed"],
+                                 content["n_permutations"],
+                                 content["n_samples"])
+
+    def save(self, fpath):
+        tmp_fpath = fpath + ".tmp"
+        with open(tmp_fpath, "w") as f:
+            json.dump({"version": self.VERSION,
+                       "generator": "philox",
+                       "seed": self.seed,
+                       "n_permutations": self.n_permutations,
+                       "n_samples": self.n_samples}, f, indent=2)
+        f.close()
+        os.replace(tmp_fpath, fpath)
+
+    def get_seed(self):
+        return self.seed
+
+    def get_n_permutations(self):
+        return self.n_permutations
+
+    def get_n_samples(self):
+        return self.n_samples
+
+    def get_dtype(self):
+        if self.n_samples <= np.iinfo(np.uint16).max + 1:
+            return np.uint16
+        return np.uint32
+
+    def get_order(self, index):
+        """
+        Method returning a single sample order.
+
+        :param index: int, the order index (0 is the real order).
+        :return : ndarray, the sample order, or None for index 0.
+        """
+        if index < 0 or index > self.n_permutations:
+            raise IndexError("permutation order index out of range")
+        if index == 0:
+            return None
+
+        generator = np.random.Generator(np.random.Philox(key=np.array([self.seed, index],
+                                                                      dtype=np.uint64)))
+        return generator.permutation(self.n_samples).astype(self.get_dtype())
+
+    def get_matrix(self, dtype=None):
+        """
+        Method returning all orders as a matrix, the real order (identity)
+        included as the first row.
+
+        :param dtype: the integer dtype, default: the smallest of uint16 and
+                      uint32 that fits the sample indices.
+        :return : ndarray, (n_permutations + 1) x n_samples.
+        """
+        if dtype is None:
+            dtype = self.get_dtype()
+
+        matrix = np.empty((self.n_permutations + 1, self.n_samples),
+                          dtype=dtype)
+        matrix[0, :] = np.arange(self.n_samples)
+        for index in range(1, self.n_permutations + 1):
+            matrix[index, :] = self.get_order(index)
+
+        return matrix
+
+    def __len__(self):
+        return self.n_permutations + 1
+
+    def __getitem__(self, index):
+        return self.get_order(index)
+
+    def __iter__(self):
+        for index in range(self.n_permutations + 1):
+            yield self.get_order(index)
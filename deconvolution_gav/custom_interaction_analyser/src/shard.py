@@ -0,0 +1,202 @@
+"""
+File:         shard.py
+Created:      2020/10/29
+Last Changed: 2020/10/30
+Author:       M.Vochteloo
+
+Copyright (C) 2020 M.Vochteloo
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+A copy of the GNU General Public License can be found in the LICENSE file in the
+root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Standard imports.
+import shutil
+import json
+import glob
+import time
+import os
+
+# Third party imports.
+import numpy as np
+
+# Local application imports.
+
+
+class Shard:
+    """
+    Columnar output of one CIA batch. A shard is a directory with a JSON
+    header and one .npy file per array, so every array can be memory
+    mapped without copying or unpickling it.
+
+    The header holds the format version, the eQTL index range of the
+    batch, the covariate names, the run info (e.g. the number of samples
+    and permutations) and the dtype / shape of every array. The
+    shard is written to a temporary directory first and then renamed, so
+    a killed job never leaves a half written shard behind.
+    """
+    VERSION = 1
+    HEADER_FILENAME = "header.json"
+    PREFIX = "shard"
+
+    def __init__(self, path, header, arrays):
+        self.path = path
+        self.header = header
+        self.arrays = arrays
+
+    @staticmethod
+    def get_name(start, end):
+        return "{}_{}_{}".format(Shard.PREFIX, start, end)
+
+    @staticmethod
+    def write(directory, start, end, covariates, arrays, info=None):
+        """
+        Method for writing a shard.
+
+        :param directory: string, the directory to write the shard in.
+        :param start: int, the first eQTL index of the batch.
+        :param end: int, the eQTL index after the last row of the batch.
+        :param covariates: list, the covariate names (columns).
+        :param arrays: dict, array name -> ndarray. The first dimension of
+                       every array is the row (eQTL) dimension.
+        :param info: dict, information about the run that created the
+                     shard, default: None.
+        :return : string, the path of the shard.
+        """
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        path = os.path.join(directory, Shard.get_name(start, end))
+        tmp_path = path + ".tmp"
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+
+        header = {"version": Shard.VERSION,
+                  "start": int(start),
+                  "end": int(end),
+                  "covariates": list(covariates),
+                  "created": int(time.time()),
+                  "info": info,
+                  "arrays": {}}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            if array.dtype == object:
+                array = array.astype(str)
+            np.save(os.path.join(tmp_path, name + ".npy"), array,
+                    allow_pickle=False)
+            header["arrays"][name] = {"dtype": array.dtype.str,
+                                      "shape": list(array.shape)}
+
+        with open(os.path.join(tmp_path, Shard.HEADER_FILENAME), "w") as f:
+            json.dump(header, f, indent=2)
+        f.close()
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+
+        return path
+
+    @staticmethod
+    def load(path, mmap_mode="r"):
+        """
+        Method for loading a shard.
+
+        :param path: string, the shard directory.
+        :param mmap_mode: string, the numpy memory map mode; None reads the
+                          arrays into memory.
+        :return : Shard, or None if the shard is invalid.
+        """
+        header_path = os.path.join(path, Shard.HEADER_FILENAME)
+        if not os.path.isfile(header_path):
+            print("\t\tNo header in: {}".format(os.path.basename(path)))
+            return None
+
+        with open(header_path, "r") as f:
+            header = json.load(f)
+        f.close()
+
+        if header.get("version") != Shard.VERSION:
+            print("\t\tUnsupported shard version {} in: "
+                  "{}".format(header.get("version"), os.path.basename(path)))
+            return None
+
+        arrays = {}
+        for name, info in header["arrays"].items():
+            array = np.load(os.path.join(path, name + ".npy"),
+                            mmap_mode=mmap_mode, allow_pickle=False)
+            if list(array.shape) != info["shape"]:
+                print("\t\tInvalid {} array in: "
+                      "{}".format(name, os.path.basename(path)))
+                return None
+            arrays[name] = array
+
+        return Shard(path, header, arrays)
+
+    @staticmethod
+    def list_shards(directory):
+        return sorted(glob.glob(os.path.join(directory,
+                                             Shard.PREFIX + "_*_*[0-9]")))
+
+    @staticmethod
+    def remove_covered(directory, start, end, keep=None):
+        """
+        Method for removing the shards of which the eQTL index range lies
+        within [start, end), e.g. the partial shard of a batch that was
+        interrupted and has been rerun.
+
+        :param directory: string, the shard directory.
+        :param start: int, the first eQTL index of the range.
+        :param end: int, the eQTL index after the last row of the range.
+        :param keep: string, the path of a shard that is not removed.
+        :return : list, the paths of the removed shards.
+        """
+        removed = []
+        for path in Shard.list_shards(directory):
+            if keep is not None and os.path.abspath(path) == os.path.abspath(keep):
+                continue
+            parts = os.path.basename(path).split("_")
+            try:
+                shard_start, shard_end = int(parts[-2]), int(parts[-1])
+            except (ValueError, IndexError):
+                continue
+            if start <= shard_start and shard_end <= end:
+                shutil.rmtree(path)
+                removed.append(path)
+
+        return removed
+
+    def get_path(self):
+        return self.path
+
+    def get_header(self):
+        return self.header
+
+    def get_start(self):
+        return self.header["start"]
+
+    def get_end(self):
+        return self.header["end"]
+
+    def get_covariates(self):
+        return self.header["covariates"]
+
+    def get_info(self):
+        return self.header.get("info")
+
+    def get_array(self, name):
+        return self.arrays[name]
+
+    def get_array_names(self):
+        return list(self.arrays.keys())
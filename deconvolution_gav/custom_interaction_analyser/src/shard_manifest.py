@@ -0,0 +1,181 @@
+"""
+File:         shard_manifest.py
+Created:      2020/10/30
+Last Changed:
+Author:       M.Vochteloo
+
+Copyright (C) 2020 M.Vochteloo
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+A copy of the GNU General Public License can be found in the LICENSE file in the
+root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Standard imports.
+import hashlib
+import json
+import os
+
+# Third party imports.
+import numpy as np
+
+# Local application imports.
+
+
+class ShardManifest:
+    """
+    Record of the shards that are combined already. Every entry holds the
+    path, eQTL index range, number of rows, size, creation time and
+    checksum of a shard. A shard whose size and creation time match its
+    entry is unchanged; otherwise its checksum decides whether it was
+    replaced. An unchanged shard with a new size or creation time gets
+    these written back, so its checksum is only computed once.
+    """
+    VERSION = 1
+    FILENAME = "shard_manifest.json"
+
+    def __init__(self, covariates, entries=None):
+        self.covariates = list(covariates)
+        if entries is None:
+            entries = {}
+        self.entries = entries
+        self.modified = False
+
+    @staticmethod
+    def load(fpath):
+        if not os.path.isfile(fpath):
+            return None
+
+        with open(fpath, "r") as f:
+            content = json.load(f)
+        f.close()
+
+        if content.get("version") != ShardManifest.VERSION:
+            return None
+
+        return ShardManifest(content["covariates"], content["shards"])
+
+    def save(self, fpath):
+        tmp_fpath = fpath + ".tmp"
+        with open(tmp_fpath, "w") as f:
+            json.dump({"version": self.VERSION,
+                       "covariates": self.covariates,
+                       "shards": self.entries}, f, indent=2)
+        f.close()
+        os.replace(tmp_fpath, fpath)
+
+    @staticmethod
+    def get_key(shard):
+        return os.path.basename(shard.get_path())
+
+    @staticmethod
+    def get_size(path):
+        return sum(os.path.getsize(os.path.join(path, fname))
+                   for fname in os.listdir(path))
+
+    @staticmethod
+    def calc_checksum(path):
+        md5 = hashlib.md5()
+        for fname in sorted(os.listdir(path)):
+            md5.update(fname.encode())
+            with open(os.path.join(path, fname), "rb") as f:
+                while True:
+                    chunk = f.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    md5.update(chunk)
+            f.close()
+
+        return md5.hexdigest()
+
+    @staticmethod
+    def create_entry(shard, checksum=None):
+        path = shard.get_path()
+        if checksum is None:
+            checksum = ShardManifest.calc_checksum(path)
+        return {"path": os.path.abspath(path),
+                "start": shard.get_start(),
+                "end": shard.get_end(),
+                "n_rows": int(shard.get_array("eqtl_indices").shape[0]),
+                "size": ShardManifest.get_size(path),
+                "created": shard.get_header().get("created"),
+                "checksum": checksum}
+
+    def compare(self, shards):
+        """
+        Method for comparing shards with the manifest.
+
+        :param shards: list, the shards that are present now.
+        :return new: list, shards that are not in the manifest.
+        :return replaced: list, shards that differ from their entry.
+        :return unchanged: list, shards that match their entry.
+        :return removed: list, keys of entries without a shard.
+        """
+        new = []
+        replaced = []
+        unchanged = []
+        for shard in shards:
+            entry = self.entries.get(self.get_key(shard))
+            size = self.get_size(shard.get_path())
+            created = shard.get_header().get("created")
+            if entry is None:
+                new.append(shard)
+            elif entry["size"] == size and entry["created"] == created:
+                unchanged.append(shard)
+            elif entry["checksum"] == self.calc_checksum(shard.get_path()):
+                entry["size"] = size
+                entry["created"] = created
+                self.modified = True
+                unchanged.append(shard)
+            else:
+                replaced.append(shard)
+
+        keys = set(self.get_key(shard) for shard in shards)
+        removed = [key for key in self.entries.keys() if key not in keys]
+
+        return new, replaced, unchanged, removed
+
+    def add(self, shard, entry=None):
+        if entry is None:
+            entry = self.create_entry(shard)
+        self.entries[self.get_key(shard)] = entry
+
+    def remove(self, key):
+        del self.entries[key]
+
+    def is_modified(self):
+        return self.modified
+
+    def get_covariates(self):
+        return self.covariates
+
+    def get_coverage(self):
+        """
+        Method for finding the eQTL indices that no shard or multiple
+        shards cover, between the lowest start and highest end.
+
+        :return missing: ndarray, the missing eQTL indices.
+        :return duplicated: ndarray, the eQTL indices in multiple shards.
+        """
+        if len(self.entries) == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+        starts = np.array([entry["start"] for entry in self.entries.values()])
+        ends = np.array([entry["end"] for entry in self.entries.values()])
+        offset = starts.min()
+        depth = np.zeros(ends.max() - offset + 1, dtype=np.int64)
+        np.add.at(depth, starts - offset, 1)
+        np.add.at(depth, ends - offset, -1)
+        depth = np.cumsum(depth)[:-1]
+
+        return np.flatnonzero(depth == 0) + offset, \
+            np.flatnonzero(depth > 1) + offset
@@ -1,7 +1,7 @@
 """
 File:         storage_container.py
 Created:      2020/10/14
-Last Changed: 2020/10/21
+Last Changed: 2020/10/30
 Author:       M.Vochteloo
 
 Copyright (C) 2020 M.Vochteloo
@@ -23,78 +23,120 @@ root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
 # Standard imports.
 
 # Third party imports.
-
+import numpy as np
 
 # Local application imports.
 
 
 class StorageContainer:
-    def __init__(self, colnames):
-        # Initialize the result list.
-        self.pvalues_buffer = [[-1, "-"] + colnames]
-        self.coefficients_buffer = [[-1, "-"] + colnames]
-        self.std_errors_buffer = [[-1, "-"] + colnames]
-        self.perm_pvalues_buffer = []
-
-        # Initialize a new row.
-        self.pvalues = None
-        self.perm_pvalues = None
-        self.coefficients = None
-        self.std_errors = None
+    def __init__(self, colnames, n_rows, n_permutations, dtype=np.float64,
+                 perm_dtype=np.float64):
+        self.colnames = colnames
+        n_cols = len(colnames)
+
+        # Preallocate the result arrays. Rows that are never stored or that
+        # errored stay NaN.
+        self.eqtl_indices = np.full(n_rows, -1, dtype=np.int64)
+        self.names = np.empty(n_rows, dtype=object)
+        self.pvalues = np.full((n_rows, n_cols), np.nan, dtype=dtype)
+        self.coefficients = np.full((n_rows, n_cols), np.nan, dtype=dtype)
+        self.std_errors = np.full((n_rows, n_cols), np.nan, dtype=dtype)
+        self.perm_pvalues = np.full((n_rows, n_cols, n_permutations), np.nan,
+                                    dtype=perm_dtype)
+        self.n_perm_used = np.zeros((n_rows, n_cols), dtype=np.int32)
+        self.run_times = np.full(n_rows, np.nan, dtype=np.float64)
+        self.beta_shape1 = None
+        self.beta_shape2 = None
+        self.beta_pvalues = None
 
         # Initialize variables.
         self.n_rows = 0
         self.error = False
 
     def add_row(self, eqtl_index, genotype_name):
-        self.pvalues = [eqtl_index, genotype_name]
-        self.coefficients = [eqtl_index, genotype_name]
-        self.std_errors = [eqtl_index, genotype_name]
+        self.eqtl_indices[self.n_rows] = eqtl_index
+        self.names[self.n_rows] = genotype_name
+        self.error = False
 
-        self.perm_pvalues = []
+    def set_values(self, pvalues, coefficients, std_errors, n_perm_used):
+        """
+        Set the values of the current row.
+
+        :param pvalues: ndarray, the p-values of every covariate (rows) and
+                        sample order (columns). The first order is the
+                        real one, the others are permutations.
+        :param coefficients: ndarray, the coefficient of every covariate.
+        :param std_errors: ndarray, the std error of every covariate.
+        :param n_perm_used: ndarray, the number of permutations that were
+                            used for every covariate.
+        """
+        self.pvalues[self.n_rows, :] = pvalues[:, 0]
+        self.perm_pvalues[self.n_rows, :, :] = pvalues[:, 1:]
+        self.coefficients[self.n_rows, :] = coefficients
+        self.std_errors[self.n_rows, :] = std_errors
+        self.n_perm_used[self.n_rows, :] = n_perm_used
+
+    def set_run_time(self, run_time):
+        self.run_times[self.n_rows] = run_time
 
     def store_row(self):
-        self.pvalues_buffer.append(self.pvalues)
-        self.perm_pvalues_buffer.extend(self.perm_pvalues)
-        self.coefficients_buffer.append(self.coefficients)
-        self.std_errors_buffer.append(self.std_errors)
-
-        self.pvalues = None
-        self.perm_pvalues = None
-        self.coefficients = None
-        self.std_errors = None
+        if self.error:
+            self.pvalues[self.n_rows, :] = np.nan
+            self.perm_pvalues[self.n_rows, :, :] = np.nan
+            self.coefficients[self.n_rows, :] = np.nan
+            self.std_errors[self.n_rows, :] = np.nan
+            self.n_perm_used[self.n_rows, :] = 0
 
         self.n_rows = self.n_rows + 1
 
-    def add_pvalue(self, order_id, value):
-        if order_id == 0:
-            self.pvalues.append(value)
-        else:
-            self.perm_pvalues.append(value)
-
-    def add_coefficient(self, order_id, value):
-        if order_id == 0:
-            self.coefficients.append(value)
-        else:
-            pass
-
-    def add_std_error(self, order_id, value):
-        if order_id == 0:
-            self.std_errors.append(value)
-        else:
-            pass
+    def set_beta_values(self, shape1, shape2, beta_pvalues):
+        """
+        Set the beta approximation of the stored rows.
+
+        :param shape1: ndarray, the alpha parameter of every row.
+        :param shape2: ndarray, the beta parameter of every row.
+        :param beta_pvalues: ndarray, the adjusted p-value of every row and
+                             covariate.
+        """
+        self.beta_shape1 = shape1
+        self.beta_shape2 = shape2
+        self.beta_pvalues = beta_pvalues
+
+    def get_arrays(self):
+        arrays = {"eqtl_indices": self.eqtl_indices[:self.n_rows],
+                  "names": self.names[:self.n_rows],
+                  "pvalues": self.pvalues[:self.n_rows],
+                  "coefficients": self.coefficients[:self.n_rows],
+                  "std_errors": self.std_errors[:self.n_rows],
+                  "perm_pvalues": self.perm_pvalues[:self.n_rows],
+                  "n_perm_used": self.n_perm_used[:self.n_rows],
+                  "run_times": self.run_times[:self.n_rows]}
+        if self.beta_pvalues is not None:
+            arrays["beta_shape1"] = self.beta_shape1
+            arrays["beta_shape2"] = self.beta_shape2
+            arrays["beta_pvalues"] = self.beta_pvalues
+
+        return arrays
+
+    def to_table(self, values):
+        table = [[-1, "-"] + self.colnames]
+        table.extend([[index, name] + row for index, name, row in
+                      zip(self.eqtl_indices[:self.n_rows].tolist(),
+                          self.names[:self.n_rows].tolist(),
+                          values[:self.n_rows].tolist())])
+        return table
 
     def get_pvalues(self):
-        return self.pvalues_buffer
+        return self.to_table(self.pvalues)
 
     def get_perm_pvalues(self):
-        return self.perm_pvalues_buffer
+        return self.perm_pvalues[:self.n_rows].ravel().tolist()
 
     def get_coefficients(self):
-        return self.coefficients_buffer
+        return self.to_table(self.coefficients)
 
     def get_std_errors(self):
-        return self.std_errors_buffer
+        return self.to_table(self.std_errors)
 
     def has_error(self):
         return self.error
@@ -102,5 +144,8 @@ class StorageContainer:
     def set_error(self):
         self.error = True
 
+    def get_colnames(self):
+        return self.colnames
+
     def get_n_rows(self):
         return self.n_rows
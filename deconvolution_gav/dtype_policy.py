@@ -0,0 +1,113 @@
+"""
+File:         dtype_policy.py
+Created:      2020/10/30
+Last Changed:
+Author:       M.Vochteloo
+
+Copyright (C) 2020 M.Vochteloo
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+A copy of the GNU General Public License can be found in the LICENSE file in the
+root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Standard imports.
+
+# Third party imports.
+import numpy as np
+import pandas as pd
+
+# Local application imports.
+
+# Storage dtypes of the genotype and expression matrices. The matrices are
+# kept in memory in the storage dtype and the numerical kernels upcast the
+# rows they work on to float64.
+#
+# Genotype dosages (0 - 2, -1 for missing) are stored as:
+#   float64 / float32: the dosage, NaN for missing.
+#   uint8: round(dosage * 100), 255 for missing. This is exact for dosages
+#          with at most two decimals.
+# Expression is stored as float64 or float32.
+
+GENOTYPE_DTYPES = ("float64", "float32", "uint8")
+EXPRESSION_DTYPES = ("float64", "float32")
+GENOTYPE_MISSING = -1
+UINT8_SCALE = 100
+UINT8_MISSING = 255
+
+
+def check_dtype(dtype, options, name):
+    if dtype not in options:
+        raise ValueError("Unsupported {} dtype '{}', options are: "
+                         "{}".format(name, dtype, ", ".join(options)))
+
+
+def get_genotype_read_dtype(dtype):
+    """
+    Method for getting the dtype to parse a genotype matrix with.
+
+    :param dtype: string, the genotype storage dtype.
+    :return : string, the parse dtype.
+    """
+    check_dtype(dtype, GENOTYPE_DTYPES, "genotype")
+    if dtype == "uint8":
+        return "float32"
+    return dtype
+
+
+def encode_genotype(df, dtype):
+    """
+    Method for converting a parsed genotype matrix into the storage dtype.
+
+    :param df: DataFrame, the dosages with -1 for missing values.
+    :param dtype: string, the genotype storage dtype.
+    :return : DataFrame, the encoded genotype matrix.
+    """
+    check_dtype(dtype, GENOTYPE_DTYPES, "genotype")
+    values = df.to_numpy()
+    missing = (values == GENOTYPE_MISSING) | np.isnan(values)
+
+    if dtype != "uint8":
+        values = values.astype(dtype, copy=not values.flags.writeable)
+        values[missing] = np.nan
+        return pd.DataFrame(values, index=df.index, columns=df.columns,
+                            copy=False)
+
+    present = values[~missing]
+    if present.size > 0 and (present.min() < 0 or present.max() > 2):
+        raise ValueError("Genotype dosages outside of 0 - 2 can not be "
+                         "stored as uint8")
+    encoded = np.full(values.shape, UINT8_MISSING, dtype=np.uint8)
+    encoded[~missing] = np.rint(present * UINT8_SCALE).astype(np.uint8)
+    return pd.DataFrame(encoded, index=df.index, columns=df.columns,
+                        copy=False)
+
+
+def decode_genotype(values):
+    """
+    Method for upcasting stored genotype values to float64.
+
+    :param values: ndarray, stored genotype values (any storage dtype).
+    :return : ndarray, float64 dosages with NaN for missing values.
+    """
+    values = np.asarray(values)
+    if values.dtype != np.uint8:
+        return values.astype(np.float64)
+
+    decoded = values.astype(np.float64) / UINT8_SCALE
+    decoded[values == UINT8_MISSING] = np.nan
+    return decoded
+
+
+def decode_genotype_df(df):
+    return pd.DataFrame(decode_genotype(df.to_numpy()), index=df.index,
+                        columns=df.columns)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+"""
+File:         export_results_store.py
+Created:      2020/10/30
+Last Changed:
+Author:       M.Vochteloo
+
+Copyright (C) 2020 M.Vochteloo
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+A copy of the GNU General Public License can be found in the LICENSE file in the
+root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Standard imports.
+from __future__ import print_function
+import argparse
+import time
+import os
+
+# Third party imports.
+
+# Local application imports.
+from results_store import ResultsStore, parse_filter
+from utilities import save_dataframe
+
+# Metadata
+__program__ = "Export Results Store"
+__author__ = "Martijn Vochteloo"
+__maintainer__ = "Martijn Vochteloo"
+__email__ = "m.vochteloo@rug.nl"
+__license__ = "GPLv3"
+__version__ = 1.0
+__description__ = "{} is a program developed and maintained by {}. " \
+                  "This program is licensed under the {} license and is " \
+                  "provided 'as-is' without any warranty or indemnification " \
+                  "of any kind.".format(__program__,
+                                        __author__,
+                                        __license__)
+
+"""
+Syntax:
+./export_results_store.py -i /path/to/results_store -c SNP covariate perm-FDR -f "perm-FDR<0.05" -o signif.txt.gz
+./export_results_store.py -i /path/to/results_store -table perm-FDR -o perm-FDR_table.txt.gz
+./export_results_store.py -i /path/to/results_store -molten -o molten_table.txt.gz
+"""
+
+
+class main():
+    def __init__(self):
+        # Get the command line arguments.
+        arguments = self.create_argument_parser()
+        self.indir = getattr(arguments, 'input')
+        self.columns = getattr(arguments, 'columns')
+        self.filters = getattr(arguments, 'filters')
+        self.table = getattr(arguments, 'table')
+        self.molten = getattr(arguments, 'molten')
+        self.outpath = getattr(arguments, 'output')
+
+    @staticmethod
+    def create_argument_parser():
+        parser = argparse.ArgumentParser(prog=__program__,
+                                         description=__description__)
+
+        # Add optional arguments.
+        parser.add_argument("-v",
+                            "--version",
+                            action="version",
+                            version="{} {}".format(__program__,
+                                                   __version__),
+                            help="show program's version number and exit")
+        parser.add_argument("-i",
+                            "--input",
+                            type=str,
+                            required=True,
+                            help="The path of the results store.")
+        parser.add_argument("-c",
+                            "--columns",
+                            nargs="+",
+                            type=str,
+                            default=None,
+                            help="The columns to export. Default: all.")
+        parser.add_argument("-f",
+                            "--filters",
+                            nargs="+",
+                            type=str,
+                            default=None,
+                            help="The row filters, e.g. 'perm-FDR<0.05' or "
+                                 "'covariate==CellMapNNLS_Neuron'. "
+                                 "Default: None.")
+        parser.add_argument("-table",
+                            type=str,
+                            default=None,
+                            help="Export one column as the covariate x eQTL "
+                                 "table. Default: None.")
+        parser.add_argument("-molten",
+                            action='store_true',
+                            help="Export the molten table layout. "
+                                 "Default: False.")
+        parser.add_argument("-o",
+                            "--output",
+                            type=str,
+                            required=True,
+                            help="The output path.")
+
+        return parser.parse_args()
+
+    def start(self):
+        self.print_arguments()
+
+        start_time = time.time()
+        store = ResultsStore(self.indir)
+        if self.table is not None:
+            store.export_table(self.table, self.outpath)
+        elif self.molten:
+            store.export_molten(self.outpath)
+        else:
+            filters = None
+            if self.filters is not None:
+                filters = [parse_filter(x) for x in self.filters]
+            df = store.read(columns=self.columns, filters=filters)
+            save_dataframe(df=df, outpath=self.outpath, header=True,
+                           index=False)
+        print("Exported {} in {:.2f} second(s)".format(os.path.basename(self.outpath),
+                                                     time.time() - start_time),
+              flush=True)
+
+    def print_arguments(self):
+        print("Arguments:")
+        print("  > Input: {}".format(self.indir))
+        print("  > Columns: {}".format(self.columns))
+        print("  > Filters: {}".format(self.filters))
+        print("  > Table: {}".format(self.table))
+        print("  > Molten: {}".format(self.molten))
+        print("  > Output: {}".format(self.outpath))
+        print("")
+
+
+if __name__ == '__main__':
+    m = main()
+    m.start()
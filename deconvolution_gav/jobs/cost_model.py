@@ -0,0 +1,232 @@
+"""
+File:         cost_model.py
+Created:      2020/10/30
+Last Changed:
+Author:       M.Vochteloo
+
+Copyright (C) 2020 M.Vochteloo
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+A copy of the GNU General Public License can be found in the LICENSE file in the
+root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Standard imports.
+import json
+import os
+import re
+
+# Third party imports.
+import numpy as np
+
+# Local application imports.
+
+# Runtime model of the CIA. The time of one eQTL is modelled as
+# intercept + slope * work, where work = samples * covariates *
+# (permutations + 1) is the number of (permuted) models that are fitted.
+# The model is fitted on the per-eQTL times of earlier runs, taken from the
+# job logs ("finished in X second(s)") or from the run_times array of the
+# shards. eQTLs that were timed before keep their relative cost (e.g. when
+# adaptive permutations stop early), scaled to the new settings.
+
+ARGUMENT_PATTERN = re.compile(r"^\s*> (Skip rows|Samples|Cores|Permutations): (\d+)\s*$")
+PROCESSING_PATTERN = re.compile(r"^\s*Processing eQTL (\d+)/(\d+)")
+EQTL_TIME_PATTERN = re.compile(r"^\s*finished in ([0-9.]+) second\(s\)")
+TOTAL_TIME_PATTERN = re.compile(r"^\s*Finished in\s+(\d+) hour\(s\), (\d+) minute\(s\) and (\d+) second\(s\)")
+
+
+def calc_work(n_samples, n_covariates, n_permutations):
+    return float(n_samples) * n_covariates * (n_permutations + 1)
+
+
+def parse_log(fpath, n_covariates):
+    """
+    Method for reading the per-eQTL timing of a CIA log file. The file may
+    hold multiple runs (the job logs are appended to).
+
+    :param fpath: string, the log file.
+    :param n_covariates: int, the number of covariates (not in the log).
+    :return observations: list, (eqtl index, seconds, work, cores) tuples.
+    :return overheads: list, the time of every complete run that is not
+                       spent on eQTLs (loading, saving), in seconds.
+    """
+    observations = []
+    overheads = []
+    arguments = {}
+    current = None
+    run_seconds = 0
+    with open(fpath, "r") as f:
+        for line in f:
+            match = ARGUMENT_PATTERN.match(line)
+            if match is not None:
+                if match.group(1) == "Skip rows":
+                    arguments = {}
+                    run_seconds = 0
+                arguments[match.group(1)] = int(match.group(2))
+                continue
+
+            match = PROCESSING_PATTERN.match(line)
+            if match is not None:
+                current = arguments.get("Skip rows", 0) + int(match.group(1)) - 1
+                continue
+
+            match = EQTL_TIME_PATTERN.match(line)
+            if match is not None and current is not None and \
+                    "Samples" in arguments and "Permutations" in arguments:
+                seconds = float(match.group(1))
+                cores = arguments.get("Cores", 1)
+                observations.append((current,
+                                     seconds,
+                                     calc_work(arguments["Samples"],
+                                               n_covariates,
+                                               arguments["Permutations"]),
+                                     cores))
+                run_seconds += seconds / cores
+                current = None
+                continue
+
+            match = TOTAL_TIME_PATTERN.match(line)
+            if match is not None:
+                hours, minutes, seconds = [int(x) for x in match.groups()]
+                total = hours * 3600 + minutes * 60 + seconds
+                overheads.append(max(0, total - run_seconds))
+                run_seconds = 0
+    f.close()
+
+    return observations, overheads
+
+
+def load_shard_timing(shard_dir):
+    """
+    Method for reading the per-eQTL timing that is stored in the shards.
+
+    :param shard_dir: string, the shard directory.
+    :return : list, (eqtl index, seconds, work, cores) tuples.
+    """
+    observations = []
+    for name in sorted(os.listdir(shard_dir)):
+        path = os.path.join(shard_dir, name)
+        header_path = os.path.join(path, "header.json")
+        times_path = os.path.join(path, "run_times.npy")
+        if not os.path.isfile(header_path) or not os.path.isfile(times_path):
+            continue
+
+        with open(header_path, "r") as f:
+            header = json.load(f)
+        f.close()
+        info = header.get("info")
+        if info is None:
+            continue
+
+        work = calc_work(info["n_samples"], len(header["covariates"]),
+                         info["n_permutations"])
+        eqtl_indices = np.load(os.path.join(path, "eqtl_indices.npy"))
+        run_times = np.load(times_path)
+        for eqtl_index, seconds in zip(eqtl_indices, run_times):
+            if not np.isnan(seconds):
+                observations.append((int(eqtl_index), float(seconds), work,
+                                     info["cores"]))
+
+    return observations
+
+
+class CostModel:
+    def __init__(self, observations, overheads=None):
+        """
+        :param observations: list, (eqtl index, seconds, work, cores)
+                             tuples; of an eQTL that is timed multiple
+                             times the last observation is used.
+        :param overheads: list, the per-run overhead in seconds.
+        """
+        latest = {}
+        for eqtl_index, seconds, work, cores in observations:
+            latest[eqtl_index] = (seconds, work)
+        self.eqtl_indices = np.array(sorted(latest.keys()), dtype=np.int64)
+        self.seconds = np.array([latest[i][0] for i in self.eqtl_indices], dtype=np.float64)
+        self.work = np.array([latest[i][1] for i in self.eqtl_indices], dtype=np.float64)
+
+        self.overhead = None
+        if overheads is not None and len(overheads) > 0:
+            self.overhead = float(np.median(overheads))
+
+        self.intercept, self.slope = self.fit(self.seconds, self.work)
+
+    @staticmethod
+    def fit(seconds, work):
+        if len(seconds) == 0:
+            raise ValueError("No timing observations")
+
+        # With a single work size the intercept and slope cannot be
+        # separated, the time is then assumed proportional to the work.
+        if np.unique(work).size < 2:
+            return 0.0, float(np.median(seconds / work))
+
+        design = np.column_stack((np.ones_like(work), work))
+        (intercept, slope), _, _, _ = np.linalg.lstsq(design, seconds, rcond=None)
+        if slope <= 0:
+            return 0.0, float(np.median(seconds / work))
+        return max(0.0, float(intercept)), float(slope)
+
+    def get_n_observations(self):
+        return len(self.eqtl_indices)
+
+    def get_overhead(self):
+        return self.overhead
+
+    def get_parameters(self):
+        return self.intercept, self.slope
+
+    def predict(self, eqtl_indices, work):
+        """
+        Method for predicting the time of eQTLs.
+
+        :param eqtl_indices: ndarray, the eQTL indices.
+        :param work: float, the work of one eQTL in the new run.
+        :return : ndarray, the predicted seconds per eQTL (single core).
+        """
+        eqtl_indices = np.asarray(eqtl_indices, dtype=np.int64)
+        predictions = np.full(len(eqtl_indices),
+                              self.intercept + self.slope * work)
+
+        # Scale the eQTLs that were timed before by their observed cost
+        # relative to the model.
+        positions = np.searchsorted(self.eqtl_indices, eqtl_indices)
+        positions = np.minimum(positions, max(len(self.eqtl_indices) - 1, 0))
+        observed = self.eqtl_indices[positions] == eqtl_indices
+        expected = self.intercept + self.slope * self.work[positions[observed]]
+        predictions[observed] *= self.seconds[positions[observed]] / expected
+
+        return predictions
+
+
+def create_batches(costs, target):
+    """
+    Method for splitting consecutive eQTLs into batches with a cost of at
+    most target each (at least one eQTL per batch).
+
+    :param costs: ndarray, the cost of every eQTL.
+    :param target: float, the maximum cost of a batch.
+    :return : list, (start position, n eQTLs, cost) tuples.
+    """
+    batches = []
+    start = 0
+    total = 0.0
+    for position, cost in enumerate(costs):
+        if position > start and total + cost > target:
+            batches.append((start, position - start, total))
+            start = position
+            total = 0.0
+        total += cost
+    if len(costs) > start:
+        batches.append((start, len(costs) - start, total))
+
+    return batches
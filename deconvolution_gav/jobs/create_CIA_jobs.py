@@ -3,7 +3,7 @@
 """
 File:         create_CIA_jobs.py
 Created:      2020/10/16
-Last Changed: 2020/10/27
+Last Changed: 2020/10/30
 Author:       M.Vochteloo
 
 Copyright (C) 2020 M.Vochteloo
@@ -26,11 +26,15 @@ root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
 from __future__ import print_function
 from pathlib import Path
 import argparse
+import math
 import os
 
 # Third party imports.
+import numpy as np
 
 # Local application imports.
+from cost_model import CostModel, parse_log, load_shard_timing, calc_work, \
+    create_batches
 
 # Metadata
 __program__ = "Create CIA jobs"
@@ -46,6 +50,17 @@ __description__ = "{} is a program developed and maintained by {}. " \
                                         __author__,
                                         __license__)
 
+"""
+Syntax:
+./create_CIA_jobs.py -j CIA -i cortex_eur_cis -s default_settings -l 18000 -b 50 -ns 2932
+./create_CIA_jobs.py -j CIA -i cortex_eur_cis -s default_settings -l 18000 -ns 2932 -nc 10 -np 100 -tl CIA_TEST/output -sd ../custom_interaction_analyser/cortex_eur_cis/shards -tr 5
+"""
+
+# The walltime of every time tier in seconds.
+TIME_TIERS = {"short": 6 * 3600 - 60,
+              "medium": 24 * 3600 - 60,
+              "long": 7 * 24 * 3600 - 11 * 60}
+
 
 class main():
     def __init__(self):
@@ -60,8 +75,14 @@ class main():
         self.stop_index = getattr(arguments, 'last')
         self.batch_size = getattr(arguments, 'batch')
         self.n_samples = getattr(arguments, 'n_samples')
-        self.cores = 1
+        self.cores = getattr(arguments, 'cores')
         self.mem = getattr(arguments, 'mem')
+        self.n_covariates = getattr(arguments, 'n_covariates')
+        self.n_permutations = getattr(arguments, 'n_permutations')
+        self.timing_logs = getattr(arguments, 'timing_logs')
+        self.shard_dirs = getattr(arguments, 'shard_dirs')
+        self.target = getattr(arguments, 'target')
+        self.margin = getattr(arguments, 'margin')
 
         if self.output_folder is None:
             self.output_folder = self.input_folder
@@ -70,13 +91,8 @@ class main():
         self.outdir = os.path.join(Path(__file__).parent.absolute(), self.job)
         self.log_file_outdir = os.path.join(self.outdir, 'output')
         time = getattr(arguments, 'time').lower()
-        self.time = None
-        if time == "short":
-            self.time = "05:59:00"
-        elif time == "medium":
-            self.time = "23:59:00"
-        elif time == "long":
-            self.time = "6-23:49:00"
+        self.max_seconds = TIME_TIERS[time]
+        self.time = self.format_time(self.max_seconds)
 
         for outdir in [self.outdir, self.log_file_outdir]:
             if not os.path.exists(outdir):
@@ -159,11 +175,54 @@ class main():
                             default=None,
                             help="The name of node to exclude,"
                                  "default: None.")
-
+        parser.add_argument("-nc",
+                            "--n_covariates",
+                            type=int,
+                            default=None,
+                            help="The number of covariates, needed for the "
+                                 "runtime model. Default: None.")
+        parser.add_argument("-np",
+                            "--n_permutations",
+                            type=int,
+                            default=0,
+                            help="The number of permutations, used by the "
+                                 "runtime model. Default: 0.")
+        parser.add_argument("-tl",
+                            "--timing_logs",
+                            nargs="+",
+                            type=str,
+                            default=[],
+                            help="CIA log files (or directories with log "
+                                 "files) to fit the runtime model on. "
+                                 "Default: [].")
+        parser.add_argument("-sd",
+                            "--shard_dirs",
+                            nargs="+",
+                            type=str,
+                            default=[],
+                            help="CIA shard directories to fit the runtime "
+                                 "model on. Default: [].")
+        parser.add_argument("-tr",
+                            "--target",
+                            type=float,
+                            default=None,
+                            help="The target runtime per job in hours when "
+                                 "using the runtime model. Default: 80%% of "
+                                 "the -t / --time walltime.")
+        parser.add_argument("-ma",
+                            "--margin",
+                            type=float,
+                            default=1.25,
+                            help="The walltime safety factor on top of the "
+                                 "predicted runtime. Default: 1.25.")
 
         return parser.parse_args()
 
     def start(self):
+        if len(self.timing_logs) > 0 or len(self.shard_dirs) > 0:
+            self.start_cost_model()
+            return
+
         start_indices = [i for i in range(self.start_index, self.stop_index, self.batch_size)]
         for job_id, start_index in enumerate(start_indices):
             batch_size = self.batch_size
@@ -171,7 +230,89 @@ class main():
                 batch_size = self.stop_index - start_index
             self.write_job_file(job_id, start_index, batch_size)
 
-    def write_job_file(self, job_id, start_index, batch_size):
+    def start_cost_model(self):
+        if self.n_covariates is None:
+            print("The runtime model requires -nc / --n_covariates.")
+            exit()
+
+        print("Loading timing data.")
+        observations = []
+        overheads = []
+        for fpath in self.list_log_files(self.timing_logs):
+            log_observations, log_overheads = parse_log(fpath, self.n_covariates)
+            observations.extend(log_observations)
+            overheads.extend(log_overheads)
+        for shard_dir in self.shard_dirs:
+            observations.extend(load_shard_timing(shard_dir))
+
+        model = CostModel(observations, overheads)
+        intercept, slope = model.get_parameters()
+        overhead = model.get_overhead()
+        if overhead is None:
+            overhead = 60
+        print("\tFitted on {} eQTL(s): {:.4f} + {:.4e} * work second(s), "
+              "overhead {:.0f} second(s)".format(model.get_n_observations(),
+                                                 intercept,
+                                                 slope,
+                                                 overhead))
+
+        target = self.max_seconds * 0.8
+        if self.target is not None:
+            target = self.target * 3600
+        budget = target / self.margin - overhead
+        if budget <= 0:
+            print("The target runtime is too short for the overhead.")
+            exit()
+
+        eqtl_indices = np.arange(self.start_index, self.stop_index)
+        work = calc_work(self.n_samples, self.n_covariates, self.n_permutations)
+        costs = model.predict(eqtl_indices, work) / self.cores
+        batches = create_batches(costs, budget)
+
+        print("Writing {} job(s).".format(len(batches)))
+        runtimes = []
+        for job_id, (position, batch_size, cost) in enumerate(batches):
+            runtime = cost + overhead
+            walltime = min(self.max_seconds,
+                           int(math.ceil(runtime * self.margin / 60)) * 60)
+            if runtime > self.max_seconds:
+                print("\tWARNING: job {} is predicted to take longer than "
+                      "the walltime".format(job_id))
+            self.write_job_file(job_id, int(eqtl_indices[position]),
+                                batch_size, self.format_time(walltime))
+            runtimes.append(runtime)
+        print("\tBatch sizes: {}-{} eQTL(s)".format(min(x[1] for x in batches),
+                                                  max(x[1] for x in batches)))
+        print("\tPredicted runtimes: {:.0f}-{:.0f} second(s)".format(min(runtimes),
+                                                                    max(runtimes)))
+
+    @staticmethod
+    def list_log_files(paths):
+        fpaths = []
+        for path in paths:
+            if os.path.isdir(path):
+                fpaths.extend(sorted(os.path.join(path, fname)
+                                     for fname in os.listdir(path)
+                                     if fname.endswith(".out") or
+                                     fname.endswith(".log")))
+            else:
+                fpaths.append(path)
+        return fpaths
+
+    @staticmethod
+    def format_time(seconds):
+        days, seconds = divmod(int(seconds), 24 * 3600)
+        hours, seconds = divmod(seconds, 3600)
+        minutes, seconds = divmod(seconds, 60)
+        time = "{:02d}:{:02d}:{:02d}".format(hours, minutes, seconds)
+        if days > 0:
+            time = "{}-{}".format(days, time)
+        return time
+
+    def write_job_file(self, job_id, start_index, batch_size, time=None):
+        if time is None:
+            time = self.time
+
         skip_rows = ""
         if start_index > 0:
             skip_rows = " -sr {}".format(start_index)
@@ -188,7 +329,7 @@ class main():
                  "#SBATCH --job-name={}\n".format(job_name),
                  "#SBATCH --output={}\n".format(out_filepath),
                  "#SBATCH --error={}\n".format(out_filepath),
-                 "#SBATCH --time={}\n".format(self.time),
+                 "#SBATCH --time={}\n".format(time),
                  "#SBATCH --cpus-per-task={}\n".format(self.cores),
                  "#SBATCH --mem={}gb\n".format(self.mem),
                  "#SBATCH --nodes=1\n",
@@ -200,7 +341,7 @@ class main():
                  "module load Python/3.6.3-foss-2015b\n",
                  "source $HOME/venv/bin/activate\n",
                  "\n",
-                 "python3 /groups/umcg-biogen/tmp03/output/2019-11-06-FreezeTwoDotOne/2020-10-12-deconvolution_gav/custom_interaction_analyser.py -i {} -o {} -s {}{} -ne {} -ns {}\n".format(self.input_folder, self.output_folder, self.settings, skip_rows, batch_size, self.n_samples),
+                 "python3 /groups/umcg-biogen/tmp03/output/2019-11-06-FreezeTwoDotOne/2020-10-12-deconvolution_gav/custom_interaction_analyser.py -i {} -o {} -s {}{} -ne {} -ns {} -c {}\n".format(self.input_folder, self.output_folder, self.settings, skip_rows, batch_size, self.n_samples, self.cores),
                  "\n",
                  "deactivate\n"]
 
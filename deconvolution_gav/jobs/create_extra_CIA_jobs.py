@@ -3,7 +3,7 @@
 """
 File:         create_extra_CIA_jobs.py
 Created:      2020/10/25
-Last Changed: 2020/10/27
+Last Changed: 2020/10/30
 Author:       M.Vochteloo
 
 Copyright (C) 2020 M.Vochteloo
@@ -26,6 +26,7 @@ root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
 from __future__ import print_function
 from pathlib import Path
 import argparse
+import json
 import os
 
 # Third party imports.
@@ -46,6 +47,12 @@ __description__ = "{} is a program developed and maintained by {}. " \
                                         __author__,
                                         __license__)
 
+"""
+Syntax:
+./create_extra_CIA_jobs.py -j CIA -i cortex_eur_cis -s default_settings -ns 2932 -r ../custom_interaction_analyser/cortex_eur_cis/coverage_report.json -l 18000 -g 5
+./create_extra_CIA_jobs.py -j CIA -i cortex_eur_cis -s default_settings -ns 2932 -mi 535 2678-2679
+"""
+
 
 class main():
     def __init__(self):
@@ -60,9 +67,15 @@ class main():
         self.n_samples = getattr(arguments, 'n_samples')
         self.cores = 1
         self.mem = getattr(arguments, 'mem')
+        self.report_path = getattr(arguments, 'report')
+        self.missing = getattr(arguments, 'missing')
+        self.first = getattr(arguments, 'first')
+        self.last = getattr(arguments, 'last')
+        self.gap = getattr(arguments, 'gap')
 
-        # Hard coded.
-        self.missing = ['535', '1727', '1759', '1799', '2279', '2287', '2295', '2303', '2311', '2319', '2327', '2335', '2343', '2351', '2359', '2495', '2519', '2535', '2678-2679', '2703', '2743', '2775', '2799', '2815', '2831', '2839', '2847', '2918-2919']
+        if self.report_path is None and self.missing is None:
+            print("Provide a coverage report (-r) or missing ranges (-mi).")
+            exit()
 
         # Set the variables.
         self.outdir = os.path.join(Path(__file__).parent.absolute(), self.job + "_E")
@@ -114,6 +127,42 @@ class main():
                             required=True,
                             help="The settings input file (without '.json'), "
                                  "default: 'default_settings'.")
+        parser.add_argument("-r",
+                            "--report",
+                            type=str,
+                            default=None,
+                            help="The coverage report of the combiner "
+                                 "(coverage_report.json). Default: None.")
+        parser.add_argument("-mi",
+                            "--missing",
+                            nargs="+",
+                            type=str,
+                            default=None,
+                            help="The missing eQTL ranges, e.g. 535 "
+                                 "2678-2679 (inclusive). Default: None.")
+        parser.add_argument("-f",
+                            "--first",
+                            type=int,
+                            default=None,
+                            help="The eQTL index of the first one that "
+                                 "should be analysed, to resubmit the eQTLs "
+                                 "before the first present one. "
+                                 "Default: None.")
+        parser.add_argument("-l",
+                            "--last",
+                            type=int,
+                            default=None,
+                            help="The eQTL index after the last one that "
+                                 "should be analysed (as in "
+                                 "create_CIA_jobs.py), to resubmit the eQTLs "
+                                 "after the last present one. Default: None.")
+        parser.add_argument("-g",
+                            "--gap",
+                            type=int,
+                            default=0,
+                            help="Merge missing ranges that are at most this "
+                                 "number of eQTLs apart into one job. "
+                                 "Default: 0.")
         parser.add_argument("-b",
                             "--batch",
                             type=int,
@@ -159,9 +208,15 @@ class main():
             job_id_count += 1
 
     def create_jobs_info(self):
-        jobs_info = []
-        for missing in self.missing:
-            split_missing = missing.split("-")
+        missing = []
+        if self.missing is not None:
+            missing.extend(self.missing)
+        if self.report_path is not None:
+            missing.extend(self.load_report())
+
+        ranges = []
+        for missing_range in missing:
+            split_missing = missing_range.split("-")
 
             start_index = int(split_missing[0])
             if len(split_missing) == 1:
@@ -172,6 +227,18 @@ class main():
                 print("unexpected input")
                 continue
 
+            ranges.append((start_index, stop_index))
+
+        # Merge the ranges that overlap or lie close together.
+        merged = []
+        for start_index, stop_index in sorted(ranges):
+            if len(merged) > 0 and start_index - merged[-1][1] <= self.gap:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], stop_index))
+            else:
+                merged.append((start_index, stop_index))
+
+        jobs_info = []
+        for start_index, stop_index in merged:
             batch_size = stop_index - start_index
 
             if batch_size > self.batch_size:
@@ -189,6 +256,29 @@ class main():
 
         return jobs_info
 
+    def load_report(self):
+        with open(self.report_path, "r") as f:
+            report = json.load(f)
+        f.close()
+
+        missing = list(report["missing"])
+        if report["first"] is None:
+            if self.first is not None and self.last is not None and \
+                    self.last > self.first:
+                missing.append("{}-{}".format(self.first, self.last - 1))
+            return missing
+
+        if self.first is not None and self.first < report["first"]:
+            missing.append("{}-{}".format(self.first, report["first"] - 1))
+        if self.last is not None and self.last > report["last"] + 1:
+            missing.append("{}-{}".format(report["last"] + 1, self.last - 1))
+        print("Coverage report: {} present, {} missing, {} duplicated "
+              "eQTL(s)".format(report["n_present"],
+                               report["n_missing"],
+                               report["n_duplicated"]))
+
+        return missing
+
     def write_job_file(self, job_id, start_index, batch_size):
         skip_rows = ""
         if start_index > 0:
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+"""
+File:         lookup_results.py
+Created:      2020/10/30
+Last Changed:
+Author:       M.Vochteloo
+
+Copyright (C) 2020 M.Vochteloo
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+A copy of the GNU General Public License can be found in the LICENSE file in the
+root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Standard imports.
+from __future__ import print_function
+import argparse
+import time
+
+# Third party imports.
+import pandas as pd
+
+# Local application imports.
+from results_index import ResultsIndex, build_results_index, KEY_TYPES
+from utilities import save_dataframe
+
+# Metadata
+__program__ = "Lookup Results"
+__author__ = "Martijn Vochteloo"
+__maintainer__ = "Martijn Vochteloo"
+__email__ = "m.vochteloo@rug.nl"
+__license__ = "GPLv3"
+__version__ = 1.0
+__description__ = "{} is a program developed and maintained by {}. " \
+                  "This program is licensed under the {} license and is " \
+                  "provided 'as-is' without any warranty or indemnification " \
+                  "of any kind.".format(__program__,
+                                        __author__,
+                                        __license__)
+
+"""
+Syntax:
+./lookup_results.py -i /path/to/results_store -build -eq /path/to/eQTLprobes_combined.txt.gz
+./lookup_results.py -i /path/to/results_store -k CYP24A1 CLECL1
+./lookup_results.py -i /path/to/results_store -k rs123 -t SNPName -c covariate zscore perm-FDR -o rs123.txt.gz
+"""
+
+
+class main():
+    def __init__(self):
+        # Get the command line arguments.
+        arguments = self.create_argument_parser()
+        self.indir = getattr(arguments, 'input')
+        self.build = getattr(arguments, 'build')
+        self.eqtl_path = getattr(arguments, 'eqtl')
+        self.keys = getattr(arguments, 'keys')
+        self.key_type = getattr(arguments, 'key_type')
+        self.columns = getattr(arguments, 'columns')
+        self.outpath = getattr(arguments, 'output')
+
+    @staticmethod
+    def create_argument_parser():
+        parser = argparse.ArgumentParser(prog=__program__,
+                                         description=__description__)
+
+        # Add optional arguments.
+        parser.add_argument("-v",
+                            "--version",
+                            action="version",
+                            version="{} {}".format(__program__,
+                                                   __version__),
+                            help="show program's version number and exit")
+        parser.add_argument("-i",
+                            "--input",
+                            type=str,
+                            required=True,
+                            help="The path of the results store.")
+        parser.add_argument("-build",
+                            action='store_true',
+                            help="(Re)build the lookup index. "
+                                 "Default: False.")
+        parser.add_argument("-eq",
+                            "--eqtl",
+                            type=str,
+                            default=None,
+                            help="The eQTL file to build the index from, "
+                                 "needed for HGNCName lookups. "
+                                 "Default: None.")
+        parser.add_argument("-k",
+                            "--keys",
+                            nargs="+",
+                            type=str,
+                            default=[],
+                            help="The SNPNames, ProbeNames and / or "
+                                 "HGNCNames to look up. Default: [].")
+        parser.add_argument("-t",
+                            "--key_type",
+                            type=str,
+                            choices=KEY_TYPES,
+                            default=None,
+                            help="The type of the keys. Default: all.")
+        parser.add_argument("-c",
+                            "--columns",
+                            nargs="+",
+                            type=str,
+                            default=None,
+                            help="The columns to return. Default: all.")
+        parser.add_argument("-o",
+                            "--output",
+                            type=str,
+                            default=None,
+                            help="The output path. Default: print the "
+                                 "results.")
+
+        return parser.parse_args()
+
+    def start(self):
+        self.print_arguments()
+
+        if self.build:
+            start_time = time.time()
+            index_dir = build_results_index(self.indir, self.eqtl_path)
+            print("Built {} in {:.2f} second(s)".format(index_dir,
+                                                       time.time() - start_time),
+                  flush=True)
+
+        if len(self.keys) == 0:
+            return
+
+        start_time = time.time()
+        index = ResultsIndex(self.indir)
+        df = index.lookup(self.keys, key_type=self.key_type,
+                          columns=self.columns)
+        print("Found {} row(s) in {:.1f} millisecond(s)".format(df.shape[0],
+                                                              (time.time() - start_time) * 1000),
+              flush=True)
+
+        if self.outpath is not None:
+            save_dataframe(df=df, outpath=self.outpath, header=True,
+                           index=False)
+        else:
+            with pd.option_context("display.max_rows", None,
+                                   "display.max_columns", None,
+                                   "display.width", None):
+                print(df.to_string(index=False))
+
+    def print_arguments(self):
+        print("Arguments:")
+        print("  > Input: {}".format(self.indir))
+        print("  > Build: {}".format(self.build))
+        print("  > eQTL path: {}".format(self.eqtl_path))
+        print("  > Keys: {}".format(self.keys))
+        print("  > Key type: {}".format(self.key_type))
+        print("  > Columns: {}".format(self.columns))
+        print("  > Output: {}".format(self.outpath))
+        print("")
+
+
+if __name__ == '__main__':
+    m = main()
+    m.start()
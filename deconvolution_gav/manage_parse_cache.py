@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+"""
+File:         manage_parse_cache.py
+Created:      2020/10/30
+Last Changed:
+Author:       M.Vochteloo
+
+Copyright (C) 2020 M.Vochteloo
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+A copy of the GNU General Public License can be found in the LICENSE file in the
+root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Standard imports.
+from __future__ import print_function
+from datetime import datetime
+import argparse
+import os
+
+# Third party imports.
+
+# Local application imports.
+from parse_cache import ParseCache, get_parse_cache, CACHE_ENV, \
+    DEFAULT_CACHE_DIR
+
+# Metadata
+__program__ = "Manage Parse Cache"
+__author__ = "Martijn Vochteloo"
+__maintainer__ = "Martijn Vochteloo"
+__email__ = "m.vochteloo@rug.nl"
+__license__ = "GPLv3"
+__version__ = 1.0
+__description__ = "{} is a program developed and maintained by {}. " \
+                  "This program is licensed under the {} license and is " \
+                  "provided 'as-is' without any warranty or indemnification " \
+                  "of any kind.".format(__program__,
+                                        __author__,
+                                        __license__)
+
+"""
+Syntax:
+./manage_parse_cache.py -list
+./manage_parse_cache.py -d /path/to/cache -shrink 5
+./manage_parse_cache.py -clear
+"""
+
+
+class main():
+    def __init__(self):
+        # Get the command line arguments.
+        arguments = self.create_argument_parser()
+        self.cache_dir = getattr(arguments, 'cache_dir')
+        self.list = getattr(arguments, 'list')
+        self.shrink = getattr(arguments, 'shrink')
+        self.clear = getattr(arguments, 'clear')
+
+    @staticmethod
+    def create_argument_parser():
+        parser = argparse.ArgumentParser(prog=__program__,
+                                         description=__description__)
+
+        # Add optional arguments.
+        parser.add_argument("-v",
+                            "--version",
+                            action="version",
+                            version="{} {}".format(__program__,
+                                                   __version__),
+                            help="show program's version number and exit")
+        parser.add_argument("-d",
+                            "--cache_dir",
+                            type=str,
+                            default=None,
+                            help="The cache directory. Default: the "
+                                 "directory in ${} or {}.".format(CACHE_ENV,
+                                                                  DEFAULT_CACHE_DIR))
+        parser.add_argument("-list",
+                            action='store_true',
+                            help="List the cache entries, most recently used "
+                                 "first. Default: False.")
+        parser.add_argument("-shrink",
+                            type=float,
+                            default=None,
+                            help="Remove the least recently used entries "
+                                 "until the cache is at most this many GB. "
+                                 "Default: None.")
+        parser.add_argument("-clear",
+                            action='store_true',
+                            help="Remove all cache entries. Default: False.")
+
+        return parser.parse_args()
+
+    def get_cache(self):
+        if self.cache_dir is not None:
+            return ParseCache(os.path.expanduser(self.cache_dir))
+
+        cache = get_parse_cache()
+        if cache is None:
+            cache = ParseCache(os.path.expanduser(DEFAULT_CACHE_DIR))
+        return cache
+
+    def start(self):
+        self.print_arguments()
+        cache = self.get_cache()
+        print("Cache directory: {}".format(cache.cache_dir))
+
+        if self.clear:
+            n_removed = cache.clear()
+            print("Removed {} entries".format(n_removed))
+        elif self.shrink is not None:
+            n_removed = cache.evict(max_size=int(self.shrink * 1024 ** 3))
+            print("Removed {} entries".format(n_removed))
+
+        entries = cache.list_entries()
+        if self.list:
+            for entry in entries:
+                print("  {}  {:>10.2f} MB  {:<6}  {:>15}  last used: {}  "
+                      "{}".format(entry["key"][:12],
+                                  entry["size"] / 1024 ** 2,
+                                  entry["format"],
+                                  "x".join([str(x) for x in entry["shape"]]),
+                                  datetime.fromtimestamp(entry["last_used"]).strftime("%d-%m-%Y, %H:%M:%S"),
+                                  entry["path"]))
+        print("{} entries, {:.2f} GB".format(len(entries),
+                                             sum(entry["size"] for entry in entries) / 1024 ** 3))
+
+    def print_arguments(self):
+        print("Arguments:")
+        print("  > Cache directory: {}".format(self.cache_dir))
+        print("  > List: {}".format(self.list))
+        print("  > Shrink: {}".format(self.shrink))
+        print("  > Clear: {}".format(self.clear))
+        print("")
+
+
+if __name__ == '__main__':
+    m = main()
+    m.start()
@@ -1,7 +1,7 @@
 """
 File:         correct_cohort_effects.py
 Created:      2020/10/08
-Last Changed: 2020/10/19
+Last Changed: 2020/10/30
 Author:       M.Vochteloo
 
 Copyright (C) 2020 M.Vochteloo
@@ -89,6 +89,8 @@ class CorrectCohortEffects:
                                                  (100 / (expression_df.shape[0] - 1)) * i))
 
             if expression.index.equals(cohorts.index):
+                # Fit in float64, the expression may be stored as float32.
+                expression = expression.astype(np.float64)
                 ols = sm.OLS(expression, cohorts)
                 try:
                     ols_result = ols.fit()
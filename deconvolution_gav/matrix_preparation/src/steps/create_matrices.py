@@ -1,7 +1,7 @@
 """
 File:         create_matrices.py
 Created:      2020/10/08
-Last Changed: 2020/10/13
+Last Changed: 2020/10/30
 Author:       M.Vochteloo
 
 Copyright (C) 2020 M.Vochteloo
@@ -20,7 +20,6 @@ root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
 """
 
 # Standard imports.
-import gzip
 import os
 
 # Third party imports.
@@ -29,6 +28,7 @@ import pandas as pd
 
 # Local application imports.
 from utilities import prepare_output_dir, check_file_exists, load_dataframe, save_dataframe, construct_dict_from_df
+from bgzf import open_lines
 
 
 class CreateMatrices:
@@ -146,7 +146,7 @@ class CreateMatrices:
         indices = []
         alleles_columns = []
         genotype_columns = []
-        with gzip.open(self.geno_file, 'rb') as f:
+        with open_lines(self.geno_file) as f:
             for i, line in enumerate(f):
                 if (i == 0) or (i % self.print_interval == 0):
                     self.log.info("\tprocessed {} lines\tfound {}/{} genotype lines.".format(i, len(indices), len(interest)))
@@ -199,7 +199,7 @@ class CreateMatrices:
         expression_indices = []
         sign_expr_data_collection = []
         sign_expr_indices = []
-        with gzip.open(filepath, 'rb') as f:
+        with open_lines(filepath) as f:
             for i, line in enumerate(f):
                 if (i == 0) or (i % self.print_interval == 0):
                     process_str = "\tprocessed {} lines".format(i)
@@ -106,8 +106,9 @@ class PerformDeconvolution:
         self.log.info("Performing partial deconvolution.")
         decon_data = []
         residuals_data = []
+        sign_m = sign_df.values.astype(np.float64)
         for _, sample in expr_df.T.iterrows():
-            proportions, rnorm = self.nnls(sign_df, sample)
+            proportions, rnorm = self.nnls(sign_m, sample)
             decon_data.append(proportions)
             residuals_data.append(rnorm)
 
@@ -163,7 +164,9 @@ class PerformDeconvolution:
 
     @staticmethod
     def nnls(A, b):
-        return nnls(A, b)
+        # The NNLS solver works in float64, upcast float32 input here.
+        return nnls(np.asarray(A, dtype=np.float64),
+                    np.asarray(b, dtype=np.float64))
 
     @staticmethod
     def sum_to_one(X):
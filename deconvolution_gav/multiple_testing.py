@@ -0,0 +1,215 @@
+"""
+File:         multiple_testing.py
+Created:      2020/10/30
+Last Changed:
+Author:       M.Vochteloo
+
+Copyright (C) 2020 M.Vochteloo
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+A copy of the GNU General Public License can be found in the LICENSE file in the
+root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Standard imports.
+
+# Third party imports.
+import numpy as np
+from scipy import stats
+
+# Local application imports.
+
+# The lower and upper limit of stats.norm.isf:
+# stats.norm.isf((1 - 1e-16)) = -8.209536151601387
+# stats.norm.isf(1e-323) = 38.44939448087599
+MIN_PVALUE = 1e-323
+MAX_PVALUE = 1.0 - 1e-16
+
+
+def calc_zscores(pvalues):
+    """
+    Method for converting p-values to z-scores. The p-values are clamped to
+    [MIN_PVALUE, MAX_PVALUE] first; NaN stays NaN.
+
+    :param pvalues: array-like, the p-values.
+    :return : ndarray, the z-scores.
+    """
+    pvalues = np.asarray(pvalues, dtype=np.float64)
+    return stats.norm.isf(np.clip(pvalues, MIN_PVALUE, MAX_PVALUE))
+
+
+def calc_bh_fdr(pvalues):
+    """
+    Method for calculating the Benjamini-Hochberg FDR.
+
+    FDR = p-value * (# p-values / rank), made monotone by taking the
+    cumulative minimum from the largest p-value downwards and capped at 1.
+    NaN p-values are ignored and get a NaN FDR.
+
+    :param pvalues: array-like, the p-values (any shape).
+    :return : ndarray, the FDR values (same shape).
+    """
+    pvalues = np.asarray(pvalues, dtype=np.float64)
+    fdr = np.full(pvalues.shape, np.nan)
+    mask = ~np.isnan(pvalues)
+    n = np.count_nonzero(mask)
+    if n == 0:
+        return fdr
+
+    present = pvalues[mask]
+    order = np.argsort(present, kind="mergesort")
+    ranked = present[order] * (n / np.arange(1, n + 1))
+    ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+    present_fdr = np.empty(n)
+    present_fdr[order] = np.minimum(ranked, 1)
+    fdr[mask] = present_fdr
+
+    return fdr
+
+
+def count_less_equal(sorted_values, values):
+    """
+    Method for counting the number of sorted values <= every value.
+
+    :param sorted_values: ndarray, sorted values without NaN.
+    :param values: array-like, the thresholds.
+    :return : ndarray, the counts.
+    """
+    return np.searchsorted(sorted_values, values, side="right")
+
+
+def calc_perm_fdr(pvalues, perm_pvalues, n_perm=None, perm_weights=None,
+                  perm_sorted=False):
+    """
+    Method for calculating the permutation FDR.
+
+    FDR = (# permuted p-values <= p-value / n_perm) / # p-values <= p-value
+
+    capped at 1. Instead of dividing by n_perm every permuted p-value can
+    be given a weight (e.g. 1 / the number of permutations of its test).
+    NaN p-values are ignored and get a NaN FDR.
+
+    :param pvalues: array-like, the real p-values (any shape).
+    :param perm_pvalues: array-like, the permuted p-values.
+    :param n_perm: int, the number of permutations per test.
+    :param perm_weights: array-like, the weight of every permuted p-value.
+    :param perm_sorted: boolean, whether perm_pvalues are already sorted
+                        and free of NaN.
+    :return : ndarray, the FDR values (same shape as pvalues).
+    """
+    pvalues = np.asarray(pvalues, dtype=np.float64)
+    perm_pvalues = np.asarray(perm_pvalues, dtype=np.float64)
+    if perm_weights is not None:
+        perm_weights = np.asarray(perm_weights, dtype=np.float64)
+    if not perm_sorted:
+        mask = ~np.isnan(perm_pvalues)
+        perm_pvalues = perm_pvalues[mask]
+        order = np.argsort(perm_pvalues, kind="mergesort")
+        perm_pvalues = perm_pvalues[order]
+        if perm_weights is not None:
+            perm_weights = perm_weights[mask][order]
+
+    fdr = np.full(pvalues.shape, np.nan)
+    mask = ~np.isnan(pvalues)
+    present = pvalues[mask]
+    n_signif = count_less_equal(np.sort(present), present)
+    perm_counts = count_less_equal(perm_pvalues, present)
+    if perm_weights is None:
+        expected = perm_counts / n_perm
+    else:
+        expected = np.concatenate(([0], np.cumsum(perm_weights)))[perm_counts]
+    fdr[mask] = np.minimum(expected / n_signif, 1)
+
+    return fdr
+
+
+class PermutationCounter:
+    """
+    Out-of-core alternative of calc_perm_fdr. The permuted p-values are
+    added chunk by chunk and only binned by the position they would get in
+    the sorted real p-values, so the memory use is linear in the number of
+    real p-values instead of the number of permuted p-values. The resulting
+    FDR is exact: equal to calc_perm_fdr on all permuted p-values at once
+    (up to the order of the floating point summation of the weights).
+    """
+
+    def __init__(self, pvalues):
+        """
+        :param pvalues: array-like, the real p-values (any shape).
+        """
+        self.pvalues = np.asarray(pvalues, dtype=np.float64)
+        self.mask = ~np.isnan(self.pvalues)
+        self.sorted_pvalues = np.sort(self.pvalues[self.mask])
+        n = len(self.sorted_pvalues)
+        self.counts = np.zeros(n + 1, dtype=np.int64)
+        self.weights = np.zeros(n + 1, dtype=np.float64)
+        self.n_perm_pvalues = 0
+
+    def add(self, perm_pvalues, perm_weights=None):
+        """
+        Method for adding a chunk of permuted p-values.
+
+        :param perm_pvalues: array-like, the permuted p-values (any shape).
+        :param perm_weights: array-like, the weight of every permuted
+                             p-value (same shape), default: 1.
+        """
+        perm_pvalues = np.asarray(perm_pvalues, dtype=np.float64).ravel()
+        mask = ~np.isnan(perm_pvalues)
+        if perm_weights is None:
+            perm_weights = np.ones(np.count_nonzero(mask))
+        else:
+            perm_weights = np.asarray(perm_weights,
+                                      dtype=np.float64).ravel()[mask]
+        perm_pvalues = perm_pvalues[mask]
+
+        # A permuted p-value counts for every real p-value from the first
+        # one that is >= to it onwards.
+        bins = np.searchsorted(self.sorted_pvalues, perm_pvalues, side="left")
+        minlength = len(self.counts)
+        self.counts += np.bincount(bins, minlength=minlength)
+        self.weights += np.bincount(bins, weights=perm_weights,
+                                    minlength=minlength)
+        self.n_perm_pvalues += len(perm_pvalues)
+
+    def get_n_perm_pvalues(self):
+        return self.n_perm_pvalues
+
+    def get_counts(self):
+        """
+        Method returning the number of permuted p-values <= every real
+        p-value; NaN p-values get a count of 0.
+
+        :return : ndarray, the counts (same shape as pvalues).
+        """
+        counts = np.zeros(self.pvalues.shape, dtype=np.int64)
+        positions = self.get_positions()
+        counts[self.mask] = np.cumsum(self.counts)[positions]
+        return counts
+
+    def get_fdr(self, n_perm=1):
+        """
+        Method for calculating the permutation FDR, see calc_perm_fdr.
+
+        :param n_perm: int, the number of permutations per test. Leave at
+                       1 if the added weights already are 1 / n_perm.
+        :return : ndarray, the FDR values (same shape as pvalues).
+        """
+        fdr = np.full(self.pvalues.shape, np.nan)
+        positions = self.get_positions()
+        expected = np.cumsum(self.weights)[positions] / n_perm
+        fdr[self.mask] = np.minimum(expected / (positions + 1), 1)
+        return fdr
+
+    def get_positions(self):
+        # Index of the last sorted real p-value <= every real p-value.
+        return count_less_equal(self.sorted_pvalues,
+                                self.pvalues[self.mask]) - 1
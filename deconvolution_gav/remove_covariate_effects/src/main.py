@@ -1,7 +1,7 @@
 """
 File:         main.py
 Created:      2020/10/14
-Last Changed: 2020/10/20
+Last Changed: 2020/10/30
 Author:       M.Vochteloo
 
 Copyright (C) 2020 M.Vochteloo
@@ -23,7 +23,6 @@ root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
 # Standard imports.
 from __future__ import print_function
 from pathlib import Path
-import gzip
 import os
 
 # Third party imports.
@@ -32,6 +31,7 @@ import statsmodels.api as sm
 
 # Local application imports.
 from utilities import check_file_exists, prepare_output_dir, load_dataframe, construct_dict_from_df
+from bgzf import BgzfWriter, open_lines
 
 
 class Main:
@@ -127,13 +127,14 @@ class Main:
     def work(self, covariates_df, order):
         print("Correcting data.")
         buffer = []
-        with gzip.open(self.matrix_inpath, 'rb') as f:
+        f_out = BgzfWriter(self.outpath, threads=None)
+        with open_lines(self.matrix_inpath) as f:
             for i, line in enumerate(f):
                 if (i == 0) or (i % self.print_interval == 0):
                     print("\tprocessed {} lines.".format(i))
 
                 if len(buffer) > self.write_interval:
-                    self.write_buffer(self.outpath, buffer)
+                    self.write_buffer(f_out, buffer)
                     buffer = []
 
                 splitted_line = np.array(line.decode().strip('\n').split('\t'))
@@ -151,7 +152,8 @@ class Main:
         f.close()
 
         if len(buffer) > 0:
-            self.write_buffer(self.outpath, buffer)
+            self.write_buffer(f_out, buffer)
+        f_out.close()
 
     @staticmethod
     def remove_covariates(y, X):
@@ -167,11 +169,9 @@ class Main:
         return [np.nan] * len(y)
 
     @staticmethod
-    def write_buffer(filename, buffer):
-        with gzip.open(filename, 'wb') as f:
-            for line in buffer:
-                f.write(line.encode())
-        f.close()
+    def write_buffer(f_out, buffer):
+        for line in buffer:
+            f_out.write(line + "\n")
 
     def print_arguments(self):
         print("Arguments:")
@@ -0,0 +1,222 @@
+"""
+File:         results_index.py
+Created:      2020/10/30
+Last Changed:
+Author:       M.Vochteloo
+
+Copyright (C) 2020 M.Vochteloo
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+A copy of the GNU General Public License can be found in the LICENSE file in the
+root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Standard imports.
+import shutil
+import json
+import os
+
+# Third party imports.
+import numpy as np
+import pandas as pd
+
+# Local application imports.
+from results_store import ResultsStore
+from utilities import load_dataframe
+
+# Lookup index of a results store by SNPName, ProbeName and HGNCName. The
+# index is stored in the 'index' directory of the store (so it is removed
+# when the store is rewritten) and holds per key type the sorted keys with
+# the eQTL index they belong to, plus the key of every eQTL in table order.
+# A lookup is a binary search on the (memory mapped) keys followed by a
+# binary search on the eqtl_index column of the store partitions.
+
+INDEX_VERSION = 1
+INDEX_FOLDER = "index"
+HEADER_FILENAME = "index.json"
+KEY_TYPES = ["SNPName", "ProbeName", "HGNCName"]
+
+
+def build_results_index(store_dir, eqtl_path=None):
+    """
+    Create the lookup index of a results store.
+
+    :param store_dir: string, the results store directory.
+    :param eqtl_path: string, the eQTL file (SNPName, ProbeName and
+                      HGNCName columns) the CIA was run on; the rows of the
+                      store eQTLs are selected by their CIA eQTL index. If
+                      None the SNPName and ProbeName are taken from the
+                      store eQTL names (SNPName_ProbeName).
+    :return : string, the index directory.
+    """
+    store = ResultsStore(store_dir)
+    eqtls = np.asarray(store.get_eqtls(), dtype=str)
+    n_eqtls = len(eqtls)
+
+    # eQTLs missing from the CIA output have no name and no keys.
+    present = np.flatnonzero(eqtls != "")
+
+    keys = {}
+    if eqtl_path is not None:
+        first = store.get_first_eqtl_index()
+        eqtl_df = load_dataframe(eqtl_path, header=0, index_col=None,
+                                 skiprows=range(1, first + 1),
+                                 nrows=n_eqtls)
+        if len(present) > 0 and eqtl_df.shape[0] <= present[-1]:
+            raise ValueError("eQTL file has {} rows, the results store ends "
+                             "at eQTL index {}".format(first + eqtl_df.shape[0],
+                                                       first + present[-1]))
+        for key_type in KEY_TYPES:
+            if key_type in eqtl_df.columns:
+                values = np.full(n_eqtls, "", dtype=object)
+                values[present] = eqtl_df[key_type].values[present]
+                keys[key_type] = values
+        if "SNPName" in keys:
+            mismatches = [i for i in present if not
+                          eqtls[i].startswith("{}_".format(keys["SNPName"][i]))]
+            if len(mismatches) > 0:
+                raise ValueError("eQTL file not in identical order as the "
+                                 "results store, first mismatch at eQTL "
+                                 "index {}".format(first + mismatches[0]))
+    else:
+        names = [eqtl.rsplit("_", 1) for eqtl in eqtls[present]]
+        if any(len(name) != 2 for name in names):
+            raise ValueError("Cannot split the eQTL names into SNPName and "
+                             "ProbeName, provide the eQTL file")
+        for i, key_type in enumerate(["SNPName", "ProbeName"]):
+            values = np.full(n_eqtls, "", dtype=object)
+            values[present] = [name[i] for name in names]
+            keys[key_type] = values
+
+    index_dir = os.path.join(store_dir, INDEX_FOLDER)
+    tmp_index_dir = index_dir + ".tmp"
+    if os.path.exists(tmp_index_dir):
+        shutil.rmtree(tmp_index_dir)
+    os.makedirs(tmp_index_dir)
+
+    for key_type, values in keys.items():
+        values = np.asarray(pd.Series(values).fillna("").astype(str).values,
+                            dtype=str)
+        present = np.flatnonzero(values != "")
+        order = present[np.argsort(values[present], kind="mergesort")]
+        np.save(os.path.join(tmp_index_dir, key_type + ".npy"), values,
+                allow_pickle=False)
+        np.save(os.path.join(tmp_index_dir, key_type + "_keys.npy"),
+                values[order], allow_pickle=False)
+        np.save(os.path.join(tmp_index_dir, key_type + "_eqtls.npy"),
+                order.astype(np.int64), allow_pickle=False)
+
+    header = {"version": INDEX_VERSION,
+              "n_eqtls": n_eqtls,
+              "eqtl_path": None if eqtl_path is None else os.path.abspath(eqtl_path),
+              "key_types": [key_type for key_type in KEY_TYPES if key_type in keys]}
+    with open(os.path.join(tmp_index_dir, HEADER_FILENAME), "w") as f:
+        json.dump(header, f, indent=2)
+    f.close()
+
+    if os.path.exists(index_dir):
+        shutil.rmtree(index_dir)
+    os.rename(tmp_index_dir, index_dir)
+
+    return index_dir
+
+
+class ResultsIndex:
+    def __init__(self, store_dir):
+        self.store = ResultsStore(store_dir)
+        self.index_dir = os.path.join(store_dir, INDEX_FOLDER)
+        header_path = os.path.join(self.index_dir, HEADER_FILENAME)
+        if not os.path.isfile(header_path):
+            raise ValueError("Results store {} has no lookup index, "
+                             "build it first".format(store_dir))
+        with open(header_path, "r") as f:
+            self.header = json.load(f)
+        f.close()
+
+        if self.header.get("version") != INDEX_VERSION:
+            raise ValueError("Unsupported results index version "
+                             "{}".format(self.header.get("version")))
+        if self.header["n_eqtls"] != len(self.store.get_eqtls()):
+            raise ValueError("Results index does not match the results "
+                             "store, rebuild it")
+
+        self.arrays = {}
+
+    def get_store(self):
+        return self.store
+
+    def get_key_types(self):
+        return self.header["key_types"]
+
+    def load_array(self, key_type, suffix=""):
+        name = key_type + suffix
+        if name not in self.arrays:
+            self.arrays[name] = np.load(os.path.join(self.index_dir, name + ".npy"),
+                                        mmap_mode="r", allow_pickle=False)
+        return self.arrays[name]
+
+    def find_eqtls(self, keys, key_type=None):
+        """
+        Method for finding the eQTL indices of a number of keys.
+
+        :param keys: list, the SNPNames, ProbeNames and / or HGNCNames.
+        :param key_type: string, the type of the keys, default: search all
+                         key types.
+        :return : ndarray, the (unique, sorted) eQTL indices.
+        """
+        if key_type is None:
+            key_types = self.get_key_types()
+        elif key_type in self.get_key_types():
+            key_types = [key_type]
+        else:
+            raise KeyError("Unknown key type: {}".format(key_type))
+
+        keys = np.asarray([str(key) for key in keys], dtype=str)
+        eqtl_indices = []
+        for key_type in key_types:
+            sorted_keys = self.load_array(key_type, "_keys")
+            sorted_eqtls = self.load_array(key_type, "_eqtls")
+            starts = np.searchsorted(sorted_keys, keys, side="left")
+            ends = np.searchsorted(sorted_keys, keys, side="right")
+            for start, end in zip(starts, ends):
+                if end > start:
+                    eqtl_indices.append(np.asarray(sorted_eqtls[start:end]))
+
+        if len(eqtl_indices) == 0:
+            return np.array([], dtype=np.int64)
+        return np.unique(np.concatenate(eqtl_indices))
+
+    def lookup(self, keys, key_type=None, columns=None):
+        """
+        Method for reading all covariate statistics of a number of keys.
+
+        :param keys: list, the SNPNames, ProbeNames and / or HGNCNames.
+        :param key_type: string, the type of the keys, default: search all
+                         key types.
+        :param columns: list, the store columns to read, default: all.
+        :return : DataFrame, one row per eQTL - covariate pair, annotated
+                  with the indexed keys of the eQTL.
+        """
+        if columns is None:
+            columns = self.store.get_columns()
+        read_columns = list(columns)
+        if "eqtl_index" not in read_columns:
+            read_columns.append("eqtl_index")
+
+        eqtl_indices = self.find_eqtls(keys, key_type=key_type)
+        df = self.store.read_eqtls(eqtl_indices, columns=read_columns)
+        positions = df["eqtl_index"].values
+        df = df.loc[:, list(columns)]
+        for i, key_type in enumerate(self.get_key_types()):
+            df.insert(i, key_type, self.load_array(key_type)[positions])
+
+        return df
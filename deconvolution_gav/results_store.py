@@ -0,0 +1,351 @@
+"""
+File:         results_store.py
+Created:      2020/10/30
+Last Changed:
+Author:       M.Vochteloo
+
+Copyright (C) 2020 M.Vochteloo
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+A copy of the GNU General Public License can be found in the LICENSE file in the
+root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Standard imports.
+import operator
+import shutil
+import json
+import os
+import re
+
+# Third party imports.
+import numpy as np
+import pandas as pd
+
+# Local application imports.
+from utilities import save_dataframe
+
+# Partitioned columnar store of the combined interaction results (one row
+# per eQTL - covariate pair). The store is a directory with a JSON header
+# and one sub directory per partition holding one .npy file per column, so
+# a query only reads (memory maps) the columns and partitions it needs.
+# The header keeps the minimum / maximum of every column per partition,
+# so filters can skip partitions without opening them. Within a partition
+# the rows are in table order (eQTL by eQTL), so the rows of an eQTL can be
+# found by a binary search on the eqtl_index column. The eqtl_index is the
+# position in the eQTL list of the header; the CIA eQTL index of a position
+# is first_eqtl_index + eqtl_index. eQTLs missing from the CIA output have
+# an empty name.
+
+STORE_VERSION = 1
+HEADER_FILENAME = "store.json"
+KEY_COLUMNS = ["covariate", "SNP", "covariate_index", "eqtl_index"]
+OPERATORS = {"==": operator.eq,
+             "!=": operator.ne,
+             "<": operator.lt,
+             "<=": operator.le,
+             ">": operator.gt,
+             ">=": operator.ge}
+
+
+def write_store(outdir, df, covariates, eqtls, partition_by="covariate",
+                eqtl_block_size=10000, first_eqtl_index=0):
+    """
+    Write a results store.
+
+    :param outdir: string, the store directory (replaced if it exists).
+    :param df: DataFrame, one row per eQTL - covariate pair with the
+               KEY_COLUMNS and any number of numeric value columns.
+    :param covariates: list, the covariate names in table order.
+    :param eqtls: list, the eQTL (SNP) names in table order.
+    :param partition_by: string, 'covariate' (one partition per covariate)
+                         or 'eqtl' (blocks of eqtl_block_size eQTLs).
+    :param eqtl_block_size: int, the number of eQTLs per partition.
+    :param first_eqtl_index: int, the CIA eQTL index of the first eQTL.
+    :return : string, the store directory.
+    """
+    if partition_by == "covariate":
+        keys = df["covariate_index"].values
+    elif partition_by == "eqtl":
+        keys = df["eqtl_index"].values // eqtl_block_size
+    else:
+        raise ValueError("Unknown partitioning: {}".format(partition_by))
+
+    tmp_outdir = outdir + ".tmp"
+    if os.path.exists(tmp_outdir):
+        shutil.rmtree(tmp_outdir)
+    os.makedirs(tmp_outdir)
+
+    columns = {}
+    for column in df.columns:
+        values = np.asarray(df[column])
+        if values.dtype == object:
+            values = values.astype(str)
+        columns[column] = values
+
+    partitions = []
+    order = np.lexsort((columns["covariate_index"], columns["eqtl_index"], keys))
+    unique_keys, starts = np.unique(keys[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+    for key, start, end in zip(unique_keys, starts, ends):
+        rows = order[start:end]
+        name = "part_{}".format(key)
+        os.makedirs(os.path.join(tmp_outdir, name))
+        stats = {}
+        for column, values in columns.items():
+            values = values[rows]
+            np.save(os.path.join(tmp_outdir, name, column + ".npy"), values,
+                    allow_pickle=False)
+            stats[column] = get_min_max(values)
+        partitions.append({"name": name,
+                           "n_rows": int(len(rows)),
+                           "stats": stats})
+
+    header = {"version": STORE_VERSION,
+              "partition_by": partition_by,
+              "eqtl_block_size": eqtl_block_size,
+              "first_eqtl_index": int(first_eqtl_index),
+              "covariates": list(covariates),
+              "eqtls": list(eqtls),
+              "columns": {column: values.dtype.str
+                          for column, values in columns.items()},
+              "partitions": partitions}
+    with open(os.path.join(tmp_outdir, HEADER_FILENAME), "w") as f:
+        json.dump(header, f, indent=2)
+    f.close()
+
+    if os.path.exists(outdir):
+        shutil.rmtree(outdir)
+    os.rename(tmp_outdir, outdir)
+
+    return outdir
+
+
+def get_min_max(values):
+    if values.dtype.kind in "fiu":
+        if values.dtype.kind == "f":
+            values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return None
+        return [values.min().item(), values.max().item()]
+    if len(values) == 0:
+        return None
+    values = np.sort(values)
+    return [str(values[0]), str(values[-1])]
+
+
+def parse_filter(text):
+    """
+    Parse a filter like 'perm-FDR<0.05' or 'covariate==CellMapNNLS_Neuron'
+    into a (column, operator, value) tuple.
+    """
+    match = re.match(r"^\s*(.+?)\s*(==|!=|<=|>=|<|>)\s*(.+?)\s*$", text)
+    if match is None:
+        raise ValueError("Invalid filter: {}".format(text))
+    column, op, value = match.groups()
+    try:
+        value = float(value)
+    except ValueError:
+        pass
+
+    return column, op, value
+
+
+class ResultsStore:
+    def __init__(self, indir):
+        self.indir = indir
+        with open(os.path.join(indir, HEADER_FILENAME), "r") as f:
+            self.header = json.load(f)
+        f.close()
+
+        if self.header.get("version") != STORE_VERSION:
+            raise ValueError("Unsupported results store version "
+                             "{}".format(self.header.get("version")))
+
+    def get_columns(self):
+        return list(self.header["columns"].keys())
+
+    def get_covariates(self):
+        return self.header["covariates"]
+
+    def get_eqtls(self):
+        return self.header["eqtls"]
+
+    def get_first_eqtl_index(self):
+        return self.header.get("first_eqtl_index", 0)
+
+    def get_partitions(self):
+        return [partition["name"] for partition in self.header["partitions"]]
+
+    def load_column(self, partition, column, mmap_mode="r"):
+        return np.load(os.path.join(self.indir, partition, column + ".npy"),
+                       mmap_mode=mmap_mode, allow_pickle=False)
+
+    @staticmethod
+    def may_match(stats, filters):
+        for column, op, value in filters:
+            if op == "in":
+                continue
+            min_max = stats.get(column)
+            if min_max is None:
+                return False
+            low, high = min_max
+            try:
+                if op == "==" and (value < low or value > high):
+                    return False
+                if op in ("<", "<=") and not OPERATORS[op](low, value):
+                    return False
+                if op in (">", ">=") and not OPERATORS[op](high, value):
+                    return False
+            except TypeError:
+                pass
+
+        return True
+
+    def read(self, columns=None, filters=None):
+        """
+        Method for reading (part of) the store.
+
+        :param columns: list, the columns to read, default: all.
+        :param filters: list, (column, operator, value) tuples that all
+                        have to hold; operator is one of ==, !=, <, <=, >,
+                        >= or 'in' (value is a list).
+        :return : DataFrame, the selected rows and columns.
+        """
+        if columns is None:
+            columns = self.get_columns()
+        if filters is None:
+            filters = []
+        for column in list(columns) + [f[0] for f in filters]:
+            if column not in self.header["columns"]:
+                raise KeyError("Unknown column: {}".format(column))
+
+        # The key indices are always read, to return the rows in table
+        # order (eQTL by eQTL).
+        read_columns = list(columns) + [column for column in ["eqtl_index", "covariate_index"]
+                                        if column not in columns]
+        data = {column: [] for column in read_columns}
+        for partition in self.header["partitions"]:
+            if not self.may_match(partition["stats"], filters):
+                continue
+
+            mask = np.ones(partition["n_rows"], dtype=bool)
+            for column, op, value in filters:
+                values = self.load_column(partition["name"], column)
+                if op == "in":
+                    mask &= np.isin(values, list(value))
+                else:
+                    mask &= OPERATORS[op](values, value)
+            if not np.any(mask):
+                continue
+
+            for column in read_columns:
+                data[column].append(self.load_column(partition["name"],
+                                                     column)[mask])
+
+        return self.create_df(data, columns)
+
+    def read_eqtls(self, eqtl_indices, columns=None):
+        """
+        Method for reading all rows of a number of eQTLs. Only the
+        partitions that may hold the eQTLs are opened and the rows are found
+        by a binary search, so this does not scale with the store size.
+
+        :param eqtl_indices: list, the eQTL indices.
+        :param columns: list, the columns to read, default: all.
+        :return : DataFrame, the rows of the eQTLs (all covariates).
+        """
+        if columns is None:
+            columns = self.get_columns()
+        for column in columns:
+            if column not in self.header["columns"]:
+                raise KeyError("Unknown column: {}".format(column))
+        eqtl_indices = np.unique(np.asarray(eqtl_indices, dtype=np.int64))
+
+        read_columns = list(columns) + [column for column in ["eqtl_index", "covariate_index"]
+                                        if column not in columns]
+        data = {column: [] for column in read_columns}
+        for partition in self.header["partitions"]:
+            min_max = partition["stats"].get("eqtl_index")
+            if min_max is None:
+                continue
+            selection = eqtl_indices[(eqtl_indices >= min_max[0]) &
+                                     (eqtl_indices <= min_max[1])]
+            if len(selection) == 0:
+                continue
+
+            values = self.load_column(partition["name"], "eqtl_index")
+            starts = np.searchsorted(values, selection, side="left")
+            ends = np.searchsorted(values, selection, side="right")
+            rows = [np.arange(start, end) for start, end in zip(starts, ends)
+                    if end > start]
+            if len(rows) == 0:
+                continue
+            rows = np.concatenate(rows)
+
+            for column in read_columns:
+                data[column].append(self.load_column(partition["name"],
+                                                     column)[rows])
+
+        return self.create_df(data, columns)
+
+    def create_df(self, data, columns):
+        data = {column: np.concatenate(values) if len(values) > 0
+                else np.array([], dtype=self.header["columns"][column])
+                for column, values in data.items()}
+        order = np.lexsort((data["covariate_index"], data["eqtl_index"]))
+        df = pd.DataFrame({column: data[column][order] for column in columns},
+                          columns=columns)
+
+        return df
+
+    def to_table(self, column):
+        """
+        Method for pivoting one column into the covariate x eQTL table.
+
+        :param column: string, the value column.
+        :return : DataFrame, covariates x eQTLs.
+        """
+        df = self.read(columns=["covariate_index", "eqtl_index", column])
+        covariates = self.get_covariates()
+        eqtls = self.get_eqtls()
+        values = np.full((len(covariates), len(eqtls)), np.nan)
+        values[df["covariate_index"].values, df["eqtl_index"].values] = df[column].values
+
+        table = pd.DataFrame(values, index=covariates, columns=eqtls)
+        table.index.name = "-"
+
+        return table
+
+    def to_molten(self):
+        """
+        Method for recreating the molten data frame layout of the
+        combiner; covariate and SNP names get their position as suffix.
+
+        :return : DataFrame, the molten data frame.
+        """
+        df = self.read()
+        df["covariate"] = ["{}_{}".format(name, index) for name, index in
+                           zip(df["covariate"], df["covariate_index"])]
+        df["SNP"] = ["{}_{}".format(name, index) for name, index in
+                     zip(df["SNP"], df["eqtl_index"])]
+        df.drop(["covariate_index", "eqtl_index"], axis=1, inplace=True)
+
+        return df
+
+    def export_table(self, column, outpath):
+        save_dataframe(df=self.to_table(column), outpath=outpath,
+                       header=True, index=True)
+
+    def export_molten(self, outpath):
+        save_dataframe(df=self.to_molten(), outpath=outpath,
+                       header=True, index=True)
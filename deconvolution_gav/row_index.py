@@ -0,0 +1,193 @@
+"""
+File:         row_index.py
+Created:      2020/10/29
+Last Changed:
+Author:       M.Vochteloo
+
+Copyright (C) 2020 M.Vochteloo
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+A copy of the GNU General Public License can be found in the LICENSE file in the
+root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Standard imports.
+import gzip
+import io
+import os
+
+# Third party imports.
+import numpy as np
+import pandas as pd
+
+# Local application imports.
+from bgzf import BgzfWriter, BgzfReader, is_bgzf
+from utilities import load_dataframe, get_column_dtypes
+
+# Row offset index of a matrix file. The index is stored next to the
+# matrix as <matrix>.ridx.npz and holds the (virtual) offset of the start of
+# every line, so a slice of rows can be read without decompressing and
+# parsing the rows before it. Only uncompressed and BGZF compressed files
+# can be indexed; regular gzip files can be converted with convert_to_bgzf.
+
+INDEX_SUFFIX = ".ridx.npz"
+INDEX_VERSION = 1
+
+
+def get_index_path(inpath):
+    return inpath + INDEX_SUFFIX
+
+
+def convert_to_bgzf(inpath, outpath=None):
+    """
+    Convert a (gzip compressed) text file to BGZF. The result is still a
+    valid gzip file. If no outpath is given the input file is replaced.
+    """
+    replace = outpath is None
+    if replace:
+        outpath = inpath + ".bgzf.tmp"
+
+    opener = gzip.open if inpath.endswith(".gz") else open
+    with opener(inpath, "rb") as f_in, BgzfWriter(outpath) as f_out:
+        while True:
+            chunk = f_in.read(1024 * 1024)
+            if not chunk:
+                break
+            f_out.write(chunk)
+    f_in.close()
+
+    if replace:
+        os.replace(outpath, inpath)
+        outpath = inpath
+
+    return outpath
+
+
+def build_row_index(inpath):
+    """
+    Create the row offset index of a matrix file.
+
+    :param inpath: string, the path of the matrix (uncompressed or BGZF).
+    :return : string, the path of the index.
+    """
+    if is_bgzf(inpath):
+        compression = "bgzf"
+        with BgzfReader(inpath) as f:
+            offsets = f.get_line_offsets()
+        f.close()
+    elif inpath.endswith(".gz"):
+        raise ValueError("Cannot index regular gzip file {}, convert it to "
+                         "BGZF first.".format(inpath))
+    else:
+        compression = "none"
+        offsets = [0]
+        position = 0
+        with open(inpath, "rb") as f:
+            while True:
+                chunk = f.read(1024 * 1024)
+                if not chunk:
+                    break
+                newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == 10)
+                offsets.extend((newlines + position + 1).tolist())
+                position += len(chunk)
+                last_byte = chunk[-1:]
+        f.close()
+
+        if position > 0 and last_byte != b"\n":
+            offsets.append(position)
+
+    stat = os.stat(inpath)
+    outpath = get_index_path(inpath)
+    np.savez(outpath,
+             version=np.array(INDEX_VERSION),
+             compression=np.array(compression),
+             size=np.array(stat.st_size, dtype=np.int64),
+             mtime=np.array(int(stat.st_mtime), dtype=np.int64),
+             offsets=np.array(offsets, dtype=np.int64))
+
+    return outpath
+
+
+def load_row_index(inpath):
+    """
+    Load the row offset index of a matrix file.
+
+    :param inpath: string, the path of the matrix.
+    :return : (compression, offsets) or None if there is no valid index.
+    """
+    index_path = get_index_path(inpath)
+    if not os.path.isfile(index_path):
+        return None
+
+    with np.load(index_path, allow_pickle=False) as index:
+        stat = os.stat(inpath)
+        if int(index["version"]) != INDEX_VERSION or \
+                int(index["size"]) != stat.st_size or \
+                int(index["mtime"]) != int(stat.st_mtime):
+            print("\tRow index of {} is outdated, "
+                  "ignoring it".format(os.path.basename(inpath)))
+            return None
+        compression = str(index["compression"])
+        offsets = index["offsets"]
+
+    return compression, offsets
+
+
+def read_rows(inpath, compression, offsets, skip_rows, n_rows=None):
+    """
+    Read the header line and a slice of the data lines of an indexed matrix.
+
+    :return : bytes, the header line followed by the selected lines.
+    """
+    n_lines = len(offsets) - 1
+    start = min(skip_rows + 1, n_lines)
+    end = n_lines if n_rows is None else min(start + n_rows, n_lines)
+
+    if compression == "bgzf":
+        with BgzfReader(inpath) as f:
+            header = f.readline()
+            f.seek(int(offsets[start]))
+            lines = f.readlines(end - start)
+        f.close()
+        return header + b"".join(lines)
+
+    with open(inpath, "rb") as f:
+        header = f.readline()
+        f.seek(int(offsets[start]))
+        content = f.read(int(offsets[end] - offsets[start]))
+    f.close()
+    return header + content
+
+
+def load_dataframe_rows(inpath, header, index_col, skip_rows=0, nrows=None,
+                        sep="\t", low_memory=True, dtype=None):
+    """
+    Load a slice of rows of a matrix. Uses the row offset index if there is
+    a valid one and falls back on load_dataframe otherwise.
+    """
+    index = load_row_index(inpath)
+    if index is None:
+        return load_dataframe(inpath, header=header, index_col=index_col,
+                              sep=sep, low_memory=low_memory, nrows=nrows,
+                              skiprows=range(1, skip_rows + 1), dtype=dtype)
+
+    compression, offsets = index
+    content = read_rows(inpath, compression, offsets, skip_rows, nrows)
+    df = pd.read_csv(io.BytesIO(content), sep=sep, header=header,
+                     index_col=index_col, low_memory=low_memory,
+                     dtype=get_column_dtypes(inpath, header=header,
+                                             index_col=index_col, sep=sep,
+                                             dtype=dtype))
+    print("\tLoaded dataframe: {} "
+          "with shape: {} (indexed)".format(os.path.basename(inpath),
+                                            df.shape))
+    return df
@@ -0,0 +1,106 @@
+"""
+File:         synthetic_data.py
+Created:      2020/10/30
+Last Changed:
+Author:       M.Vochteloo
+
+Copyright (C) 2020 M.Vochteloo
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+A copy of the GNU General Public License can be found in the LICENSE file in the
+root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Standard imports.
+import os
+
+# Third party imports.
+import numpy as np
+import pandas as pd
+
+# Local application imports.
+from utilities import save_dataframe
+
+# Generator of synthetic CIA input matrices. The genotypes are dosages
+# (0 - 2) with -1 for missing values, the covariates are cell fractions
+# that sum to one per sample and the expression is simulated from the
+# genotype, the technical covariates and a genotype x covariate
+# interaction, so every file has the layout of the matrix preparation
+# output.
+
+FILENAMES = {"genotype": "genotype_table.txt.gz",
+             "expression": "expression_table.txt.gz",
+             "technical_covariates": "technical_covariates_table.txt.gz",
+             "covariates": "covariates_table.txt.gz"}
+
+
+def generate_cia_data(outdir, n_eqtls, n_samples, n_tech_covs=4, n_covs=5,
+                      missing_rate=0.05, interaction_rate=0.1, seed=0):
+    """
+    Generate synthetic CIA input matrices.
+
+    :param outdir: string, the output directory.
+    :param n_eqtls: int, the number of eQTLs (genotype / expression rows).
+    :param n_samples: int, the number of samples.
+    :param n_tech_covs: int, the number of technical covariates.
+    :param n_covs: int, the number of covariates.
+    :param missing_rate: float, the mean fraction of missing genotypes; the
+                         rate of every eQTL is drawn between 0 and twice
+                         this value, so eQTLs differ in cost.
+    :param interaction_rate: float, the fraction of eQTLs with a genotype x
+                             covariate interaction effect.
+    :param seed: int, the random seed.
+    :return : dict, file type -> filename (see FILENAMES).
+    """
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    random_state = np.random.RandomState(seed)
+
+    samples = ["sample{}".format(i) for i in range(n_samples)]
+    snps = ["rs{}".format(i) for i in range(n_eqtls)]
+    probes = ["ENSG{:011d}".format(i) for i in range(n_eqtls)]
+    tech_covs_names = ["tech_cov{}".format(i) for i in range(n_tech_covs)]
+    covs_names = ["cell_type{}".format(i) for i in range(n_covs)]
+
+    maf = random_state.uniform(0.05, 0.5, size=(n_eqtls, 1))
+    genotype = random_state.binomial(2, maf, size=(n_eqtls, n_samples)).astype(np.float64)
+    tech_covs = random_state.normal(size=(n_tech_covs, n_samples))
+    covs = random_state.dirichlet(np.ones(n_covs), size=n_samples).T
+
+    eqtl_effect = random_state.normal(0, 0.5, size=(n_eqtls, 1))
+    tech_effect = random_state.normal(0, 0.3, size=(n_eqtls, n_tech_covs))
+    inter_effect = np.zeros((n_eqtls, 1))
+    inter_cov = random_state.randint(0, n_covs, size=n_eqtls)
+    has_inter = random_state.uniform(size=n_eqtls) < interaction_rate
+    inter_effect[has_inter, 0] = random_state.normal(0, 2, size=np.sum(has_inter))
+    expression = eqtl_effect * genotype + \
+        np.dot(tech_effect, tech_covs) + \
+        inter_effect * genotype * covs[inter_cov, :] + \
+        random_state.normal(size=(n_eqtls, n_samples))
+
+    eqtl_missing_rate = random_state.uniform(0, 2 * missing_rate, size=(n_eqtls, 1))
+    genotype[random_state.uniform(size=(n_eqtls, n_samples)) < eqtl_missing_rate] = -1
+
+    save_dataframe(df=pd.DataFrame(genotype, index=snps, columns=samples),
+                   outpath=os.path.join(outdir, FILENAMES["genotype"]),
+                   header=True, index=True)
+    save_dataframe(df=pd.DataFrame(expression, index=probes, columns=samples),
+                   outpath=os.path.join(outdir, FILENAMES["expression"]),
+                   header=True, index=True)
+    save_dataframe(df=pd.DataFrame(tech_covs, index=tech_covs_names, columns=samples),
+                   outpath=os.path.join(outdir, FILENAMES["technical_covariates"]),
+                   header=True, index=True)
+    save_dataframe(df=pd.DataFrame(covs, index=covs_names, columns=samples),
+                   outpath=os.path.join(outdir, FILENAMES["covariates"]),
+                   header=True, index=True)
+
+    return dict(FILENAMES)
@@ -0,0 +1,88 @@
+"""
+File:         test_results_index.py
+Created:      2020/10/30
+Last Changed:
+Author:       M.Vochteloo
+
+Copyright (C) 2020 M.Vochteloo
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+A copy of the GNU General Public License can be found in the LICENSE file in the
+root directory of this source tree. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Standard imports.
+import sys
+import os
+
+# Third party imports.
+import numpy as np
+import pandas as pd
+
+# Local application imports.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from results_store import write_store
+from results_index import ResultsIndex, build_results_index
+
+
+def create_store(store_dir):
+    """
+    A store of CIA eQTLs 3 to 6 where eQTL 4 is missing.
+    """
+    covariates = ["covA", "covB"]
+    eqtls = ["rs3_ENSG3", "", "rs5_ENSG5", "rs6_ENSG6"]
+    eqtl_indices = np.repeat(np.arange(len(eqtls)), len(covariates))
+    covariate_indices = np.tile(np.arange(len(covariates)), len(eqtls))
+    df = pd.DataFrame({"covariate": np.array(covariates)[covariate_indices],
+                       "SNP": np.array(eqtls)[eqtl_indices],
+                       "covariate_index": covariate_indices,
+                       "eqtl_index": eqtl_indices,
+                       "pvalue": np.arange(len(eqtl_indices)) / 10})
+    df = df.loc[df["SNP"] != "", :]
+    write_store(outdir=store_dir, df=df, covariates=covariates, eqtls=eqtls,
+                first_eqtl_index=3)
+
+
+def create_eqtl_file(eqtl_path):
+    pd.DataFrame({"SNPName": ["rs{}".format(i) for i in range(8)],
+                  "ProbeName": ["ENSG{}".format(i) for i in range(8)],
+                  "HGNCName": ["G{}".format(i) for i in range(8)]}
+                 ).to_csv(eqtl_path, sep="\t", index=False)
+
+
+def test_index_with_gap_from_names(tmp_path):
+    store_dir = str(tmp_path / "results_store")
+    create_store(store_dir)
+    build_results_index(store_dir)
+
+    index = ResultsIndex(store_dir)
+    assert index.get_key_types() == ["SNPName", "ProbeName"]
+    assert list(index.find_eqtls(["rs3", "ENSG5", "rs6"])) == [0, 2, 3]
+    assert len(index.find_eqtls([""])) == 0
+
+
+def test_index_with_gap_from_eqtl_file(tmp_path):
+    store_dir = str(tmp_path / "results_store")
+    eqtl_path = str(tmp_path / "eqtl.txt")
+    create_store(store_dir)
+    create_eqtl_file(eqtl_path)
+    build_results_index(store_dir, eqtl_path=eqtl_path)
+
+    index = ResultsIndex(store_dir)
+    assert index.get_key_types() == ["SNPName", "ProbeName", "HGNCName"]
+    assert list(index.find_eqtls(["G3", "G5", "G6"])) == [0, 2, 3]
+    assert len(index.find_eqtls(["G0", "G4", "G7"])) == 0
+
+    df = index.lookup(["G5"], columns=["pvalue"])
+    assert list(df["SNPName"]) == ["rs5", "rs5"]
+    assert list(df["HGNCName"]) == ["G5", "G5"]
+    assert np.allclose(df["pvalue"].values, [0.4, 0.5])
@@ -1,7 +1,7 @@
 """
 File:         utilities.py
 Created:      2020/10/08
-Last Changed: 2020/10/15
+Last Changed: 2020/10/30
 Author(s):    M.Vochteloo
 
 Copyright (C) 2020 M.Vochteloo
@@ -27,34 +27,68 @@ import os
 # Third party imports.
 
 # Local application imports.
+from parse_cache import get_parse_cache
+from bgzf import BgzfWriter
 
 
 def check_file_exists(file_path):
     return os.path.exists(file_path) and os.path.isfile(file_path)
 
 
+def get_column_dtypes(inpath, header, index_col, sep="\t", dtype=None):
+    """
+    Method for getting a read_csv dtype argument that parses the data
+    columns of a matrix as dtype and leaves the index column(s) as is.
+    """
+    if dtype is None:
+        return None
+    columns = pd.read_csv(inpath, sep=sep, header=header,
+                          index_col=index_col, nrows=0).columns
+    return {column: dtype for column in columns}
+
+
 def load_dataframe(inpath, header, index_col, sep="\t", low_memory=True,
-                   nrows=None, skiprows=None, logger=None):
-    df = pd.read_csv(inpath, sep=sep, header=header, index_col=index_col,
-                     low_memory=low_memory, nrows=nrows, skiprows=skiprows)
+                   nrows=None, skiprows=None, logger=None, dtype=None):
+    if dtype is not None:
+        dtype = get_column_dtypes(inpath, header=header, index_col=index_col,
+                                  sep=sep, dtype=dtype)
+
+    cache = get_parse_cache()
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.get_key(inpath, header=header, index_col=index_col,
+                                  sep=sep, low_memory=low_memory, nrows=nrows,
+                                  skiprows=skiprows, dtype=dtype)
+
+    df = None
+    if cache_key is not None:
+        df = cache.load(cache_key)
+    cached = df is not None
+    if df is None:
+        df = pd.read_csv(inpath, sep=sep, header=header, index_col=index_col,
+                         low_memory=low_memory, nrows=nrows, skiprows=skiprows,
+                         dtype=dtype)
+        if cache_key is not None:
+            cache.store(cache_key, df, inpath)
+
+    message = "\tLoaded dataframe: {} with shape: {}{}".format(
+        os.path.basename(inpath), df.shape, " (cached)" if cached else "")
     if logger is None:
-        print("\tLoaded dataframe: {} "
-                    "with shape: {}".format(os.path.basename(inpath),
-                                            df.shape))
+        print(message)
     else:
-        logger.info("\tLoaded dataframe: {} "
-                    "with shape: {}".format(os.path.basename(inpath),
-                                            df.shape))
+        logger.info(message)
     return df
 
 
-def save_dataframe(df, outpath, header, index, sep="\t", logger=None):
-    compression = 'infer'
+def save_dataframe(df, outpath, header, index, sep="\t", logger=None,
+                   threads=None):
     if outpath.endswith('.gz'):
-        compression = 'gzip'
-
-    df.to_csv(outpath, sep=sep, index=index, header=header,
-              compression=compression)
+        # BGZF: gzip compatible and compressed with multiple threads.
+        with BgzfWriter(outpath, threads=threads) as f:
+            df.to_csv(f, sep=sep, index=index, header=header)
+        f.close()
+    else:
+        df.to_csv(outpath, sep=sep, index=index, header=header)
     if logger is None:
         print("\tSaved dataframe: {} "
                     "with shape: {}".format(os.path.basename(outpath),